@@ -1,12 +1,31 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string, g, stream_with_context
 from flask_cors import CORS
 import os
+import math
 import uuid
 import re
 import logging
 from datetime import datetime
 import json
+import io
+import codecs
 import random
+import heapq
+import hashlib
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import queue
+import zlib
+import cProfile
+import pstats
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from array import array
+from itertools import accumulate, chain, islice
 
 # PDF and text processing
 try:
@@ -16,8 +35,13 @@ except ImportError:
     PDF_SUPPORT = False
     print("PyPDF2 not installed. PDF support disabled.")
 
-# Simple in-memory storage for documents
-documents = {}
+# Vectorized ranking
+try:
+    import numpy as np
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+    print("NumPy not installed. BM25 ranking disabled.")
 
 app = Flask(__name__)
 CORS(app)
@@ -28,34 +52,221 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # Largest request body, 16MB by default
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 1024 * 1024 * 1024))  # Largest file accepted through chunked uploads
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # Chunk size suggested to chunked upload clients
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))  # Seconds an idle chunked upload is kept before it is discarded
+RANKING_SCORER = os.environ.get('RANKING_SCORER', 'legacy')  # 'legacy' or 'bm25'
+PROXIMITY_BONUS = float(os.environ.get('PROXIMITY_BONUS', 0.5))  # Most the legacy scorer adds for question words close together or a quoted phrase, 0 disables
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.9))  # Word-triple similarity at which paragraphs are indexed once, 0 disables
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'documents.db')
+DOCUMENT_CACHE_BYTES = int(os.environ.get('DOCUMENT_CACHE_BYTES', 256 * 1024 * 1024))  # In-memory document budget
+DOCUMENT_TTL = int(os.environ.get('DOCUMENT_TTL', 0))  # Seconds until a document expires, 0 keeps documents forever
+SWEEP_INTERVAL = int(os.environ.get('SWEEP_INTERVAL', 300))  # Seconds between expiry and upload folder sweeps, 0 disables
+APPEND_CHAIN_LIMIT = int(os.environ.get('APPEND_CHAIN_LIMIT', 16))  # Appends stored as deltas before a document is rewritten in full, 0 always rewrites
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 1))  # Processes for PDF extraction and batch evaluation
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 50))  # Smaller PDFs are extracted in the request thread
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))  # Background threads processing asynchronous uploads
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 32))  # Pending asynchronous uploads before new ones are refused
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 3600))  # Seconds finished upload jobs remain visible in /status
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', 4096))  # Memoized answers kept in memory, 0 disables
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')  # Allow per-request profiling
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # Fraction of requests profiled to files when profiling is enabled
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')  # Where .prof files are written
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 1000))  # Newest .prof files kept in PROFILE_DIR, 0 keeps them all
+SUMMARY_MAX_WORDS = int(os.environ.get('SUMMARY_MAX_WORDS', 150))  # Length of the summary generated on upload
+SUMMARY_TIME_BUDGET_MS = int(os.environ.get('SUMMARY_TIME_BUDGET_MS', 250))  # Wall-clock budget for scoring summary sentences, 0 is unlimited
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['MAX_UPLOAD_BYTES'] = MAX_UPLOAD_BYTES
+app.config['UPLOAD_CHUNK_SIZE'] = UPLOAD_CHUNK_SIZE
+app.config['UPLOAD_SESSION_TTL'] = UPLOAD_SESSION_TTL
+app.config['RANKING_SCORER'] = RANKING_SCORER
+app.config['PROXIMITY_BONUS'] = PROXIMITY_BONUS
+app.config['NEAR_DUPLICATE_THRESHOLD'] = NEAR_DUPLICATE_THRESHOLD
+app.config['DATABASE_PATH'] = DATABASE_PATH
+app.config['DOCUMENT_CACHE_BYTES'] = DOCUMENT_CACHE_BYTES
+app.config['DOCUMENT_TTL'] = DOCUMENT_TTL
+app.config['SWEEP_INTERVAL'] = SWEEP_INTERVAL
+app.config['APPEND_CHAIN_LIMIT'] = APPEND_CHAIN_LIMIT
+app.config['WORKER_PROCESSES'] = WORKER_PROCESSES
+app.config['PDF_PARALLEL_MIN_PAGES'] = PDF_PARALLEL_MIN_PAGES
+app.config['INGEST_WORKERS'] = INGEST_WORKERS
+app.config['INGEST_QUEUE_SIZE'] = INGEST_QUEUE_SIZE
+app.config['JOB_RETENTION'] = JOB_RETENTION
+app.config['ANSWER_CACHE_SIZE'] = ANSWER_CACHE_SIZE
+app.config['PROFILING_ENABLED'] = PROFILING_ENABLED
+app.config['PROFILE_SAMPLE_RATE'] = PROFILE_SAMPLE_RATE
+app.config['PROFILE_DIR'] = PROFILE_DIR
+app.config['PROFILE_MAX_FILES'] = PROFILE_MAX_FILES
+app.config['SUMMARY_MAX_WORDS'] = SUMMARY_MAX_WORDS
+app.config['SUMMARY_TIME_BUDGET_MS'] = SUMMARY_TIME_BUDGET_MS
+
+# Process pool for PDF extraction and batch evaluation, created on first use
+process_pool = None
+process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    """Return the shared worker process pool"""
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(max_workers=app.config['WORKER_PROCESSES'])
+        return process_pool
+
+def extract_pdf_page_range(file_path, start, stop):
+    """Extract the text of pages [start, stop) of a PDF, run inside a worker process"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() for i in range(start, stop)]
+
+class TextSpans:
+    """Read-only sequence of paragraphs or sentences stored as array('I') offsets into one shared text"""
+    
+    __slots__ = ('text', 'starts', 'ends', 'join_lines')
+    
+    def __init__(self, text, starts, ends, join_lines=False):
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+        # Paragraph spans cover several lines that read as one space-joined paragraph
+        self.join_lines = join_lines
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def __getitem__(self, i):
+        span = self.text[self.starts[i]:self.ends[i]]
+        if self.join_lines:
+            return ' '.join(line.strip() for line in span.split('\n'))
+        return span
+    
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self[i]
+    
+    def __getstate__(self):
+        # The text is stored once next to the index and bound again on load
+        return self.starts, self.ends, self.join_lines
+    
+    def __setstate__(self, state):
+        self.starts, self.ends, self.join_lines = state
+        self.text = None
+
+class LayeredCounts:
+    """Counts held as a tuple of Counter layers, oldest first, so counting appended text copies a layer about its own
+    size instead of every count; the newest layers merge as they grow, like the levels of an LSM tree"""
+    
+    @staticmethod
+    def add(layers, counts):
+        """New layers with counts on top, merging the newest two while the older is at most twice the size"""
+        if not counts:
+            return tuple(layers)
+        layers = list(layers)
+        layers.append(counts)
+        while len(layers) > 1 and len(layers[-2]) <= 2 * len(layers[-1]):
+            merged = Counter(layers[-2])
+            merged.update(layers.pop())
+            layers[-1] = merged
+        return tuple(layers)
+    
+    @staticmethod
+    def merged(layers):
+        """All the counts in one Counter, keyed in the order a single pass would have counted them"""
+        if len(layers) == 1:
+            return layers[0]
+        merged = Counter()
+        for layer in layers:
+            merged.update(layer)
+        return merged
+    
+    @staticmethod
+    def total(layers, key):
+        """The count of key across the layers"""
+        return sum(layer.get(key, 0) for layer in layers)
 
 class DocumentProcessor:
     """Handles document processing and text extraction"""
     
+    # Bump whenever the index layout changes so stored indexes are rebuilt on load
+    INDEX_VERSION = 6
+    
+    SENTENCE_END = re.compile(r'[.!?]+')
+    
     @staticmethod
     def extract_text_from_pdf(file_path):
         """Extract text from PDF file"""
+        return DocumentProcessor.extract_pdf_pages(file_path)[0]
+    
+    @staticmethod
+    def extract_pdf_pages(file_path, progress=None):
+        """Extract text from PDF file, returning the text and the offset where each page starts"""
         if not PDF_SUPPORT:
             raise Exception("PDF support not available. Please install PyPDF2.")
         
-        text = ""
+        pages = []
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+            for number, page_text in DocumentProcessor.iter_pdf_pages(file_path):
+                pages.append(page_text)
+                if progress:
+                    progress(number)
         except Exception as e:
             logger.error(f"Error extracting PDF text: {e}")
             raise Exception(f"Failed to extract text from PDF: {str(e)}")
         
-        return text.strip()
+        # Pages are joined with newlines and the result stripped; blank pages at either end are dropped
+        # and the outer pages stripped in place first, so the text is only ever built once
+        lengths = [len(page_text) + 1 for page_text in pages]
+        filled = [i for i, page_text in enumerate(pages) if page_text and not page_text.isspace()]
+        if not filled:
+            return '', [0] * len(pages)
+        first, last = filled[0], filled[-1]
+        leading = sum(lengths[:first]) + len(pages[first]) - len(pages[first].lstrip())
+        pages[first] = pages[first].lstrip()
+        pages[last] = pages[last].rstrip()
+        text = "\n".join(pages[first:last + 1])
+        del pages
+        
+        page_offsets = []
+        offset = 0
+        for length in lengths:
+            page_offsets.append(max(offset - leading, 0))
+            offset += length
+        
+        return text, page_offsets
+    
+    @staticmethod
+    def iter_pdf_pages(file_path):
+        """Yield (page number, text) for each PDF page, fanning large PDFs out to a process pool"""
+        workers = app.config['WORKER_PROCESSES']
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            page_count = len(pdf_reader.pages)
+            # Small PDFs are read in this process, through the reader that counted their pages
+            if workers <= 1 or page_count < app.config['PDF_PARALLEL_MIN_PAGES']:
+                for number, page in enumerate(pdf_reader.pages, start=1):
+                    yield number, page.extract_text()
+                return
+        
+        pool = get_process_pool()
+        
+        # Several chunks per worker keeps every core busy when pages differ in cost
+        chunk_size = max(8, math.ceil(page_count / (workers * 4)))
+        futures = [pool.submit(extract_pdf_page_range, file_path, start, min(start + chunk_size, page_count))
+                   for start in range(0, page_count, chunk_size)]
+        try:
+            number = 1
+            for future in futures:
+                for page_text in future.result():
+                    yield number, page_text
+                    number += 1
+        finally:
+            for future in futures:
+                future.cancel()
     
     @staticmethod
     def extract_text_from_txt(file_path):
@@ -73,384 +284,3621 @@ class DocumentProcessor:
         
         return text.strip()
     
+    @staticmethod
+    def save_upload(file, file_path, chunk_size=65536):
+        """Stream an uploaded file to disk, returning its content hash"""
+        digest = DocumentProcessor.content_hasher(file_path)
+        with open(file_path, 'wb') as output:
+            for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                digest.update(chunk)
+                output.write(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def hash_file(file_path, chunk_size=65536):
+        """Content hash of a file already on disk"""
+        digest = DocumentProcessor.content_hasher(file_path)
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def content_hasher(file_path):
+        """SHA-256 hasher seeded with the file type"""
+        # The extension decides how the bytes are extracted, so it is part of the content identity
+        return hashlib.sha256(os.path.splitext(file_path)[1].lower().encode('utf-8') + b'\0')
+    
     @staticmethod
     def split_into_paragraphs(text):
         """Split text into paragraphs for better processing"""
-        paragraphs = []
-        current_paragraph = []
-        
-        for line in text.split('\n'):
-            line = line.strip()
-            if line:
-                current_paragraph.append(line)
-            else:
-                if current_paragraph:
-                    paragraphs.append(' '.join(current_paragraph))
-                    current_paragraph = []
-        
-        if current_paragraph:
-            paragraphs.append(' '.join(current_paragraph))
-        
-        return [p for p in paragraphs if len(p.strip()) > 20]  # Filter out very short paragraphs
-
-class TextAnalyzer:
-    """Handles text analysis and question answering"""
+        return DocumentProcessor.split_paragraph_spans(text)
     
     @staticmethod
-    def generate_summary(text, max_words=150):
-        """Generate a summary of the text"""
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-        
-        if not sentences:
-            return "Unable to generate summary from this document."
+    def split_paragraph_spans(text, start=0):
+        """Split text from start onwards into paragraphs kept as offsets into the text"""
+        starts = array('I')
+        ends = array('I')
+        end = offset = start
+        line_count = length = 0
         
-        # Simple extractive summarization - take first few sentences and some from middle
-        summary_sentences = []
-        total_words = 0
-        
-        # Add first sentence
-        if sentences:
-            summary_sentences.append(sentences[0])
-            total_words += len(sentences[0].split())
-        
-        # Add sentences from middle
-        middle_start = len(sentences) // 3
-        for i in range(middle_start, min(middle_start + 3, len(sentences))):
-            if total_words >= max_words:
-                break
-            sentence = sentences[i]
-            words_in_sentence = len(sentence.split())
-            if total_words + words_in_sentence <= max_words:
-                summary_sentences.append(sentence)
-                total_words += words_in_sentence
+        for line in text[start:].split('\n'):
+            stripped_length = len(line.strip())
+            if stripped_length:
+                if not line_count:
+                    start = offset
+                line_count += 1
+                length += stripped_length
+                end = offset + len(line)
+            elif line_count:
+                # Filter out very short paragraphs, measured as their space-joined lines
+                if length + line_count - 1 > 20:
+                    starts.append(start)
+                    ends.append(end)
+                line_count = length = 0
+            offset += len(line) + 1
         
-        summary = '. '.join(summary_sentences)
-        if not summary.endswith('.'):
-            summary += '.'
+        if line_count and length + line_count - 1 > 20:
+            starts.append(start)
+            ends.append(end)
         
-        return summary
+        return TextSpans(text, starts, ends, join_lines=True)
     
     @staticmethod
-    def find_relevant_context(text, question, max_contexts=3):
-        """Find relevant paragraphs for answering a question"""
-        paragraphs = DocumentProcessor.split_into_paragraphs(text)
+    def split_sentence_spans(text, min_length=20, start=0):
+        """Split text from start onwards into stripped sentences longer than min_length, kept as offsets into the text"""
+        starts = array('I')
+        ends = array('I')
         
-        # Extract meaningful words from question (excluding common stop words)
-        stopwords = {'what', 'who', 'when', 'where', 'why', 'how', 'is', 'are', 'was', 'were', 'do', 'does', 'did', 'can', 'could', 'should', 'would', 'will', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'this', 'that', 'these', 'those'}
+        def add(start, stop):
+            sentence = text[start:stop]
+            stripped = sentence.strip()
+            if len(stripped) > min_length:
+                leading = len(sentence) - len(sentence.lstrip())
+                starts.append(start + leading)
+                ends.append(start + leading + len(stripped))
         
-        question_words = set(re.findall(r'\b\w+\b', question.lower()))
-        meaningful_question_words = question_words - stopwords
-        
-        scored_paragraphs = []
-        for i, paragraph in enumerate(paragraphs):
-            paragraph_words = set(re.findall(r'\b\w+\b', paragraph.lower()))
-            
-            # Calculate word overlap score
-            word_overlap = len(meaningful_question_words.intersection(paragraph_words))
-            
-            # Calculate density score (percentage of question words found)
-            density_score = word_overlap / len(meaningful_question_words) if meaningful_question_words else 0
-            
-            # Bonus for longer paragraphs (more context)
-            length_bonus = min(len(paragraph.split()) / 100, 1.0)  # Cap at 1.0
-            
-            # Bonus for paragraphs with question-answering patterns
-            pattern_bonus = 0
-            paragraph_lower = paragraph.lower()
-            if any(pattern in paragraph_lower for pattern in ['because', 'due to', 'reason', 'caused by']):
-                pattern_bonus += 0.5
-            if any(pattern in paragraph_lower for pattern in ['result', 'conclusion', 'shows', 'indicates', 'demonstrates']):
-                pattern_bonus += 0.5
-            if any(pattern in paragraph_lower for pattern in ['define', 'definition', 'means', 'refers to']):
-                pattern_bonus += 0.5
-            
-            # Combined score
-            total_score = word_overlap + (density_score * 2) + length_bonus + pattern_bonus
-            
-            if total_score > 0:
-                scored_paragraphs.append((total_score, i, paragraph))
+        for match in DocumentProcessor.SENTENCE_END.finditer(text, start):
+            add(start, match.start())
+            start = match.end()
+        add(start, len(text))
         
-        # Sort by score and return top contexts
-        scored_paragraphs.sort(reverse=True)
-        return scored_paragraphs[:max_contexts]
+        return TextSpans(text, starts, ends)
     
     @staticmethod
-    def answer_question(text, question):
-        """Answer a question based on the document text"""
-        relevant_contexts = TextAnalyzer.find_relevant_context(text, question)
-        
-        if not relevant_contexts:
-            return {
-                'answer': "I couldn't find relevant information to answer this question in the document.",
-                'justification': "No relevant context found in the document for this question."
+    def bind_text(index, text):
+        """Attach a stored index's paragraph and sentence views to the document text"""
+        index['paragraphs'].text = text
+        index['sentences'].text = text
+        return index
+
+    @staticmethod
+    def build_index(text, page_offsets=None):
+        """Build a paragraph-level inverted index so questions don't re-tokenize the document"""
+        return DocumentProcessor.extend_index(None, text, 0, page_offsets)
+    
+    @staticmethod
+    def append_text(text, index, pieces):
+        """Append (text, page_offsets) pieces to a document as new paragraphs, returning its (text, index); pieces continue
+        the page numbering of paged documents, as one page each unless they have their own offsets"""
+        start = len(text) + 2
+        page_offsets = index['page_offsets'][:] if index.get('page_offsets') else None
+        parts = [text]
+        end = len(text)
+        for piece, piece_offsets in pieces:
+            if page_offsets is not None:
+                page_offsets.extend(end + 2 + offset for offset in piece_offsets or [0])
+            parts.append(piece)
+            end += 2 + len(piece)
+        text = '\n\n'.join(parts)
+        # The ranking matrix is rebuilt for the whole document, so it waits for the first search that needs it
+        return text, DocumentProcessor.extend_index(index, text, start, page_offsets, with_matrix=False)
+    
+    @staticmethod
+    def extend_index(index, text, start, page_offsets=None, with_matrix=True):
+        """Index text[start:] on top of the index of the text before it, returning a new index and leaving the old one untouched"""
+        if index is None:
+            index = {
+                'paragraphs': TextSpans(text, array('I'), array('I'), join_lines=True),
+                'sentences': TextSpans(text, array('I'), array('I')),
+                'postings': {},
+                'term_frequencies': {},
+                'positions': {},
+                'paragraph_lengths': array('I'),
+                'token_lengths': array('I'),
+                'pattern_flags': array('B'),
+                'pattern_bonuses': array('d'),
+                'static_order': array('I'),
+                'copies': {},
+                'band_keys': array('I'),
+                'paragraph_pages': None,
+                'term_totals': (),
+                'concepts': None
             }
         
-        # Combine the most relevant contexts
-        context_text = ' '.join([context[2] for context in relevant_contexts])
+        # Text before start keeps its paragraphs, so only the new ones are tokenized
+        added = DocumentProcessor.split_paragraph_spans(text, start)
+        first = len(index['paragraphs'])
+        paragraphs = TextSpans(text, index['paragraphs'].starts + added.starts, index['paragraphs'].ends + added.ends, join_lines=True)
         
-        # Generate answer based on context
-        answer = TextAnalyzer.generate_contextual_answer(context_text, question)
+        postings = {}
+        term_frequencies = {}
+        positions = {}
+        paragraph_lengths = index['paragraph_lengths'][:]
+        token_lengths = index['token_lengths'][:]
+        pattern_flags = index['pattern_flags'][:]
+        pattern_bonuses = index['pattern_bonuses'][:]
+        lowered = [paragraph.lower() for paragraph in added]
+        paragraph_tokens = [re.findall(r'\b\w+\b', paragraph_lower) for paragraph_lower in lowered]
         
-        # Ensure the answer is not just repeating the question
-        question_words = set(re.findall(r'\b\w+\b', question.lower()))
-        answer_words = set(re.findall(r'\b\w+\b', answer.lower()))
+        # Repeated headers, footers and boilerplate are indexed once, under their first occurrence
+        duplicates, band_keys = NearDuplicates.find(index, paragraphs, first, paragraph_tokens)
+        copies = dict(index['copies'])
+        for i, kept in duplicates.items():
+            copies[kept] = copies.get(kept, array('I')) + array('I', [i])
         
-        # If answer is too similar to question, try to get a different response
-        if len(question_words.intersection(answer_words)) / len(question_words) > 0.8:
-            # Try to get a different sentence from the context
-            sentences = re.split(r'[.!?]+', context_text)
-            sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
+        for i, (paragraph, paragraph_lower, tokens) in enumerate(zip(added, lowered, paragraph_tokens), start=first):
+            paragraph_lengths.append(len(paragraph.split()))
+            token_lengths.append(len(tokens))
+            flags = TextAnalyzer.pattern_flags(paragraph_lower)
+            pattern_flags.append(flags)
+            pattern_bonuses.append(TextAnalyzer.paragraph_pattern_bonus(flags))
+            if i in duplicates:
+                continue
             
-            for sentence in sentences:
-                sentence_words = set(re.findall(r'\b\w+\b', sentence.lower()))
-                if len(question_words.intersection(sentence_words)) / len(question_words) < 0.6:
-                    answer = sentence
-                    break
+            # Where each word occurs in the paragraph, for phrase and proximity scoring
+            word_positions = {}
+            for position, word in enumerate(tokens):
+                if word in word_positions:
+                    word_positions[word].append(position)
+                else:
+                    word_positions[word] = [position]
+            for word, occurrences in word_positions.items():
+                if word in postings:
+                    postings[word].append(i)
+                    term_frequencies[word].append(len(occurrences))
+                    positions[word].extend(occurrences)
+                else:
+                    postings[word] = [i]
+                    term_frequencies[word] = [len(occurrences)]
+                    positions[word] = occurrences
         
-        # Clean up the answer
-        answer = answer.strip()
-        if not answer.endswith('.'):
-            answer += '.'
+        # Order paragraphs by their question-independent score, used to rank
+        # paragraphs that share no words with the question
+        def static_score(i):
+            return min(paragraph_lengths[i] / 100, 1.0) + pattern_bonuses[i]
         
-        # Generate justification
-        justification = f"Based on the document content, particularly from "
-        if len(relevant_contexts) == 1:
-            justification += f"paragraph {relevant_contexts[0][1] + 1}"
+        added_order = sorted((i for i in range(first, len(paragraphs)) if i not in duplicates), key=lambda i: (static_score(i), i), reverse=True)
+        if first:
+            static_order = index['static_order'][:]
+            for i in added_order:
+                insort(static_order, i, key=lambda j: (-static_score(j), -j))
         else:
-            justification += f"paragraphs {relevant_contexts[0][1] + 1}"
-            if len(relevant_contexts) > 1:
-                justification += f" and {len(relevant_contexts) - 1} other related sections"
+            static_order = array('I', added_order)
         
-        # Add snippet of most relevant content
-        most_relevant_content = relevant_contexts[0][2][:150]
-        justification += f". The relevant content includes: \"{most_relevant_content}...\""
+        # Postings are keyed by shared token IDs so term strings are held once per process;
+        # terms the new paragraphs don't use keep sharing their arrays with the old index
+        token_ids = vocabulary.intern(postings)
+        term_totals = Counter({token_ids[term]: sum(frequencies) for term, frequencies in term_frequencies.items()})
+        merged_postings = dict(index['postings'])
+        merged_frequencies = dict(index['term_frequencies'])
+        merged_positions = dict(index['positions'])
+        for term, paragraph_ids in postings.items():
+            token_id = token_ids[term]
+            if token_id in merged_postings:
+                merged_postings[token_id] = merged_postings[token_id] + array('I', paragraph_ids)
+                merged_frequencies[token_id] = merged_frequencies[token_id] + array('I', term_frequencies[term])
+                merged_positions[token_id] = merged_positions[token_id] + array('I', positions[term])
+            else:
+                merged_postings[token_id] = array('I', paragraph_ids)
+                merged_frequencies[token_id] = array('I', term_frequencies[term])
+                merged_positions[token_id] = array('I', positions[term])
         
-        return {
-            'answer': answer,
-            'justification': justification
+        # The last sentence before start may run on into the new text, so sentences are re-split from the end of the last complete one
+        boundary = max(text.rfind(mark, 0, start) for mark in '.!?') + 1 if start else 0
+        kept = bisect_left(index['sentences'].starts, boundary)
+        replaced = TextSpans(text, index['sentences'].starts[kept:], index['sentences'].ends[kept:])
+        resplit = DocumentProcessor.split_sentence_spans(text, start=boundary)
+        sentences = TextSpans(text, index['sentences'].starts[:kept] + resplit.starts, index['sentences'].ends[:kept] + resplit.ends)
+        
+        # Page number of each paragraph, when the source has pages
+        paragraph_pages = None
+        if page_offsets:
+            paragraph_pages = index['paragraph_pages']
+            if paragraph_pages is None or len(paragraph_pages) != first:
+                paragraph_pages = array('I', (bisect_right(page_offsets, offset) for offset in index['paragraphs'].starts))
+            paragraph_pages = paragraph_pages + array('I', (bisect_right(page_offsets, offset) for offset in added.starts))
+        
+        index = {
+            'version': DocumentProcessor.INDEX_VERSION,
+            'paragraphs': paragraphs,
+            'sentences': sentences,
+            'postings': merged_postings,
+            'term_frequencies': merged_frequencies,
+            # Token positions of each term, paragraph after paragraph in postings order;
+            # term_frequencies says how many belong to each paragraph
+            'positions': merged_positions,
+            'paragraph_lengths': paragraph_lengths,
+            'token_lengths': token_lengths,
+            'pattern_flags': pattern_flags,
+            'pattern_bonuses': pattern_bonuses,
+            'static_order': static_order,
+            # Positions of the paragraphs collapsed into each indexed paragraph, which they nearly repeat
+            'copies': copies,
+            'band_keys': index['band_keys'] + band_keys,
+            'page_offsets': array('I', page_offsets) if page_offsets else None,
+            'paragraph_pages': paragraph_pages,
+            # Occurrences of each term in the indexed paragraphs, for the summary centroid
+            'term_totals': LayeredCounts.add(index['term_totals'], term_totals),
+            'concepts': TextAnalyzer.collect_concepts(text, start, resplit, index['concepts'], replaced)
         }
+        index['matrix'] = RankingEngine.build_matrix(index) if NUMPY_SUPPORT and with_matrix else None
+        return index
+
+class NearDuplicates:
+    """MinHash/LSH detection of near-identical paragraphs, such as repeated headers, footers and boilerplate"""
+    
+    # Signatures hold BANDS x ROWS minimum hashes; paragraphs agreeing on all rows of a band are compared,
+    # which catches 99% of pairs at 0.9 similarity and 3% at 0.5
+    BANDS = 8
+    ROWS = 8
+    # Odd multipliers and offsets of the 32-bit hash functions, fixed so signatures
+    # computed in another process or before an append still agree
+    HASH_MULTIPLIERS = tuple((0x9E3779B9 * (2 * k + 1)) % 2 ** 32 | 1 for k in range(BANDS * ROWS))
+    HASH_OFFSETS = tuple((0x85EBCA6B * (k + 1)) % 2 ** 32 for k in range(BANDS * ROWS))
+    # Paragraphs kept per band key and compared per new paragraph at most, bounding the work on
+    # text where many paragraphs look alike, such as tables of figures
+    MAX_CANDIDATES = 8
+    # Share of agreeing signature rows below the threshold at which a pair is still checked exactly,
+    # several standard deviations of the estimate
+    ESTIMATE_MARGIN = 0.15
+    
+    DIGITS = re.compile(r'\d')
     
     @staticmethod
-    def generate_contextual_answer(context, question):
-        """Generate an answer based on context and question"""
-        # Clean up context and question
-        context = context.strip()
-        question_lower = question.lower()
+    def shingles(tokens):
+        """Consecutive word triples, with digits blanked so page numbers and dates do not tell copies apart"""
+        normalized = {token: NearDuplicates.DIGITS.sub('0', token) for token in set(tokens)}
+        words = [normalized[token] for token in tokens]
+        return set(zip(words, words[1:], words[2:]))
+    
+    @staticmethod
+    def similarity(shingles, other):
+        """Jaccard similarity of two shingle sets"""
+        if not shingles or not other:
+            return 0.0
+        return len(shingles & other) / len(shingles | other)
+    
+    @staticmethod
+    def signatures(paragraph_tokens):
+        """Offsets of the paragraphs with at least one word triple, and their MinHash signatures as rows"""
+        # Stable word codes, so hashes match across processes
+        word_codes = {word: zlib.crc32(NearDuplicates.DIGITS.sub('0', word).encode('utf-8'))
+                      for word in set(chain.from_iterable(paragraph_tokens))}
+        lengths = [len(tokens) for tokens in paragraph_tokens]
+        codes = np.fromiter(map(word_codes.__getitem__, chain.from_iterable(paragraph_tokens)), dtype=np.uint64, count=sum(lengths))
+        owners = np.repeat(np.arange(len(paragraph_tokens)), lengths)
         
-        # Split context into sentences
-        sentences = re.split(r'[.!?]+', context)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
+        # Every word triple within one paragraph, mixed in 64 bits and kept to the top 32, grouped by paragraph
+        within = owners[:-2] == owners[2:]
+        shingles = (codes[:-2] * np.uint64(0x9E3779B97F4A7C15) + codes[1:-1] * np.uint64(0xC2B2AE3D27D4EB4F) + codes[2:])[within]
+        shingles ^= shingles >> np.uint64(33)
+        shingles *= np.uint64(0xFF51AFD7ED558CCD)
+        shingles = (shingles >> np.uint64(32)).astype(np.uint32)
+        counts = np.bincount(owners[:-2][within], minlength=len(paragraph_tokens))
+        signed = np.flatnonzero(counts)
+        signatures = np.empty((len(signed), NearDuplicates.BANDS * NearDuplicates.ROWS), dtype=np.uint32)
+        if not len(signed):
+            return signed, signatures
         
-        if not sentences:
-            return "The document contains relevant information but I cannot provide a specific answer."
+        starts = np.concatenate(([0], np.cumsum(counts[signed])[:-1]))
+        for k, (multiplier, offset) in enumerate(zip(NearDuplicates.HASH_MULTIPLIERS, NearDuplicates.HASH_OFFSETS)):
+            signatures[:, k] = np.minimum.reduceat(shingles * np.uint32(multiplier) + np.uint32(offset), starts)
+        return signed, signatures
+    
+    @staticmethod
+    def band_keys(signatures):
+        """One non-zero 32-bit key per band of each signature row; colliding keys only cost a comparison"""
+        rows = NearDuplicates.ROWS
+        keys = np.zeros((len(signatures), NearDuplicates.BANDS), dtype=np.uint32)
+        for band in range(NearDuplicates.BANDS):
+            for row in range(rows):
+                keys[:, band] = keys[:, band] * np.uint32(NearDuplicates.HASH_MULTIPLIERS[row]) + signatures[:, band * rows + row]
+        return keys | np.uint32(1)
+    
+    @staticmethod
+    def find(index, paragraphs, first, paragraph_tokens):
+        """Map each new paragraph, from position first on, that nearly repeats an earlier kept one to that paragraph's position;
+        also return the band keys of the new paragraphs, zero for collapsed ones and ones without word triples"""
+        band_keys = array('I', bytes(4 * NearDuplicates.BANDS * len(paragraph_tokens)))
+        threshold = app.config['NEAR_DUPLICATE_THRESHOLD']
+        if threshold <= 0 or not NUMPY_SUPPORT or not paragraph_tokens:
+            return {}, band_keys
         
-        # Extract key question words (excluding common question words)
-        question_stopwords = {'what', 'who', 'when', 'where', 'why', 'how', 'is', 'are', 'was', 'were', 'do', 'does', 'did', 'can', 'could', 'should', 'would', 'will', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
-        question_words = set(re.findall(r'\b\w+\b', question_lower))
-        meaningful_question_words = question_words - question_stopwords
+        signed, signatures = NearDuplicates.signatures(paragraph_tokens)
+        keys = NearDuplicates.band_keys(signatures)
+        new_keys = np.zeros((len(paragraph_tokens), NearDuplicates.BANDS), dtype=np.uint32)
+        new_keys[signed] = keys
+        old_keys = np.frombuffer(index['band_keys'], dtype=np.uint32).reshape(-1, NearDuplicates.BANDS)
         
-        # Score sentences based on relevance
-        scored_sentences = []
-        for sentence in sentences:
-            sentence_words = set(re.findall(r'\b\w+\b', sentence.lower()))
-            
-            # Calculate relevance score
-            word_overlap = len(meaningful_question_words.intersection(sentence_words))
-            
-            # Bonus for sentences that contain key question patterns
-            pattern_bonus = 0
-            if any(word in sentence.lower() for word in ['define', 'definition', 'means', 'refers to', 'is', 'are']):
-                pattern_bonus += 1
-            if any(word in sentence.lower() for word in ['because', 'due to', 'reason', 'caused by']):
-                pattern_bonus += 1
-            if any(word in sentence.lower() for word in ['result', 'conclusion', 'shows', 'indicates']):
-                pattern_bonus += 1
-            
-            total_score = word_overlap + pattern_bonus
-            
-            if total_score > 0:
-                scored_sentences.append((total_score, sentence))
+        # Only paragraphs sharing a band key with another one can be near-duplicates, and
+        # keys are nearly always unique, so the rest are settled without leaving NumPy
+        shared = np.zeros(len(signed), dtype=bool)
+        old_shared = np.zeros(len(old_keys), dtype=bool)
+        for band in range(NearDuplicates.BANDS):
+            values, counts = np.unique(np.concatenate((old_keys[:, band], keys[:, band])), return_counts=True)
+            repeated = values[(counts > 1) & (values != 0)]
+            shared |= np.isin(keys[:, band], repeated)
+            old_shared |= np.isin(old_keys[:, band], repeated)
         
-        # Sort by score and get the best answer
-        if scored_sentences:
-            scored_sentences.sort(reverse=True)
-            best_sentence = scored_sentences[0][1]
-            
-            # Try to improve the answer by combining related sentences
-            if len(scored_sentences) > 1:
-                # If the top sentences have similar scores, combine them
-                top_score = scored_sentences[0][0]
-                combined_answer = best_sentence
-                
-                for score, sentence in scored_sentences[1:3]:  # Check next 2 sentences
-                    if score >= top_score * 0.7:  # If score is within 70% of top score
-                        combined_answer += " " + sentence
-                
-                return combined_answer
-            else:
-                return best_sentence
+        buckets = [{} for _ in range(NearDuplicates.BANDS)]
+        def remember(j, row_keys):
+            for band, key in enumerate(row_keys):
+                bucket = buckets[band].setdefault(key, [])
+                if len(bucket) < NearDuplicates.MAX_CANDIDATES:
+                    bucket.append(j)
         
-        # If no good match found, try to find sentences that contain question keywords
-        for sentence in sentences:
-            sentence_lower = sentence.lower()
-            if any(word in sentence_lower for word in meaningful_question_words):
-                return sentence
+        # Collapsed paragraphs have all-zero keys and never share one, so only kept paragraphs are remembered
+        for j in np.flatnonzero(old_shared).tolist():
+            remember(j, old_keys[j].tolist())
         
-        # Last resort: return the first substantial sentence
-        return sentences[0] if sentences else "I cannot find relevant information in the document to answer this question."
+        shingle_sets = {}
+        def shingles_of(i):
+            if i not in shingle_sets:
+                tokens = paragraph_tokens[i - first] if i >= first else re.findall(r'\b\w+\b', paragraphs[i].lower())
+                shingle_sets[i] = NearDuplicates.shingles(tokens)
+            return shingle_sets[i]
+        
+        signature_rows = np.full(len(paragraph_tokens), -1)
+        signature_rows[signed] = np.arange(len(signed))
+        
+        duplicates = {}
+        for row in np.flatnonzero(shared).tolist():
+            i = first + int(signed[row])
+            row_keys = keys[row].tolist()
+            # Candidates share at least one band; new ones whose signatures disagree too often are
+            # dropped without tokens, and the exact similarity decides for the rest
+            candidates = list(dict.fromkeys(j for band, key in enumerate(row_keys) for j in buckets[band].get(key, ())))
+            candidates = candidates[:NearDuplicates.MAX_CANDIDATES]
+            new = [j for j in candidates if j >= first]
+            if new:
+                agreement = (signatures[signature_rows[np.array(new) - first]] == signatures[row]).mean(axis=1)
+                unlikely = {j for j, share in zip(new, agreement.tolist()) if share < threshold - NearDuplicates.ESTIMATE_MARGIN}
+                candidates = [j for j in candidates if j not in unlikely]
+            kept = next((j for j in candidates
+                         if NearDuplicates.similarity(shingles_of(i), shingles_of(j)) >= threshold), None)
+            if kept is not None:
+                duplicates[i] = kept
+                new_keys[i - first] = 0
+            else:
+                remember(i, row_keys)
+        return duplicates, array('I', new_keys.tobytes())
     
     @staticmethod
-    def extract_key_concepts(text):
-        """Extract key concepts, names, and important terms from the text"""
-        # Split into sentences and clean
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-        
-        # Find proper nouns (likely names, places, organizations)
-        proper_nouns = set()
-        for sentence in sentences:
-            words = re.findall(r'\b[A-Z][a-z]+\b', sentence)
-            proper_nouns.update(words)
+    def collapsed(index):
+        """Sorted positions of the paragraphs collapsed into another one"""
+        return sorted(chain.from_iterable(index['copies'].values()))
+    
+    @staticmethod
+    def distinct(texts):
+        """Positions of the texts that do not nearly repeat an earlier one"""
+        threshold = app.config['NEAR_DUPLICATE_THRESHOLD']
+        if threshold <= 0:
+            return list(range(len(texts)))
+        kept = []
+        kept_shingles = []
+        for n, text in enumerate(texts):
+            shingles = NearDuplicates.shingles(re.findall(r'\b\w+\b', text.lower()))
+            if any(NearDuplicates.similarity(shingles, other) >= threshold for other in kept_shingles):
+                continue
+            kept.append(n)
+            kept_shingles.append(shingles)
+        return kept
+    
+    @staticmethod
+    def distinct_contexts(relevant_contexts):
+        """Ranked (score, paragraph index, paragraph) contexts without those nearly repeating a better one"""
+        if len(relevant_contexts) < 2:
+            return relevant_contexts
+        return [relevant_contexts[n] for n in NearDuplicates.distinct([context[2] for context in relevant_contexts])]
+
+class Deadline:
+    """Wall-clock limit on a request's ranking work, remembering whether it cut any work short"""
+    
+    def __init__(self, seconds, started=None):
+        self.expires_at = (started if started is not None else time.perf_counter()) + seconds
+        self.reached = False
+    
+    def expired(self):
+        """Whether the time is up, recording that work stopped early"""
+        if not self.reached and time.perf_counter() >= self.expires_at:
+            self.reached = True
+        return self.reached
+
+class RankingEngine:
+    """Pluggable paragraph scorers used by find_relevant_context"""
+    
+    SCORERS = ('legacy', 'bm25')
+    
+    # Bump a scorer's version whenever its ranking changes so memoized answers are not reused
+    SCORER_VERSIONS = {'legacy': 4, 'bm25': 3}
+    
+    # BM25 parameters
+    BM25_K1 = 1.5
+    BM25_B = 0.75
+    
+    # Upper bound on query x paragraph cells scored at once by score_matrix
+    MATRIX_BATCH_CELLS = 4000000
+    
+    # Postings walked between deadline checks
+    DEADLINE_CHECK_POSTINGS = 4096
+    # Postings BM25 scores in one vectorized step between deadline checks
+    BM25_DEADLINE_BLOCK = 65536
+    # Margin for rounding when comparing score bounds with the top contexts' threshold
+    PRUNING_SLACK = 1e-9
+    # Postings walked in the time it takes to look a paragraph up in one postings list
+    PROBE_COST = 8
+    
+    @staticmethod
+    def score(index, question_words, max_contexts=3, scorer='legacy', deadline=None, phrases=()):
+        """Score paragraphs with the named scorer and return the top contexts;
+        both scorers stop at the deadline with the best contexts found so far"""
+        if scorer not in RankingEngine.SCORERS:
+            raise ValueError(f"Unknown scorer '{scorer}'. Available scorers: {', '.join(RankingEngine.SCORERS)}")
+        if scorer == 'legacy':
+            return RankingEngine.score_legacy(index, question_words, max_contexts, deadline, phrases)
+        return getattr(RankingEngine, f'score_{scorer}')(index, question_words, max_contexts, deadline)
+    
+    @staticmethod
+    def score_many(index, question_word_sets, max_contexts=3, scorer='legacy', phrase_sets=None):
+        """Score several questions, walking each distinct term's postings only once"""
+        if scorer not in RankingEngine.SCORERS:
+            raise ValueError(f"Unknown scorer '{scorer}'. Available scorers: {', '.join(RankingEngine.SCORERS)}")
+        if phrase_sets is None:
+            phrase_sets = [()] * len(question_word_sets)
+        if NUMPY_SUPPORT:
+            return RankingEngine.score_matrix(index, question_word_sets, max_contexts, scorer, phrase_sets)
+        if scorer != 'legacy':
+            return [RankingEngine.score(index, question_words, max_contexts, scorer) for question_words in question_word_sets]
         
-        # Find numbers and dates
-        numbers = re.findall(r'\b\d{4}\b|\b\d+\.\d+\b|\b\d+%\b', text)
+        term_questions = {}
+        for q, question_words in enumerate(question_word_sets):
+            for token_id in vocabulary.lookup(question_words).values():
+                term_questions.setdefault(token_id, []).append(q)
         
-        # Find quoted text
-        quotes = re.findall(r'"([^"]*)"', text)
+        overlaps = [{} for _ in question_word_sets]
+        for token_id, question_numbers in term_questions.items():
+            for i in index['postings'].get(token_id, ()):
+                for q in question_numbers:
+                    overlaps[q][i] = overlaps[q].get(i, 0) + 1
         
-        # Find technical terms (words that appear frequently and are longer)
-        words = re.findall(r'\b[a-zA-Z]{6,}\b', text.lower())
-        word_freq = {}
-        for word in words:
-            word_freq[word] = word_freq.get(word, 0) + 1
+        return [RankingEngine.rank_legacy(index, question_overlaps, len(question_words), max_contexts,
+                                          RankingEngine.proximity_query(index, vocabulary.lookup(question_words).values(), phrases))
+                for question_overlaps, question_words, phrases in zip(overlaps, question_word_sets, phrase_sets)]
+    
+    @staticmethod
+    def score_legacy(index, question_words, max_contexts=3, deadline=None, phrases=()):
+        """Hand-tuned overlap, density, length, pattern and proximity score, skipping postings of paragraphs that cannot reach the top contexts"""
+        # Count question words per paragraph using the postings lists, so only
+        # paragraphs containing at least one question word are visited. Rare terms
+        # go first: they are cheap to walk and quickly set the score to beat
+        postings = index['postings']
+        token_ids = vocabulary.lookup(question_words).values()
+        term_postings = sorted((postings[token_id] for token_id in token_ids if token_id in postings), key=len)
+        question_word_count = len(question_words)
+        remaining_postings = sum(len(paragraph_ids) for paragraph_ids in term_postings)
+        proximity = RankingEngine.proximity_query(index, token_ids, phrases)
+        bonus = app.config['PROXIMITY_BONUS'] if proximity is not None else 0.0
         
-        # Get most frequent longer words
-        technical_terms = [word for word, freq in sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:10]]
+        overlaps = {}
+        for position, paragraph_ids in enumerate(term_postings):
+            # Looking the remaining terms up for a few candidates beats walking long postings lists,
+            # and finding the candidates costs less than the walk once the remaining lists are long
+            remaining_terms = len(term_postings) - position
+            if max_contexts <= len(overlaps) < remaining_postings:
+                candidates = RankingEngine.legacy_candidates(index, overlaps, question_word_count, remaining_terms, max_contexts,
+                                                             remaining_postings, bonus)
+                if candidates is not None:
+                    overlaps = RankingEngine.probe_postings(candidates, term_postings[position:], deadline)
+                    # Paragraphs without any question word are ranked on their static score by rank_legacy
+                    overlaps = {i: word_overlap for i, word_overlap in overlaps.items() if word_overlap}
+                    break
+            
+            for start in range(0, len(paragraph_ids), RankingEngine.DEADLINE_CHECK_POSTINGS):
+                if deadline is not None and deadline.expired():
+                    return RankingEngine.rank_legacy(index, overlaps, question_word_count, max_contexts, proximity)
+                for i in paragraph_ids[start:start + RankingEngine.DEADLINE_CHECK_POSTINGS]:
+                    overlaps[i] = overlaps.get(i, 0) + 1
+            remaining_postings -= len(paragraph_ids)
         
-        return {
-            'proper_nouns': list(proper_nouns)[:15],
-            'numbers': numbers[:10],
-            'quotes': quotes[:5],
-            'technical_terms': technical_terms
-        }
+        return RankingEngine.rank_legacy(index, overlaps, question_word_count, max_contexts, proximity)
     
     @staticmethod
-    def generate_challenge_questions(text):
-        """Generate challenge questions from the document content"""
-        paragraphs = DocumentProcessor.split_into_paragraphs(text)
-        concepts = TextAnalyzer.extract_key_concepts(text)
+    def legacy_candidates(index, overlaps, question_word_count, remaining_terms, max_contexts, budget, bonus=0.0):
+        """Paragraphs that can still reach the top contexts once the remaining terms are counted (MaxScore),
+        or None when there are too many to look up within budget postings"""
+        # Every term adds the same overlap and density score, so a paragraph's bound is its static
+        # score plus that much per term it has or may still have, plus the most bonus it can earn
+        term_bound = 1 + 2 / question_word_count
+        static_scores = RankingEngine.static_scores(index)
+        threshold = heapq.nlargest(max_contexts, (word_overlap * term_bound + static_scores[i] for i, word_overlap in overlaps.items()))[-1]
+        minimum = threshold - remaining_terms * term_bound - bonus - RankingEngine.PRUNING_SLACK
         
-        questions = []
+        candidates = {i: word_overlap for i, word_overlap in overlaps.items() if word_overlap * term_bound + static_scores[i] >= minimum}
+        # Paragraphs none of the walked terms reached can still get there on length and patterns, best first in static order
+        for i in index['static_order']:
+            if static_scores[i] < minimum:
+                break
+            candidates.setdefault(i, 0)
+            if len(candidates) * remaining_terms * RankingEngine.PROBE_COST >= budget:
+                return None
+        return candidates
+    
+    @staticmethod
+    def probe_postings(candidates, term_postings, deadline=None):
+        """Add to each candidate's count the postings lists, sorted by paragraph, that contain it"""
+        for paragraph_ids in term_postings:
+            if deadline is not None and deadline.expired():
+                break
+            length = len(paragraph_ids)
+            for i in candidates:
+                position = bisect_left(paragraph_ids, i)
+                if position < length and paragraph_ids[position] == i:
+                    candidates[i] += 1
+        return candidates
+    
+    @staticmethod
+    def static_scores(index):
+        """Question-independent length and pattern part of each paragraph's legacy score, cached on the index"""
+        scores = index.get('static_scores')
+        if scores is None:
+            scores = documents.keep_on_index(index, 'static_scores', array('d', (min(length / 100, 1.0) + bonus
+                                                                                 for length, bonus in zip(index['paragraph_lengths'], index['pattern_bonuses']))))
+        return scores
+    
+    @staticmethod
+    def rank_legacy(index, overlaps, question_word_count, max_contexts=3, proximity=None):
+        """Rank paragraphs from their question word overlap counts, adding the proximity bonus for a proximity_query"""
+        paragraphs = index['paragraphs']
+        paragraph_lengths = index['paragraph_lengths']
+        pattern_bonuses = index['pattern_bonuses']
         
-        # If document is too short, generate basic questions
-        if len(paragraphs) < 2:
-            return [
-                "What is the main topic discussed in this document?",
-                "What are the key points mentioned in the text?",
-                "What conclusions can be drawn from this document?"
-            ]
+        scored_paragraphs = []
+        for i, word_overlap in overlaps.items():
+            # Calculate density score (percentage of question words found)
+            density_score = word_overlap / question_word_count
+            
+            # Bonus for longer paragraphs (more context)
+            length_bonus = min(paragraph_lengths[i] / 100, 1.0)  # Cap at 1.0
+            
+            # Combined score
+            total_score = word_overlap + (density_score * 2) + length_bonus + pattern_bonuses[i]
+            scored_paragraphs.append((total_score, i))
         
-        # Generate questions based on proper nouns (names, places, organizations)
-        if concepts['proper_nouns']:
-            selected_nouns = random.sample(concepts['proper_nouns'], min(3, len(concepts['proper_nouns'])))
-            for noun in selected_nouns:
-                questions.append(f"What role does {noun} play in the document?")
-                questions.append(f"What information is provided about {noun}?")
+        # Paragraphs without any question word can still rank on length and
+        # patterns alone; only the best few of them can make the cut
+        remaining = max_contexts
+        for i in index['static_order']:
+            if remaining <= 0:
+                break
+            if i in overlaps:
+                continue
+            total_score = min(paragraph_lengths[i] / 100, 1.0) + pattern_bonuses[i]
+            if total_score <= 0:
+                break
+            scored_paragraphs.append((total_score, i))
+            remaining -= 1
         
-        # Generate questions based on numbers and dates
-        if concepts['numbers']:
-            selected_numbers = random.sample(concepts['numbers'], min(2, len(concepts['numbers'])))
-            for number in selected_numbers:
-                questions.append(f"What is the significance of {number} mentioned in the document?")
+        # Read only the top contexts' text
+        return [(total_score, i, paragraphs[i]) for total_score, i in RankingEngine.select_top(index, scored_paragraphs, max_contexts, proximity)]
+    
+    @staticmethod
+    def select_top(index, scored_paragraphs, max_contexts, proximity=None):
+        """Top (score, paragraph index) pairs, adding the proximity bonus to paragraphs that can still reach them with it"""
+        # Select the top contexts with a heap instead of sorting every paragraph
+        top = heapq.nlargest(max_contexts, scored_paragraphs)
+        if proximity is None:
+            return top
+        
+        # The bonus is at most PROXIMITY_BONUS, so paragraphs further than that behind the last place stay out
+        if len(top) == max_contexts:
+            cutoff = top[-1][0] - app.config['PROXIMITY_BONUS'] - RankingEngine.PRUNING_SLACK
+            top = [item for item in scored_paragraphs if item[0] >= cutoff]
+        return RankingEngine.add_proximity(index, sorted(top, reverse=True), max_contexts, proximity)
+    
+    @staticmethod
+    def add_proximity(index, ranked_paragraphs, max_contexts, proximity):
+        """Top (score, paragraph index) pairs once each paragraph's proximity bonus is added,
+        from (score, paragraph index) pairs in descending order"""
+        weight = app.config['PROXIMITY_BONUS']
+        best = []
+        for total_score, i in ranked_paragraphs:
+            # Later paragraphs cannot catch up with the last place even with the whole bonus
+            if len(best) == max_contexts and total_score + weight + RankingEngine.PRUNING_SLACK < best[0][0]:
+                break
+            item = (total_score + weight * RankingEngine.proximity(index, i, *proximity), i)
+            if len(best) < max_contexts:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+        return sorted(best, reverse=True)
+    
+    @staticmethod
+    def proximity_query(index, token_ids, phrases):
+        """Question term token IDs and quoted phrases as token ID tuples for the proximity bonus, or None when no paragraph can earn it"""
+        if app.config['PROXIMITY_BONUS'] <= 0:
+            return None
+        postings = index['postings']
+        token_ids = tuple(token_id for token_id in token_ids if token_id in postings)
+        phrase_ids = []
+        for phrase in phrases:
+            phrase_tokens = vocabulary.lookup(phrase)
+            # Phrases with a word the document has never seen cannot occur in it
+            if all(phrase_tokens.get(word) in postings for word in phrase):
+                phrase_ids.append(tuple(phrase_tokens[word] for word in phrase))
+        if len(token_ids) < 2 and not phrase_ids:
+            return None
+        return token_ids, tuple(phrase_ids)
+    
+    @staticmethod
+    def proximity(index, i, token_ids, phrases):
+        """Share of the proximity bonus paragraph i earns: all of it for holding a quoted phrase, otherwise
+        (n - 1) / (span - 1) for the shortest span of tokens holding the n question terms it has, so adjacent terms earn all of it"""
+        if any(RankingEngine.phrase_positions(index, i, phrase) for phrase in phrases):
+            return 1.0
+        term_positions = [positions for positions in (RankingEngine.term_positions(index, token_id, i) for token_id in token_ids) if positions]
+        if len(term_positions) < 2:
+            return 0.0
+        return (len(term_positions) - 1) / (RankingEngine.shortest_span(term_positions) - 1)
+    
+    @staticmethod
+    def shortest_span(position_lists):
+        """Fewest consecutive tokens covering a position from every sorted list"""
+        merged = sorted((position, n) for n, positions in enumerate(position_lists) for position in positions)
+        counts = [0] * len(position_lists)
+        missing = len(position_lists)
+        shortest = None
+        left = 0
+        for position, n in merged:
+            if not counts[n]:
+                missing -= 1
+            counts[n] += 1
+            # Shrink the window from the left for as long as it still covers every list
+            while not missing:
+                first, m = merged[left]
+                if shortest is None or position - first < shortest:
+                    shortest = position - first
+                counts[m] -= 1
+                if not counts[m]:
+                    missing += 1
+                left += 1
+        return shortest + 1
+    
+    @staticmethod
+    def phrase_positions(index, i, phrase):
+        """Token positions where a phrase, given as token IDs, starts in paragraph i"""
+        starts = RankingEngine.term_positions(index, phrase[0], i)
+        for offset, token_id in enumerate(phrase[1:], start=1):
+            if not starts:
+                break
+            following = set(RankingEngine.term_positions(index, token_id, i))
+            starts = [start for start in starts if start + offset in following]
+        return list(starts)
+    
+    @staticmethod
+    def term_positions(index, token_id, i):
+        """Token positions of a term in paragraph i, empty when the paragraph does not contain it"""
+        paragraph_ids = index['postings'].get(token_id)
+        if paragraph_ids is None:
+            return ()
+        j = bisect_left(paragraph_ids, i)
+        if j == len(paragraph_ids) or paragraph_ids[j] != i:
+            return ()
+        offsets = RankingEngine.position_offsets(index, token_id)
+        return index['positions'][token_id][offsets[j]:offsets[j + 1]]
+    
+    @staticmethod
+    def position_offsets(index, token_id):
+        """Where each paragraph's run of a term's positions starts, cached on the index"""
+        cache = index.get('position_offsets')
+        if cache is None:
+            cache = documents.keep_on_index(index, 'position_offsets', {})
+        offsets = cache.get(token_id)
+        if offsets is None:
+            offsets = cache[token_id] = array('I', accumulate(index['term_frequencies'][token_id], initial=0))
+            documents.charge(index, 16 + DocumentStore.approximate_size(offsets))
+        return offsets
+    
+    @staticmethod
+    def build_matrix(index):
+        """Build a sparse term x paragraph frequency matrix (CSR layout) for BM25"""
+        postings = index['postings']
+        term_rows = {token_id: row for row, token_id in enumerate(postings)}
+        
+        document_frequencies = np.fromiter((len(paragraph_ids) for paragraph_ids in postings.values()), dtype=np.int64, count=len(postings))
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum(document_frequencies, out=indptr[1:])
+        
+        lengths = np.array(index['token_lengths'], dtype=np.float64)
+        # Collapsed copies are left out of the paragraph statistics, as they are out of the postings
+        collapsed = np.array(NearDuplicates.collapsed(index), dtype=np.int64)
+        paragraph_count = len(index['paragraphs']) - len(collapsed)
+        indexed = np.ones(len(lengths), dtype=bool)
+        indexed[collapsed] = False
+        
+        return {
+            'vocabulary': term_rows,
+            'indptr': indptr,
+            # Postings are uint32 arrays, so their buffers concatenate straight into the CSR arrays
+            'indices': np.frombuffer(b''.join(postings.values()), dtype=np.uint32).astype(np.int32),
+            # Term counts stay integers; BM25 arithmetic promotes them to float64 when gathered
+            'data': np.frombuffer(b''.join(index['term_frequencies'].values()), dtype=np.uint32),
+            'idf': np.log(1 + (paragraph_count - document_frequencies + 0.5) / (document_frequencies + 0.5)),
+            'paragraph_lengths': lengths,
+            'average_length': lengths[indexed].mean() if paragraph_count else 0.0,
+            'collapsed': collapsed
+        }
+    
+    @staticmethod
+    def score_bm25(index, question_words, max_contexts=3, deadline=None):
+        """Okapi BM25 over the term x paragraph matrix in a single vectorized pass, or in blocks of postings
+        between deadline checks when there is a deadline"""
+        if not NUMPY_SUPPORT:
+            raise Exception("BM25 ranking not available. Please install numpy.")
+        
+        matrix = RankingEngine.get_matrix(index)
+        paragraphs = index['paragraphs']
+        rows = np.array([matrix['vocabulary'][token_id] for token_id in vocabulary.lookup(question_words).values() if token_id in matrix['vocabulary']], dtype=np.int64)
+        if not len(rows) or not paragraphs:
+            return []
+        
+        if deadline is not None:
+            # A term's postings are contiguous and hold each paragraph once, so adding them a block at a
+            # time, in the same term order, sums every paragraph's score exactly as the single pass does
+            scores = np.zeros(len(paragraphs))
+            indptr = matrix['indptr']
+            for row in rows:
+                for start in range(indptr[row], indptr[row + 1], RankingEngine.BM25_DEADLINE_BLOCK):
+                    if deadline.expired():
+                        return RankingEngine.top_contexts(scores, paragraphs, max_contexts)
+                    positions = np.arange(start, min(start + RankingEngine.BM25_DEADLINE_BLOCK, indptr[row + 1]))
+                    paragraph_ids = matrix['indices'][positions]
+                    scores[paragraph_ids] += RankingEngine.bm25_contributions(matrix, row[None], np.array([len(positions)]), positions, paragraph_ids)
+            return RankingEngine.top_contexts(scores, paragraphs, max_contexts)
+        
+        positions, counts = RankingEngine.postings_positions(matrix, rows)
+        paragraph_ids = matrix['indices'][positions]
+        contributions = RankingEngine.bm25_contributions(matrix, rows, counts, positions, paragraph_ids)
+        scores = np.bincount(paragraph_ids, weights=contributions, minlength=len(paragraphs))
+        return RankingEngine.top_contexts(scores, paragraphs, max_contexts)
+    
+    @staticmethod
+    def score_matrix(index, question_word_sets, max_contexts=3, scorer='legacy', phrase_sets=None):
+        """Score several questions together as one query x paragraph matrix"""
+        matrix = RankingEngine.get_matrix(index)
+        paragraphs = index['paragraphs']
+        paragraph_count = len(paragraphs)
+        if not paragraph_count:
+            return [[] for _ in question_word_sets]
+        
+        if scorer == 'legacy':
+            length_bonuses = np.minimum(np.array(index['paragraph_lengths'], dtype=np.float64) / 100, 1.0)
+            pattern_bonuses = np.array(index['pattern_bonuses'], dtype=np.float64)
+            # Collapsed copies score nothing, so they are never picked on length and patterns alone
+            length_bonuses[matrix['collapsed']] = 0.0
+            pattern_bonuses[matrix['collapsed']] = 0.0
+        
+        results = []
+        batch_size = max(1, RankingEngine.MATRIX_BATCH_CELLS // paragraph_count)
+        for start in range(0, len(question_word_sets), batch_size):
+            batch = question_word_sets[start:start + batch_size]
+            
+            # One row per (question, term) pair, remembering which question it belongs to
+            question_rows = [[matrix['vocabulary'][token_id] for token_id in vocabulary.lookup(question_words).values() if token_id in matrix['vocabulary']]
+                             for question_words in batch]
+            rows = np.fromiter(chain.from_iterable(question_rows), dtype=np.int64)
+            owners = np.repeat(np.arange(len(batch)), [len(question_row) for question_row in question_rows])
+            
+            positions, counts = RankingEngine.postings_positions(matrix, rows)
+            paragraph_ids = matrix['indices'][positions]
+            cells = np.repeat(owners, counts) * paragraph_count + paragraph_ids
+            
+            if scorer == 'bm25':
+                contributions = RankingEngine.bm25_contributions(matrix, rows, counts, positions, paragraph_ids)
+                scores = np.bincount(cells, weights=contributions, minlength=len(batch) * paragraph_count).reshape(len(batch), paragraph_count)
+            else:
+                # Same arithmetic, in the same order, as rank_legacy
+                overlaps = np.bincount(cells, minlength=len(batch) * paragraph_count).reshape(len(batch), paragraph_count).astype(np.float64)
+                word_counts = np.array([max(len(question_words), 1) for question_words in batch], dtype=np.float64)[:, None]
+                scores = overlaps + (overlaps / word_counts) * 2 + length_bonuses + pattern_bonuses
+            
+            if scorer == 'bm25':
+                results.extend(RankingEngine.top_contexts(row, paragraphs, max_contexts) for row in scores)
+            else:
+                phrases = phrase_sets[start:start + batch_size] if phrase_sets is not None else [()] * len(batch)
+                results.extend(RankingEngine.top_contexts(row, paragraphs, max_contexts, index,
+                                                          RankingEngine.proximity_query(index, vocabulary.lookup(question_words).values(), question_phrases))
+                               for row, question_words, question_phrases in zip(scores, batch, phrases))
+        return results
+    
+    @staticmethod
+    def get_matrix(index):
+        """Return the index's term x paragraph matrix, building it if needed"""
+        matrix = index.get('matrix')
+        if matrix is None:
+            matrix = documents.keep_on_index(index, 'matrix', RankingEngine.build_matrix(index))
+        return matrix
+    
+    @staticmethod
+    def postings_positions(matrix, rows):
+        """Flat positions in the CSR arrays of every posting of the given term rows"""
+        indptr = matrix['indptr']
+        starts = indptr[rows]
+        counts = indptr[rows + 1] - starts
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return positions, counts
+    
+    @staticmethod
+    def bm25_contributions(matrix, rows, counts, positions, paragraph_ids):
+        """BM25 weight of each gathered posting"""
+        term_frequencies = matrix['data'][positions]
+        idf = np.repeat(matrix['idf'][rows], counts)
+        
+        k1, b = RankingEngine.BM25_K1, RankingEngine.BM25_B
+        lengths = matrix['paragraph_lengths'][paragraph_ids]
+        norm = k1 * (1 - b + b * lengths / (matrix['average_length'] or 1.0))
+        return idf * term_frequencies * (k1 + 1) / (term_frequencies + norm)
+    
+    @staticmethod
+    def top_contexts(scores, paragraphs, max_contexts, index=None, proximity=None):
+        """Top (score, paragraph index, paragraph) contexts from a vector of paragraph scores,
+        adding the legacy proximity bonus for a proximity_query"""
+        # Select without sorting every paragraph, keeping paragraphs tied with
+        # the last place so ties break like the legacy scorer
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > max_contexts:
+            cutoff = -np.partition(-scores[candidates], max_contexts - 1)[max_contexts - 1]
+            if proximity is not None:
+                # Paragraphs the bonus can still lift into the top stay candidates
+                cutoff -= app.config['PROXIMITY_BONUS'] + RankingEngine.PRUNING_SLACK
+            candidates = candidates[scores[candidates] >= cutoff]
+        
+        if proximity is not None:
+            # Best first, higher paragraph indexes first among ties, converted only as far as add_proximity reads
+            ranked = candidates[np.lexsort((candidates, scores[candidates]))[::-1]]
+            scored_paragraphs = RankingEngine.add_proximity(index, ((float(scores[i]), int(i)) for i in ranked), max_contexts, proximity)
+        else:
+            scored_paragraphs = sorted(((float(scores[i]), int(i)) for i in candidates), reverse=True)[:max_contexts]
+        return [(score, i, paragraphs[i]) for score, i in scored_paragraphs]
+
+class Summarizer:
+    """Extractive summaries built from the sentences closest to the document's TF-IDF centroid"""
+    
+    # Heaviest terms kept in the centroid
+    CENTROID_TERMS = 100
+    # Paragraphs nearest the centroid whose sentences are scored
+    CANDIDATE_PARAGRAPHS = 32
+    # Sentences sharing more than this fraction of words with a chosen sentence are skipped
+    REDUNDANCY = 0.5
+    
+    @staticmethod
+    def get_ranking(index, time_budget=None):
+        """Return the index's summary sentences best first, ranking them if needed"""
+        ranking = index.get('summary_ranking')
+        if ranking is None:
+            ranking, state = Summarizer.rank_sentences(index, time_budget)
+            documents.keep_on_index(index, 'summary_state', state)
+            ranking = documents.keep_on_index(index, 'summary_ranking', ranking)
+        return ranking
+    
+    @staticmethod
+    def rank_sentences(index, time_budget=None):
+        """Rank sentences by cosine similarity to the centroid, scoring only those in the nearest paragraphs;
+        returns the ranking and the centroid terms and nearest paragraphs, which appends start from"""
+        deadline = time.perf_counter() + time_budget if time_budget else None
+        paragraphs = index['paragraphs']
+        sentences = index['sentences']
+        matrix = RankingEngine.get_matrix(index)
+        indptr = matrix['indptr']
+        if not paragraphs or not sentences or not indptr[-1]:
+            return array('I'), {'terms': array('I'), 'candidates': array('I')}
+        
+        # Mean TF-IDF vector of the paragraphs, from the term x paragraph matrix in one pass
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        weights = matrix['data'] * matrix['idf'][rows]
+        centroid = np.bincount(rows, weights=weights, minlength=len(indptr) - 1) / len(paragraphs)
+        if len(centroid) > Summarizer.CENTROID_TERMS:
+            threshold = np.partition(centroid, -Summarizer.CENTROID_TERMS)[-Summarizer.CENTROID_TERMS]
+            centroid[centroid < threshold] = 0.0
+        
+        # Every paragraph's similarity at once, so long documents cost one vectorized pass
+        dots = np.bincount(matrix['indices'], weights=weights * centroid[rows], minlength=len(paragraphs))
+        norms = np.sqrt(np.bincount(matrix['indices'], weights=weights * weights, minlength=len(paragraphs)))
+        similarity = dots / np.where(norms > 0, norms, 1.0)
+        candidates = [int(i) for i in np.argsort(-similarity, kind='stable')[:Summarizer.CANDIDATE_PARAGRAPHS] if similarity[i] > 0]
+        
+        term_rows = matrix['vocabulary']
+        kept = np.flatnonzero(centroid)
+        token_ids = np.fromiter(term_rows, dtype=np.int64, count=len(term_rows))[kept]
+        centroid_terms = dict(zip(token_ids.tolist(), centroid[kept]))
+        
+        def idf(token_id):
+            row = term_rows.get(token_id)
+            return matrix['idf'][row] if row is not None else None
+        
+        ranking = Summarizer.score_sentences(index, candidates, centroid_terms, idf, deadline)
+        return ranking, {'terms': array('I', centroid_terms), 'candidates': array('I', candidates)}
+    
+    @staticmethod
+    def extend_ranking(source_index, index, time_budget=None):
+        """Return the summary sentences of an index extended from source_index best first, ranking them from the source's
+        centroid terms and nearest paragraphs: the centroid is recomputed over those terms and the new paragraphs' terms,
+        and only those paragraphs and the new ones are scored, so an append costs its own text rather than the whole
+        document. Without that state, as for an index rebuilt from an older layout, the whole document is ranked"""
+        state = source_index.get('summary_state')
+        if state is None or index.get('summary_ranking') is not None:
+            return Summarizer.get_ranking(index, time_budget)
+        
+        deadline = time.perf_counter() + time_budget if time_budget else None
+        paragraphs = index['paragraphs']
+        postings = index['postings']
+        first = len(source_index['paragraphs'])
+        # Collapsed copies are left out of the paragraph statistics, as they are out of the matrix
+        collapsed = NearDuplicates.collapsed(index)
+        paragraph_count = len(paragraphs) - len(collapsed)
+        added_collapsed = set(collapsed[bisect_left(collapsed, first):])
+        added = [i for i in range(first, len(paragraphs)) if i not in added_collapsed]
+        
+        # Same inverse document frequency as the matrix's, worked out once per term
+        idfs = {}
+        def idf(token_id):
+            if token_id not in idfs:
+                paragraph_ids = postings.get(token_id)
+                idfs[token_id] = math.log(1 + (paragraph_count - len(paragraph_ids) + 0.5) / (len(paragraph_ids) + 0.5)) if paragraph_ids is not None else None
+            return idfs[token_id]
+        
+        paragraph_terms = {}
+        for i in chain(state['candidates'], added):
+            counts = Counter(re.findall(r'\b\w+\b', paragraphs[i].lower()))
+            paragraph_terms[i] = {token_id: counts[term] for term, token_id in vocabulary.lookup(counts).items() if token_id in postings}
+        
+        # Terms outside the old centroid that the new paragraphs don't use only gain weight as the paragraph count grows
+        terms = set(state['terms'])
+        for i in added:
+            terms.update(paragraph_terms[i])
+        centroid = {token_id: idf(token_id) * LayeredCounts.total(index['term_totals'], token_id) / len(paragraphs) for token_id in terms}
+        if len(centroid) > Summarizer.CENTROID_TERMS:
+            threshold = heapq.nlargest(Summarizer.CENTROID_TERMS, centroid.values())[-1]
+            centroid = {token_id: weight for token_id, weight in centroid.items() if weight >= threshold}
+        
+        similarities = []
+        for i, counts in paragraph_terms.items():
+            dot = norm = 0.0
+            for token_id, count in counts.items():
+                weight = count * idf(token_id)
+                dot += weight * centroid.get(token_id, 0.0)
+                norm += weight * weight
+            if dot > 0:
+                similarities.append((dot / math.sqrt(norm), i))
+        similarities.sort(key=lambda item: (-item[0], item[1]))
+        candidates = [i for _, i in similarities[:Summarizer.CANDIDATE_PARAGRAPHS]]
+        
+        ranking = Summarizer.score_sentences(index, candidates, centroid, idf, deadline)
+        documents.keep_on_index(index, 'summary_state', {'terms': array('I', centroid), 'candidates': array('I', candidates)})
+        return documents.keep_on_index(index, 'summary_ranking', ranking)
+    
+    @staticmethod
+    def score_sentences(index, candidates, centroid, idf, deadline=None):
+        """Rank the sentences starting in the candidate paragraphs by cosine similarity to the centroid, given as weights by
+        token ID, with idf(token_id) the inverse document frequency of an indexed term or None"""
+        paragraphs = index['paragraphs']
+        sentences = index['sentences']
+        
+        # Only sentences starting in the nearest paragraphs are tokenized, nearest paragraphs
+        # first so running out of time keeps the most promising ones
+        scored = []
+        for paragraph in candidates:
+            first = bisect_left(sentences.starts, paragraphs.starts[paragraph])
+            last = bisect_left(sentences.starts, paragraphs.ends[paragraph])
+            for i in range(first, last):
+                counts = Counter(re.findall(r'\b\w+\b', sentences[i].lower()))
+                dot = norm = 0.0
+                for term, token_id in vocabulary.lookup(counts).items():
+                    term_idf = idf(token_id)
+                    if term_idf is not None:
+                        weight = counts[term] * term_idf
+                        dot += weight * centroid.get(token_id, 0.0)
+                        norm += weight * weight
+                if dot > 0:
+                    scored.append((dot / math.sqrt(norm), i))
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return array('I', (i for _, i in scored))
+    
+    @staticmethod
+    def summarize(index, max_words=150, time_budget=None):
+        """Best ranked, non-redundant sentences up to max_words in document order, or None if none qualify"""
+        sentences = index['sentences']
+        chosen = []
+        chosen_words = []
+        total_words = 0
+        for i in Summarizer.get_ranking(index, time_budget):
+            words = sentences[i].split()
+            if total_words + len(words) > max_words:
+                continue
+            word_set = {word.lower() for word in words}
+            if any(len(word_set & other) > Summarizer.REDUNDANCY * min(len(word_set), len(other)) for other in chosen_words):
+                continue
+            chosen.append(i)
+            chosen_words.append(word_set)
+            total_words += len(words)
+        
+        if not chosen:
+            return None
+        summary = '. '.join(sentences[i] for i in sorted(chosen))
+        if not summary.endswith('.'):
+            summary += '.'
+        return summary
+
+class TextAnalyzer:
+    """Handles text analysis and question answering"""
+    
+    # Question-answering pattern groups, looked for once per paragraph at index time and kept as bit flags
+    CAUSE_PATTERNS = 1
+    RESULT_PATTERNS = 2
+    DEMONSTRATES_PATTERN = 4
+    DEFINITION_PATTERNS = 8
+    COPULA_PATTERNS = 16
+    PATTERN_GROUPS = (
+        (CAUSE_PATTERNS, ('because', 'due to', 'reason', 'caused by')),
+        (RESULT_PATTERNS, ('result', 'conclusion', 'shows', 'indicates')),
+        (DEMONSTRATES_PATTERN, ('demonstrates',)),
+        (DEFINITION_PATTERNS, ('define', 'definition', 'means', 'refers to')),
+        (COPULA_PATTERNS, ('is', 'are'))
+    )
+    PATTERN_REACH = max(len(pattern) for _, patterns in PATTERN_GROUPS for pattern in patterns)
+    # Groups earning a paragraph half a point each
+    PARAGRAPH_PATTERN_BONUSES = (CAUSE_PATTERNS, RESULT_PATTERNS | DEMONSTRATES_PATTERN, DEFINITION_PATTERNS)
+    # Patterns earning an answer sentence a point each, with the flags of the groups they come from
+    SENTENCE_PATTERNS = (
+        (DEFINITION_PATTERNS | COPULA_PATTERNS, ('define', 'definition', 'means', 'refers to', 'is', 'are')),
+        (CAUSE_PATTERNS, ('because', 'due to', 'reason', 'caused by')),
+        (RESULT_PATTERNS, ('result', 'conclusion', 'shows', 'indicates'))
+    )
+    
+    # Words left out of the question terms
+    QUESTION_STOPWORDS = frozenset({'what', 'who', 'when', 'where', 'why', 'how', 'is', 'are', 'was', 'were', 'do', 'does', 'did', 'can', 'could', 'should', 'would', 'will', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'this', 'that', 'these', 'those'})
+    # Phrases quoted in a question with double quotes, or with single quotes that are not apostrophes
+    QUOTED_PHRASE = re.compile(r'"([^"]+)"|(?<!\w)\'([^\']+)\'(?!\w)')
+    
+    # Seeded challenge question sets remembered per document
+    CHALLENGE_SETS_PER_DOCUMENT = 32
+    
+    # Contexts an answer is built from, and extra ranked contexts standing in for near-duplicates among them
+    ANSWER_CONTEXTS = 3
+    DUPLICATE_MARGIN = 3
+    
+    @staticmethod
+    def generate_summary(text, max_words=150, sentences=None, index=None, time_budget=None):
+        """Generate a summary of the text, from the sentences nearest its centroid when it has an index"""
+        if index is not None and NUMPY_SUPPORT:
+            summary = Summarizer.summarize(index, max_words, time_budget)
+            if summary:
+                return summary
+        
+        if sentences is None:
+            sentences = index['sentences'] if index is not None else DocumentProcessor.split_sentence_spans(text)
+        
+        if not sentences:
+            return "Unable to generate summary from this document."
+        
+        # Simple extractive summarization - take first few sentences and some from middle
+        summary_sentences = []
+        total_words = 0
+        
+        # Add first sentence
+        if sentences:
+            summary_sentences.append(sentences[0])
+            total_words += len(sentences[0].split())
+        
+        # Add sentences from middle
+        middle_start = len(sentences) // 3
+        for i in range(middle_start, min(middle_start + 3, len(sentences))):
+            if total_words >= max_words:
+                break
+            sentence = sentences[i]
+            words_in_sentence = len(sentence.split())
+            if total_words + words_in_sentence <= max_words:
+                summary_sentences.append(sentence)
+                total_words += words_in_sentence
+        
+        summary = '. '.join(summary_sentences)
+        if not summary.endswith('.'):
+            summary += '.'
+        
+        return summary
+    
+    @staticmethod
+    def pattern_flags(text_lower):
+        """Bit flags of the question-answering pattern groups found in lowercased text"""
+        flags = 0
+        for flag, patterns in TextAnalyzer.PATTERN_GROUPS:
+            if any(pattern in text_lower for pattern in patterns):
+                flags |= flag
+        return flags
+    
+    @staticmethod
+    def paragraph_pattern_bonus(flags):
+        """Bonus for paragraphs with question-answering patterns, from their pattern flags"""
+        pattern_bonus = 0
+        for group in TextAnalyzer.PARAGRAPH_PATTERN_BONUSES:
+            if flags & group:
+                pattern_bonus += 0.5
+        return pattern_bonus
+    
+    @staticmethod
+    def joined_pattern_flags(relevant_contexts, pattern_flags):
+        """Pattern flags of the contexts' paragraphs joined with spaces"""
+        flags = 0
+        for _, i, _ in relevant_contexts:
+            flags |= pattern_flags[i]
+        # A pattern such as 'due to' can also run across the space between two paragraphs
+        reach = TextAnalyzer.PATTERN_REACH
+        for (_, _, before), (_, _, after) in zip(relevant_contexts, relevant_contexts[1:]):
+            flags |= TextAnalyzer.pattern_flags(f"{before[-reach:]} {after[:reach]}".lower())
+        return flags
+    
+    @staticmethod
+    def find_relevant_context(text, question, max_contexts=3, index=None, scorer=None, deadline=None):
+        """Find relevant paragraphs for answering a question"""
+        if index is None:
+            index = DocumentProcessor.build_index(text)
+        
+        with metrics.stage('score'):
+            meaningful_question_words = TextAnalyzer.question_terms(question)
+            return RankingEngine.score(index, meaningful_question_words, max_contexts, scorer or app.config['RANKING_SCORER'], deadline,
+                                       TextAnalyzer.question_phrases(question))
+    
+    @staticmethod
+    def find_relevant_contexts(text, questions, max_contexts=3, index=None, scorer=None):
+        """Find relevant paragraphs for several questions in one retrieval pass"""
+        if index is None:
+            index = DocumentProcessor.build_index(text)
+        
+        # Repeated questions are only ranked once
+        distinct = list(dict.fromkeys(questions))
+        with metrics.stage('score'):
+            ranked = RankingEngine.score_many(index, [TextAnalyzer.question_terms(question) for question in distinct],
+                                              max_contexts, scorer or app.config['RANKING_SCORER'],
+                                              [TextAnalyzer.question_phrases(question) for question in distinct])
+        contexts = dict(zip(distinct, ranked))
+        return [contexts[question] for question in questions]
+    
+    @staticmethod
+    def question_terms(question):
+        """Extract meaningful words from question (excluding common stop words)"""
+        question_words = set(re.findall(r'\b\w+\b', question.lower()))
+        return question_words - TextAnalyzer.QUESTION_STOPWORDS
+    
+    @staticmethod
+    def question_phrases(question):
+        """Word sequences quoted in the question, as tuples of lowercase words"""
+        phrases = []
+        for match in TextAnalyzer.QUOTED_PHRASE.finditer(question):
+            phrase = match.group(1) or match.group(2)
+            words = re.findall(r'\b\w+\b', phrase.lower())
+            # Quotes shortened with an ellipsis may end part-way through a word
+            if phrase.endswith('...'):
+                words = words[:-1]
+            # A phrase needs a question term, so only paragraphs sharing words with the question can hold it
+            if len(words) > 1 and not TextAnalyzer.QUESTION_STOPWORDS.issuperset(words):
+                phrases.append(tuple(words))
+        return tuple(dict.fromkeys(phrases))
+    
+    @staticmethod
+    def answer_question(text, question, index=None, scorer=None, deadline=None):
+        """Answer a question based on the document text"""
+        if index is None:
+            index = DocumentProcessor.build_index(text)
+        relevant_contexts = TextAnalyzer.find_relevant_context(text, question, TextAnalyzer.ANSWER_CONTEXTS + TextAnalyzer.DUPLICATE_MARGIN,
+                                                               index=index, scorer=scorer, deadline=deadline)
+        with metrics.stage('answer'):
+            return TextAnalyzer.answer_from_contexts(relevant_contexts, question, pages=index.get('paragraph_pages'),
+                                                     pattern_flags=index.get('pattern_flags'))
+    
+    @staticmethod
+    def answer_from_contexts(relevant_contexts, question, source=None, pages=None, pattern_flags=None):
+        """Build an answer and justification from the best distinct of the ranked (score, paragraph index, paragraph) contexts"""
+        relevant_contexts = NearDuplicates.distinct_contexts(relevant_contexts)[:TextAnalyzer.ANSWER_CONTEXTS]
+        if not relevant_contexts:
+            return {
+                'answer': "I couldn't find relevant information to answer this question in the document.",
+                'justification': "No relevant context found in the document for this question."
+            }
+        
+        # Combine the most relevant contexts
+        context_text = ' '.join([context[2] for context in relevant_contexts])
+        
+        # Generate answer based on context, skipping pattern groups the paragraphs are known not to contain
+        flags = TextAnalyzer.joined_pattern_flags(relevant_contexts, pattern_flags) if pattern_flags is not None else None
+        answer = TextAnalyzer.generate_contextual_answer(context_text, question, flags)
+        
+        # Ensure the answer is not just repeating the question
+        question_words = set(re.findall(r'\b\w+\b', question.lower()))
+        answer_words = set(re.findall(r'\b\w+\b', answer.lower()))
+        
+        # If answer is too similar to question, try to get a different response
+        if len(question_words.intersection(answer_words)) / len(question_words) > 0.8:
+            # Try to get a different sentence from the context
+            sentences = DocumentProcessor.split_sentence_spans(context_text, min_length=10)
+            
+            for sentence in sentences:
+                sentence_words = set(re.findall(r'\b\w+\b', sentence.lower()))
+                if len(question_words.intersection(sentence_words)) / len(question_words) < 0.6:
+                    answer = sentence
+                    break
+        
+        # Clean up the answer
+        answer = answer.strip()
+        if not answer.endswith('.'):
+            answer += '.'
+        
+        # Generate justification
+        justification = f"Based on the document content, particularly from "
+        if len(relevant_contexts) == 1:
+            justification += f"paragraph {relevant_contexts[0][1] + 1}"
+        else:
+            justification += f"paragraphs {relevant_contexts[0][1] + 1}"
+        if pages:
+            justification += f" (page {pages[relevant_contexts[0][1]]})"
+        if source:
+            justification += f" of {source}"
+        if len(relevant_contexts) > 1:
+            justification += f" and {len(relevant_contexts) - 1} other related sections"
+        
+        # Add snippet of most relevant content
+        most_relevant_content = relevant_contexts[0][2][:150]
+        justification += f". The relevant content includes: \"{most_relevant_content}...\""
+        
+        return {
+            'answer': answer,
+            'justification': justification
+        }
+    
+    @staticmethod
+    def generate_contextual_answer(context, question, pattern_flags=None):
+        """Generate an answer based on context and question"""
+        # Clean up context and question
+        context = context.strip()
+        question_lower = question.lower()
+        
+        # Split context into sentences
+        sentences = DocumentProcessor.split_sentence_spans(context, min_length=10)
+        
+        if not sentences:
+            return "The document contains relevant information but I cannot provide a specific answer."
+        
+        # Extract key question words (excluding common question words)
+        question_stopwords = {'what', 'who', 'when', 'where', 'why', 'how', 'is', 'are', 'was', 'were', 'do', 'does', 'did', 'can', 'could', 'should', 'would', 'will', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
+        question_words = set(re.findall(r'\b\w+\b', question_lower))
+        meaningful_question_words = question_words - question_stopwords
+        
+        # Only pattern groups the context contains need looking for in its sentences
+        sentence_patterns = [patterns for flags, patterns in TextAnalyzer.SENTENCE_PATTERNS if pattern_flags is None or pattern_flags & flags]
+        
+        # Score sentences based on relevance
+        scored_sentences = []
+        for sentence in sentences:
+            sentence_lower = sentence.lower()
+            sentence_words = set(re.findall(r'\b\w+\b', sentence_lower))
+            
+            # Calculate relevance score
+            word_overlap = len(meaningful_question_words.intersection(sentence_words))
+            
+            # Bonus for sentences that contain key question patterns
+            pattern_bonus = 0
+            for patterns in sentence_patterns:
+                if any(word in sentence_lower for word in patterns):
+                    pattern_bonus += 1
+            
+            total_score = word_overlap + pattern_bonus
+            
+            if total_score > 0:
+                scored_sentences.append((total_score, sentence))
+        
+        # Take the three best sentences with a heap and get the best answer
+        if scored_sentences:
+            scored_sentences = heapq.nlargest(3, scored_sentences)
+            best_sentence = scored_sentences[0][1]
+            
+            # Try to improve the answer by combining related sentences
+            if len(scored_sentences) > 1:
+                # If the top sentences have similar scores, combine them
+                top_score = scored_sentences[0][0]
+                combined_answer = best_sentence
+                
+                for score, sentence in scored_sentences[1:3]:  # Check next 2 sentences
+                    if score >= top_score * 0.7:  # If score is within 70% of top score
+                        combined_answer += " " + sentence
+                
+                return combined_answer
+            else:
+                return best_sentence
+        
+        # If no good match found, try to find sentences that contain question keywords
+        for sentence in sentences:
+            sentence_lower = sentence.lower()
+            if any(word in sentence_lower for word in meaningful_question_words):
+                return sentence
+        
+        # Last resort: return the first substantial sentence
+        return sentences[0] if sentences else "I cannot find relevant information in the document to answer this question."
+    
+    @staticmethod
+    def collect_concepts(text, start=0, sentences=(), concepts=None, replaced=()):
+        """Add the concept statistics of text[start:] and the given sentences to those of the text before it,
+        less those of the replaced sentences, returning new statistics; counts are added as a new layer"""
+        if concepts is None:
+            concepts = {'proper_nouns': (), 'numbers': [], 'quotes': [], 'quotes_end': 0, 'word_counts': ()}
+        
+        # Count proper nouns (likely names, places, organizations); replaced sentences keep
+        # their nouns' places, at zero, so merged counts match a fresh pass over the whole text
+        proper_nouns = Counter()
+        for sentence in replaced:
+            for word in re.findall(r'\b[A-Z][a-z]+\b', sentence):
+                proper_nouns[word] -= 1
+        for sentence in sentences:
+            proper_nouns.update(re.findall(r'\b[A-Z][a-z]+\b', sentence))
+        
+        # Find numbers and dates; only the first ten are ever used
+        numbers = concepts['numbers']
+        if len(numbers) < 10:
+            numbers = (numbers + re.findall(r'\b\d{4}\b|\b\d+\.\d+\b|\b\d+%\b', text[start:]))[:10]
+        
+        # Find quoted text, resuming after the last closed quote so an open one can close in the new text
+        quotes = concepts['quotes']
+        quotes_end = concepts['quotes_end']
+        if len(quotes) < 5:
+            quotes = list(quotes)
+            for match in re.compile(r'"([^"]*)"').finditer(text, quotes_end):
+                quotes.append(match.group(1))
+                quotes_end = match.end()
+                if len(quotes) == 5:
+                    break
+        
+        # Count longer words, candidates for technical terms
+        word_counts = Counter(re.findall(r'\b[a-zA-Z]{6,}\b', text[start:].lower()))
+        
+        return {
+            'proper_nouns': LayeredCounts.add(concepts['proper_nouns'], proper_nouns),
+            'numbers': numbers,
+            'quotes': quotes,
+            'quotes_end': quotes_end,
+            'word_counts': LayeredCounts.add(concepts['word_counts'], word_counts)
+        }
+    
+    @staticmethod
+    def extract_key_concepts(text, sentences=None, concepts=None):
+        """Extract key concepts, names, and important terms from the text"""
+        if concepts is None:
+            # Split into sentences and clean
+            if sentences is None:
+                sentences = DocumentProcessor.split_sentence_spans(text)
+            concepts = TextAnalyzer.collect_concepts(text, sentences=sentences)
+        
+        # Most frequent names and longer words, picked with a heap rather than sorting every count
+        proper_nouns = [word for word, count in LayeredCounts.merged(concepts['proper_nouns']).most_common(15) if count > 0]
+        technical_terms = [word for word, freq in LayeredCounts.merged(concepts['word_counts']).most_common(10)]
+        
+        return {
+            'proper_nouns': proper_nouns,
+            'numbers': concepts['numbers'],
+            'quotes': concepts['quotes'],
+            'technical_terms': technical_terms
+        }
+    
+    @staticmethod
+    def get_key_concepts(index):
+        """Return the index's key concepts, extracting them if needed"""
+        key_concepts = index.get('key_concepts')
+        if key_concepts is None:
+            key_concepts = documents.keep_on_index(index, 'key_concepts', TextAnalyzer.extract_key_concepts(None, concepts=index['concepts']))
+        return key_concepts
+    
+    @staticmethod
+    def generate_challenge_questions(text, index=None, seed=None):
+        """Generate challenge questions from the document content, reproducibly when given a seed"""
+        if index is None:
+            index = DocumentProcessor.build_index(text)
+        
+        # Question sets for a seed are fixed, so they are kept with the index
+        challenge_sets = index.get('challenge_sets')
+        if seed is not None and challenge_sets is not None and seed in challenge_sets:
+            return list(challenge_sets[seed])
+        
+        rng = random.Random(seed) if seed is not None else random
+        questions = TextAnalyzer.build_challenge_questions(index, rng)
+        
+        if seed is not None:
+            if challenge_sets is None:
+                challenge_sets = documents.keep_on_index(index, 'challenge_sets', OrderedDict())
+            challenge_sets[seed] = tuple(questions)
+            size = DocumentStore.approximate_size(challenge_sets[seed])
+            while len(challenge_sets) > TextAnalyzer.CHALLENGE_SETS_PER_DOCUMENT:
+                size -= DocumentStore.approximate_size(challenge_sets.popitem(last=False)[1])
+            documents.charge(index, size)
+        return questions
+    
+    @staticmethod
+    def build_challenge_questions(index, rng):
+        """Pick challenge questions from the index's key concepts using rng"""
+        paragraphs = index['paragraphs']
+        questions = []
+        
+        # If document is too short, generate basic questions
+        if len(paragraphs) < 2:
+            return [
+                "What is the main topic discussed in this document?",
+                "What are the key points mentioned in the text?",
+                "What conclusions can be drawn from this document?"
+            ]
+        
+        concepts = TextAnalyzer.get_key_concepts(index)
+        
+        # Generate questions based on proper nouns (names, places, organizations)
+        if concepts['proper_nouns']:
+            selected_nouns = rng.sample(concepts['proper_nouns'], min(3, len(concepts['proper_nouns'])))
+            for noun in selected_nouns:
+                questions.append(f"What role does {noun} play in the document?")
+                questions.append(f"What information is provided about {noun}?")
+        
+        # Generate questions based on numbers and dates
+        if concepts['numbers']:
+            selected_numbers = rng.sample(concepts['numbers'], min(2, len(concepts['numbers'])))
+            for number in selected_numbers:
+                questions.append(f"What is the significance of {number} mentioned in the document?")
         
         # Generate questions based on quotes
         if concepts['quotes']:
-            selected_quotes = random.sample(concepts['quotes'], min(2, len(concepts['quotes'])))
+            selected_quotes = rng.sample(concepts['quotes'], min(2, len(concepts['quotes'])))
             for quote in selected_quotes:
                 if len(quote) > 20:  # Only use substantial quotes
                     questions.append(f"Who said or wrote: '{quote[:50]}...'?")
                     questions.append(f"What is the context of the quote: '{quote[:50]}...'?")
         
-        # Generate questions based on technical terms
-        if concepts['technical_terms']:
-            selected_terms = random.sample(concepts['technical_terms'], min(3, len(concepts['technical_terms'])))
-            for term in selected_terms:
-                questions.append(f"How is the term '{term}' defined or explained in the document?")
-                questions.append(f"What is the importance of '{term}' in the context of this document?")
+        # Generate questions based on technical terms
+        if concepts['technical_terms']:
+            selected_terms = rng.sample(concepts['technical_terms'], min(3, len(concepts['technical_terms'])))
+            for term in selected_terms:
+                questions.append(f"How is the term '{term}' defined or explained in the document?")
+                questions.append(f"What is the importance of '{term}' in the context of this document?")
+        
+        # Generate questions based on document structure
+        if len(paragraphs) >= 3:
+            # Questions about different sections
+            questions.append("What is discussed in the opening section of the document?")
+            questions.append("What are the main arguments presented in the middle sections?")
+            questions.append("What conclusions are drawn in the final section?")
+        
+        # Generate analytical questions based on content
+        questions.extend([
+            "What is the author's main argument or thesis?",
+            "What evidence does the author provide to support their claims?",
+            "What are the key takeaways from this document?",
+            "How does the author structure their argument?",
+            "What examples or case studies are mentioned?",
+            "What are the implications of the information presented?",
+            "What questions does this document raise?",
+            "How does this document relate to broader themes or issues?"
+        ])
+        
+        # Remove duplicates, keeping first occurrences so a seed always gives the same order, and shuffle
+        questions = list(dict.fromkeys(questions))
+        rng.shuffle(questions)
+        
+        # Return a reasonable number of questions (5-8)
+        return questions[:min(8, len(questions))] if questions else [
+            "What is the main topic discussed in this document?",
+            "What are the key points mentioned in the text?",
+            "What conclusions can be drawn from this document?"
+        ]
+    
+    @staticmethod
+    def evaluate_answer(document_text, question, user_answer, index=None, scorer=None):
+        """Evaluate user's answer against the document"""
+        # Get the "correct" answer from the document
+        correct_response = TextAnalyzer.answer_question(document_text, question, index=index, scorer=scorer)
+        
+        # Also check against the broader document context
+        document_words = TextAnalyzer.document_vocabulary(document_text, index)
+        user_words = set(re.findall(r'\b\w+\b', user_answer.lower()))
+        
+        return TextAnalyzer.score_answer(user_words, correct_response, len(user_words.intersection(document_words)), len(document_words))
+    
+    @staticmethod
+    def evaluate_answers(document_text, questions, user_answers, index=None, scorer=None, pool=None, reference_answers=None):
+        """Evaluate many answers against the document with a single retrieval pass"""
+        # reference_answers may hold known answer_question results (or None) per question;
+        # each evaluation reports the reference answer it was scored against under 'reference'
+        if index is None:
+            index = DocumentProcessor.build_index(document_text)
+        if reference_answers is None:
+            reference_answers = [None] * len(questions)
+        
+        # Only questions without a known reference answer need retrieval
+        unresolved = [question for question, reference in zip(questions, reference_answers) if reference is None]
+        relevant_contexts = iter(TextAnalyzer.find_relevant_contexts(document_text, unresolved, TextAnalyzer.ANSWER_CONTEXTS + TextAnalyzer.DUPLICATE_MARGIN,
+                                                                     index=index, scorer=scorer))
+        document_words = TextAnalyzer.document_vocabulary(document_text, index)
+        
+        # Document overlap is measured here so workers never need the vocabulary
+        pairs = []
+        for question, user_answer, reference in zip(questions, user_answers, reference_answers):
+            contexts = next(relevant_contexts) if reference is None else None
+            user_words = set(re.findall(r'\b\w+\b', user_answer.lower()))
+            pairs.append((contexts, index.get('paragraph_pages'), index.get('pattern_flags'), question, user_words,
+                          len(user_words.intersection(document_words)), len(document_words), reference))
+        
+        with metrics.stage('evaluate'):
+            if pool is not None and len(pairs) > 1:
+                return list(pool.map(evaluate_from_contexts, pairs))
+            return [evaluate_from_contexts(pair) for pair in pairs]
+    
+    @staticmethod
+    def document_vocabulary(document_text, index=None):
+        """Set of words in the document, cached on the index"""
+        if index is None:
+            return set(re.findall(r'\b\w+\b', document_text.lower()))
+        if index.get('vocabulary') is None:
+            documents.keep_on_index(index, 'vocabulary', frozenset(re.findall(r'\b\w+\b', document_text.lower())))
+        return index['vocabulary']
+    
+    @staticmethod
+    def score_answer(user_words, correct_response, document_overlap, document_word_count):
+        """Score a user's answer against the reference answer and the document"""
+        # Simple evaluation based on keyword matching
+        correct_words = set(re.findall(r'\b\w+\b', correct_response['answer'].lower()))
+        
+        # Calculate overlap with correct answer
+        correct_overlap = len(user_words.intersection(correct_words))
         
-        # Generate questions based on document structure
-        if len(paragraphs) >= 3:
-            # Questions about different sections
-            questions.append("What is discussed in the opening section of the document?")
-            questions.append("What are the main arguments presented in the middle sections?")
-            questions.append("What conclusions are drawn in the final section?")
+        # Weight both overlaps
+        total_correct_words = len(correct_words) if correct_words else 1
+        total_document_words = document_word_count if document_word_count else 1
+        
+        correct_score = correct_overlap / total_correct_words
+        document_score = document_overlap / min(total_document_words, 100)  # Cap to avoid very low scores
+        
+        # Combined score
+        score = (correct_score * 0.7) + (document_score * 0.3)
+        
+        # Generate feedback based on score
+        if score > 0.7:
+            feedback = "Excellent! Your answer aligns well with the document content and demonstrates good understanding."
+        elif score > 0.5:
+            feedback = "Good answer! You captured important points from the document. Consider including more specific details."
+        elif score > 0.3:
+            feedback = "Your answer shows some understanding but could be more comprehensive. Review the document for additional details."
+        else:
+            feedback = "Your answer needs improvement. Please refer to the document more closely and include relevant information."
+        
+        return {
+            'feedback': feedback,
+            'justification': correct_response['justification'],
+            'score': score
+        }
+
+def evaluate_from_contexts(pair):
+    """Answer one question from its ranked contexts and score the user's answer, usable in a worker process"""
+    contexts, pages, pattern_flags, question, user_words, document_overlap, document_word_count, correct_response = pair
+    if correct_response is None:
+        correct_response = TextAnalyzer.answer_from_contexts(contexts, question, pages=pages, pattern_flags=pattern_flags)
+    evaluation = TextAnalyzer.score_answer(user_words, correct_response, document_overlap, document_word_count)
+    evaluation['reference'] = correct_response
+    return evaluation
+
+class DocumentExpired(KeyError):
+    """Raised when a document has passed its time-to-live"""
+
+class DocumentConflict(Exception):
+    """Raised when a document changed while an update to it was being prepared"""
+
+class DocumentStore:
+    """SQLite-backed document storage with a memory-bounded LRU cache of shared, content-addressed text and indexes"""
+    
+    # Seconds change events are kept for processes sharing the database
+    EVENT_RETENTION = 24 * 3600
+    # Index entries computed on first use, whose size is charged to the cache when they are filled
+    LAZY_INDEX_KEYS = ('matrix', 'static_scores', 'position_offsets', 'summary_ranking', 'summary_state', 'key_concepts', 'challenge_sets', 'vocabulary')
+    # Items measured per container when approximating its size
+    SIZE_SAMPLE = 64
+    
+    def __init__(self, path, cache_bytes):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        
+        # content_hash -> (content, approximate size in bytes), least recently used first
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        # id of each cached index -> its content_hash, so data cached on the index later is charged to its entry
+        self.index_owners = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        
+        # document_id -> per-upload metadata, kept only while the document's content is cached
+        self.metadata = {}
+        self.aliases = {}
+        
+        # Callables notified with a content_hash whenever content changes or leaves memory
+        self.listeners = []
+        
+        # Newest change from document_events applied to this process's caches
+        self.last_event = 0
+        
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            
+            # Databases created before deduplication stored text and indexes per document
+            legacy_columns = {row[1] for row in conn.execute('PRAGMA table_info(documents)')}
+            if legacy_columns and 'content_hash' not in legacy_columns:
+                conn.executescript("""
+                    DROP INDEX IF EXISTS documents_expires_at;
+                    ALTER TABLE documents RENAME TO documents_legacy;
+                    DROP TABLE IF EXISTS corpus_postings;
+                    DROP TABLE IF EXISTS corpus_documents;
+                """)
+            
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS contents (
+                    content_hash TEXT PRIMARY KEY,
+                    filepath TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    index_data BLOB,
+                    refcount INTEGER NOT NULL,
+                    base_hash TEXT,
+                    page_offsets BLOB,
+                    extensions INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS documents (
+                    document_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    upload_time TEXT NOT NULL,
+                    content_hash TEXT,
+                    expires_at REAL,
+                    expired INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+                CREATE INDEX IF NOT EXISTS documents_expires_at ON documents (expires_at) WHERE expires_at IS NOT NULL AND expired = 0;
+                CREATE TABLE IF NOT EXISTS corpus_documents (
+                    content_hash TEXT PRIMARY KEY,
+                    paragraph_count INTEGER NOT NULL,
+                    token_count INTEGER NOT NULL,
+                    paragraph_lengths BLOB NOT NULL,
+                    token_lengths BLOB NOT NULL,
+                    pattern_bonuses BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS corpus_postings (
+                    term TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    paragraph_ids BLOB NOT NULL,
+                    frequencies BLOB NOT NULL,
+                    PRIMARY KEY (term, content_hash)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS corpus_postings_content ON corpus_postings (content_hash);
+                CREATE TABLE IF NOT EXISTS document_events (
+                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document_id TEXT,
+                    content_hash TEXT,
+                    created REAL NOT NULL
+                );
+            """)
+            # Appended content can be stored as a delta: its text is only what was appended, base_hash is the content
+            # it extends and page_offsets the appended pages; extensions counts the deltas built on a record, which
+            # keep it stored after its last document lets go of it
+            if 'base_hash' not in {row[1] for row in conn.execute('PRAGMA table_info(contents)')}:
+                conn.executescript("""
+                    ALTER TABLE contents ADD COLUMN base_hash TEXT;
+                    ALTER TABLE contents ADD COLUMN page_offsets BLOB;
+                    ALTER TABLE contents ADD COLUMN extensions INTEGER NOT NULL DEFAULT 0;
+                """)
+            conn.execute('CREATE INDEX IF NOT EXISTS contents_chains ON contents (content_hash, base_hash, refcount, extensions) WHERE base_hash IS NOT NULL OR extensions > 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS contents_bases ON contents (base_hash, content_hash, refcount) WHERE base_hash IS NOT NULL')
+            # Each content record in a delta chain, with the live records whose postings include its own: itself while
+            # documents use it, and the live deltas built on it. Kept up to date as references and deltas change
+            if not conn.execute('PRAGMA table_info(chain_targets)').fetchall():
+                conn.executescript("""
+                    CREATE TABLE chain_targets (
+                        content_hash TEXT NOT NULL,
+                        target_hash TEXT NOT NULL,
+                        PRIMARY KEY (content_hash, target_hash)
+                    ) WITHOUT ROWID;
+                """)
+                # Databases created before the table keep their chains, rooted at content stored in full
+                roots = conn.execute('SELECT content_hash FROM contents INDEXED BY contents_chains WHERE base_hash IS NULL AND extensions > 0').fetchall()
+                for (root,) in roots:
+                    self._refresh_chain_targets(conn, root)
+            self.last_event = conn.execute('SELECT COALESCE(MAX(event_id), 0) FROM document_events').fetchone()[0]
+            
+            if legacy_columns and 'content_hash' not in legacy_columns:
+                self._migrate_legacy(conn, legacy_columns)
+    
+    def _migrate_legacy(self, conn, columns):
+        """Move per-document text and indexes into shared content records"""
+        # Databases created before document expiry lack the TTL columns
+        ttl_columns = 'expires_at, expired' if 'expires_at' in columns else 'NULL, 0'
+        rows = conn.execute(f'SELECT document_id, filename, filepath, upload_time, text, summary, index_data, {ttl_columns} FROM documents_legacy')
+        for document_id, filename, filepath, upload_time, text, summary, index_data, expires_at, expired in rows:
+            content_hash = None
+            if not expired:
+                content_hash = DocumentProcessor.hash_file(filepath) if os.path.exists(filepath) else hashlib.sha256(text.encode('utf-8')).hexdigest()
+                conn.execute(
+                    'INSERT INTO contents (content_hash, filepath, text, summary, index_data, refcount) VALUES (?, ?, ?, ?, ?, 1) '
+                    'ON CONFLICT (content_hash) DO UPDATE SET refcount = refcount + 1',
+                    (content_hash, filepath, text, summary, index_data)
+                )
+            conn.execute(
+                'INSERT INTO documents (document_id, filename, upload_time, content_hash, expires_at, expired) VALUES (?, ?, ?, ?, ?, ?)',
+                (document_id, filename, upload_time, content_hash, expires_at, expired)
+            )
+        conn.execute('DROP TABLE documents_legacy')
+        logger.info('Migrated documents to shared content records')
+    
+    def connection(self):
+        """Return this thread's SQLite connection"""
+        conn = getattr(self.local, 'conn', None)
+        # A forked worker must not reuse its parent's connection
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.pid = os.getpid()
+        return conn
+    
+    def __contains__(self, document_id):
+        # Only the documents row is read, so existence checks neither unpickle indexes nor evict cached content
+        with self.lock:
+            metadata = self.metadata.get(document_id)
+        if metadata is None:
+            row = self.connection().execute(
+                'SELECT expires_at FROM documents WHERE document_id = ? AND expired = 0 AND content_hash IS NOT NULL', (document_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            metadata = {'expires_at': row[0]}
+        return metadata['expires_at'] is None or metadata['expires_at'] > time.time()
+    
+    def __getitem__(self, document_id):
+        with self.lock:
+            metadata = self.metadata.get(document_id)
+            entry = self.cache.get(metadata['content_hash']) if metadata is not None else None
+            if entry is not None:
+                self.cache.move_to_end(metadata['content_hash'])
+                self.hits += 1
+        
+        if entry is None:
+            row = self.connection().execute(
+                'SELECT filename, upload_time, content_hash, expires_at, expired FROM documents WHERE document_id = ?',
+                (document_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(document_id)
+            
+            filename, upload_time, content_hash, expires_at, expired = row
+            if expired:
+                raise DocumentExpired(document_id)
+            metadata = {
+                'filename': filename,
+                'upload_time': upload_time,
+                'content_hash': content_hash,
+                'expires_at': expires_at
+            }
+            entry = self._load_content(content_hash)
+            with self.lock:
+                # Only remember metadata while its content is still cached
+                if content_hash in self.cache:
+                    self.metadata[document_id] = metadata
+                    self.aliases.setdefault(content_hash, set()).add(document_id)
+        
+        if metadata['expires_at'] is not None and metadata['expires_at'] <= time.time():
+            raise DocumentExpired(document_id)
+        return {**entry[0], **metadata}
+    
+    def _load_content(self, content_hash):
+        """Return a (content, size) entry, reading it from disk on a cache miss"""
+        with self.lock:
+            entry = self.cache.get(content_hash)
+            if entry is not None:
+                self.cache.move_to_end(content_hash)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        row = self.connection().execute(
+            'SELECT filepath, text, summary, index_data, base_hash, page_offsets FROM contents WHERE content_hash = ?', (content_hash,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(content_hash)
+        
+        filepath, text, summary, index_data, base_hash, page_offsets = row
+        if base_hash is not None:
+            text, index = self._replay([(text, page_offsets)], base_hash)
+            size = len(text) + len(summary) + self.index_size(index)
+        else:
+            index = self.load_index(content_hash, text, index_data)
+            size = len(text) + len(summary) + len(index_data or b'')
+        content = {
+            'filepath': filepath,
+            'text': text,
+            'summary': summary,
+            'index': index
+        }
+        self._notify(self._cache(content_hash, content, size))
+        return content, size
+    
+    def load_index(self, content_hash, text, index_data):
+        """Unpickle a stored index and bind it to its text, rebuilding indexes saved in an older layout"""
+        if index_data is None:
+            return None
+        
+        index = pickle.loads(index_data)
+        if index.get('version') == DocumentProcessor.INDEX_VERSION:
+            return DocumentProcessor.bind_text(index, text)
+        
+        pages = index.get('paragraph_pages')
+        index = DocumentProcessor.build_index(text)
+        # Older layouts split paragraphs the same way, so their page numbers still line up
+        if pages and len(pages) == len(index['paragraphs']):
+            index['paragraph_pages'] = array('I', pages)
+        with self.connection() as conn:
+            conn.execute('UPDATE contents SET index_data = ? WHERE content_hash = ?',
+                         (pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL), content_hash))
+        return index
+    
+    def _replay(self, pieces, base_hash):
+        """Rebuild a delta's text and index by appending its (text, page_offsets) pieces, newest first, to the content they
+        extend, starting from the nearest cached content or content stored in full"""
+        conn = self.connection()
+        while True:
+            with self.lock:
+                entry = self.cache.get(base_hash)
+            if entry is not None:
+                text, index = entry[0]['text'], entry[0]['index']
+                break
+            row = conn.execute('SELECT text, index_data, base_hash, page_offsets FROM contents WHERE content_hash = ?', (base_hash,)).fetchone()
+            if row is None:
+                raise KeyError(base_hash)
+            text, index_data, next_hash, page_offsets = row
+            if next_hash is None:
+                index = self.load_index(base_hash, text, index_data)
+                break
+            pieces.append((text, page_offsets))
+            base_hash = next_hash
+        
+        # All pieces are indexed in one pass, which splits them into the same paragraphs as appending them one by one
+        pieces = [(piece, array('I', page_offsets) if page_offsets is not None else None) for piece, page_offsets in reversed(pieces)]
+        text, extended = DocumentProcessor.append_text(text, index, pieces)
+        # The summary ranking carries on too, so the next append doesn't rank the whole document
+        if NUMPY_SUPPORT and index.get('summary_state') is not None:
+            Summarizer.extend_ranking(index, extended)
+        return text, extended
+    
+    @staticmethod
+    def index_size(index):
+        """Approximate bytes of an index that has no pickle to measure"""
+        if index is None:
+            return 0
+        arrays = sum(sum(map(len, index[key].values())) for key in ('postings', 'term_frequencies', 'positions'))
+        lazy = sum(DocumentStore.approximate_size(index.get(key)) for key in DocumentStore.LAZY_INDEX_KEYS)
+        return 4 * arrays + 32 * (len(index['paragraphs']) + len(index['sentences'])) + lazy
+    
+    @staticmethod
+    def approximate_size(value):
+        """Approximate bytes held by data cached on an index"""
+        if value is None:
+            return 0
+        if isinstance(value, array):
+            return value.itemsize * len(value)
+        if NUMPY_SUPPORT and isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        # Large containers here hold one kind of item, so the first few stand for the rest
+        if isinstance(value, dict):
+            sample = list(islice(value.items(), DocumentStore.SIZE_SAMPLE))
+            sampled = sum(16 + DocumentStore.approximate_size(key) + DocumentStore.approximate_size(item) for key, item in sample)
+            return sampled * len(value) // len(sample) if sample else 0
+        if isinstance(value, (list, tuple, set, frozenset)):
+            sample = list(islice(value, DocumentStore.SIZE_SAMPLE))
+            sampled = sum(8 + DocumentStore.approximate_size(item) for item in sample)
+            return sampled * len(value) // len(sample) if sample else 0
+        return 8
+    
+    def keep_on_index(self, index, key, value):
+        """Cache lazily computed data on an index, charging it to the index's cache entry, and return it"""
+        index[key] = value
+        self.charge(index, self.approximate_size(value))
+        return value
+    
+    def charge(self, index, size):
+        """Add bytes of data cached on an index after it was stored to its cache entry, evicting to stay under budget"""
+        with self.lock:
+            content_hash = self.index_owners.get(id(index))
+            entry = self.cache.get(content_hash) if content_hash is not None else None
+            # Indexes built outside the store, or evicted since, are not counted
+            if entry is None or entry[0]['index'] is not index:
+                return
+            self.cache[content_hash] = (entry[0], entry[1] + size)
+            self.cached_bytes += size
+            evicted = self._evict()
+        self._notify(evicted)
+    
+    def delta_chain(self, content_hash):
+        """Hashes from content back through the content each delta extends, ending with content stored in full"""
+        chain = [content_hash]
+        conn = self.connection()
+        while True:
+            # The chain index answers this without reading the text and pickled index stored in the same row
+            row = conn.execute('SELECT base_hash FROM contents INDEXED BY contents_chains WHERE content_hash = ? AND (base_hash IS NOT NULL OR extensions > 0)',
+                               (chain[-1],)).fetchone()
+            if row is None or row[0] is None:
+                return chain
+            chain.append(row[0])
+    
+    def get(self, document_id, default=None):
+        try:
+            return self[document_id]
+        except KeyError:
+            return default
+    
+    def __setitem__(self, document_id, document):
+        self.add(document_id, document)
+    
+    def add(self, document_id, document):
+        """Store a document, returning False when its content was already stored by another upload"""
+        return self._store(document_id, document)[0]
+    
+    def update(self, document_id, document, expected_hash):
+        """Point an existing document at new content, returning (created, released) where released is as for _release;
+        a document with a base_hash is stored as a delta holding only its appended text and appended_pages"""
+        return self._store(document_id, document, expected_hash)
+    
+    def add_many(self, items):
+        """Store (document_id, document, index_data) triples in one transaction, returning whether each one's content was new;
+        the content is not cached, as bulk loads are read back by the servers sharing the database"""
+        with self.connection() as conn:
+            return [self._insert(conn, document_id, document, index_data) for document_id, document, index_data in items]
+    
+    @staticmethod
+    def serialize_index(index):
+        """Pickle an index for the contents table"""
+        return pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL) if index is not None else None
+    
+    def _insert(self, conn, document_id, document, index_data):
+        """Write a document row and reference its content, returning whether the content was new"""
+        content_hash = document['content_hash']
+        if document.get('base_hash') is not None:
+            page_offsets = document['appended_pages']
+            created = conn.execute(
+                'INSERT OR IGNORE INTO contents (content_hash, filepath, text, summary, refcount, base_hash, page_offsets) VALUES (?, ?, ?, ?, 0, ?, ?)',
+                (content_hash, document['filepath'], document['appended'], document['summary'], document['base_hash'],
+                 array('I', page_offsets).tobytes() if page_offsets else None)
+            ).rowcount == 1
+            if created:
+                conn.execute('UPDATE contents SET extensions = extensions + 1 WHERE content_hash = ?', (document['base_hash'],))
+        else:
+            created = conn.execute(
+                'INSERT OR IGNORE INTO contents (content_hash, filepath, text, summary, index_data, refcount) VALUES (?, ?, ?, ?, ?, 0)',
+                (content_hash, document['filepath'], document['text'], document['summary'], index_data)
+            ).rowcount == 1
+        conn.execute('UPDATE contents SET refcount = refcount + 1 WHERE content_hash = ?', (content_hash,))
+        self._refresh_chain_targets(conn, content_hash)
+        conn.execute(
+            'INSERT OR REPLACE INTO documents (document_id, filename, upload_time, content_hash, expires_at) VALUES (?, ?, ?, ?, ?)',
+            (document_id, document['filename'], document['upload_time'], content_hash, document.get('expires_at'))
+        )
+        return created
+    
+    def _store(self, document_id, document, expected_hash=None):
+        """Write a document and its content, raising DocumentConflict if it no longer points at expected_hash"""
+        content_hash = document['content_hash']
+        # A delta's index is rebuilt from its text on load, so it is never pickled
+        index_data = self.serialize_index(document.get('index')) if document.get('base_hash') is None else None
+        with self.connection() as conn:
+            previous = conn.execute('SELECT content_hash FROM documents WHERE document_id = ? AND expired = 0', (document_id,)).fetchone()
+            if expected_hash is not None and (previous is None or previous[0] != expected_hash):
+                raise DocumentConflict(document_id)
+            created = self._insert(conn, document_id, document, index_data)
+            released = []
+            retired = []
+            if previous is not None:
+                released = self._release(conn, previous[0])
+                # Content kept only for the deltas extending it is no longer read directly, so it leaves memory too
+                if not released and conn.execute('SELECT 1 FROM contents WHERE content_hash = ? AND refcount <= 0', (previous[0],)).fetchone():
+                    retired = [(previous[0], None)]
+                self._record_event(conn, document_id, released or retired)
+        
+        self._forget(document_id)
+        if created:
+            index_size = len(index_data) if index_data is not None else self.index_size(document.get('index'))
+            evicted = self._cache(content_hash, {key: document[key] for key in ('filepath', 'text', 'summary', 'index')},
+                                  len(document['text']) + len(document['summary']) + index_size)
+            self._notify([content_hash] + evicted)
+        for released_hash, _ in released + retired:
+            self.uncache(released_hash)
+        return created, released
+    
+    def link(self, document_id, filename, content_hash, expires_at=None):
+        """Point a new document at already stored content, returning False if the content is unknown"""
+        with self.connection() as conn:
+            if conn.execute('UPDATE contents SET refcount = refcount + 1 WHERE content_hash = ?', (content_hash,)).rowcount == 0:
+                return False
+            self._refresh_chain_targets(conn, content_hash)
+            conn.execute(
+                'INSERT INTO documents (document_id, filename, upload_time, content_hash, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (document_id, filename, datetime.now().isoformat(), content_hash, expires_at)
+            )
+        return True
+    
+    def _release(self, conn, content_hash):
+        """Drop one reference to content, deleting it once unreferenced and returning (content_hash, filepath) of each
+        deleted record; content that deltas extend is deleted with the last of them"""
+        conn.execute('UPDATE contents SET refcount = refcount - 1 WHERE content_hash = ?', (content_hash,))
+        released = []
+        while content_hash is not None:
+            row = conn.execute('SELECT filepath, base_hash FROM contents WHERE content_hash = ? AND refcount <= 0 AND extensions <= 0', (content_hash,)).fetchone()
+            if row is None:
+                break
+            conn.execute('DELETE FROM contents WHERE content_hash = ?', (content_hash,))
+            released.append((content_hash, row[0]))
+            content_hash = row[1]
+            if content_hash is not None:
+                conn.execute('UPDATE contents SET extensions = extensions - 1 WHERE content_hash = ?', (content_hash,))
+        self._refresh_chain_targets(conn, content_hash, [released_hash for released_hash, _ in released])
+        return released
+    
+    def _refresh_chain_targets(self, conn, content_hash, removed=()):
+        """Rewrite the chain_targets rows of the delta chains sharing a content record with its own, after references to
+        them, deltas built on them or the removed records changed"""
+        stale = [*removed, content_hash] if content_hash is not None else list(removed)
+        
+        # Up to the content stored in full that the chains start from, through the chain index only
+        root = None
+        while content_hash is not None:
+            row = conn.execute('SELECT base_hash, refcount FROM contents INDEXED BY contents_chains WHERE content_hash = ? AND (base_hash IS NOT NULL OR extensions > 0)',
+                               (content_hash,)).fetchone()
+            if row is None:
+                break
+            root, root_refcount = content_hash, row[1]
+            content_hash = row[0]
+        
+        # Then down through every delta built on it
+        bases = {}
+        live = []
+        if root is not None:
+            if root_refcount > 0:
+                live.append(root)
+            bases[root] = None
+            pending = [root]
+            while pending:
+                base_hash = pending.pop()
+                for delta_hash, refcount in conn.execute('SELECT content_hash, refcount FROM contents INDEXED BY contents_bases WHERE base_hash = ?', (base_hash,)):
+                    bases[delta_hash] = base_hash
+                    if refcount > 0:
+                        live.append(delta_hash)
+                    pending.append(delta_hash)
+        
+        stale.extend(bases)
+        for start in range(0, len(stale), 500):
+            batch = stale[start:start + 500]
+            conn.execute(f"DELETE FROM chain_targets WHERE content_hash IN ({','.join('?' * len(batch))})", batch)
+        rows = []
+        for target_hash in live:
+            member = target_hash
+            while member is not None:
+                rows.append((member, target_hash))
+                member = bases[member]
+        conn.executemany('INSERT INTO chain_targets (content_hash, target_hash) VALUES (?, ?)', rows)
+    
+    def __delitem__(self, document_id):
+        with self.connection() as conn:
+            row = conn.execute('SELECT content_hash, expired FROM documents WHERE document_id = ?', (document_id,)).fetchone()
+            if row is None:
+                raise KeyError(document_id)
+            conn.execute('DELETE FROM documents WHERE document_id = ?', (document_id,))
+            released = self._release(conn, row[0]) if not row[1] else []
+            self._record_event(conn, document_id, released)
+        self._forget(document_id)
+        for released_hash, _ in released:
+            self.uncache(released_hash)
+        return released
+    
+    def __len__(self):
+        return self.connection().execute('SELECT COUNT(*) FROM documents WHERE expired = 0').fetchone()[0]
+    
+    def _cache(self, content_hash, content, size):
+        """Keep content in memory, returning the hashes of content evicted to stay under budget"""
+        with self.lock:
+            previous = self.cache.pop(content_hash, None)
+            if previous is not None:
+                self.cached_bytes -= previous[1]
+                self._drop_owner(previous[0])
+            self.cache[content_hash] = (content, size)
+            self.cached_bytes += size
+            if content.get('index') is not None:
+                self.index_owners[id(content['index'])] = content_hash
+            return self._evict()
+    
+    def _evict(self):
+        """Evict least recently used content while over budget, returning the evicted hashes; called with the lock held"""
+        evicted = []
+        # Evicted content stays on disk and is reloaded on next access
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            evicted_hash, (evicted_content, evicted_size) = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted_size
+            self.evictions += 1
+            self._drop_owner(evicted_content)
+            self._drop_aliases(evicted_hash)
+            evicted.append(evicted_hash)
+        return evicted
+    
+    def _drop_owner(self, content):
+        if content.get('index') is not None:
+            self.index_owners.pop(id(content['index']), None)
+    
+    def _drop_aliases(self, content_hash):
+        for document_id in self.aliases.pop(content_hash, ()):
+            self.metadata.pop(document_id, None)
+    
+    def _forget(self, document_id):
+        """Drop a document's cached metadata, leaving its shared content cached"""
+        with self.lock:
+            metadata = self.metadata.pop(document_id, None)
+            if metadata is not None:
+                self.aliases.get(metadata['content_hash'], set()).discard(document_id)
+    
+    def _notify(self, content_hashes):
+        for content_hash in content_hashes:
+            for listener in self.listeners:
+                listener(content_hash)
+    
+    def uncache(self, content_hash):
+        """Drop content from memory only"""
+        with self.lock:
+            entry = self.cache.pop(content_hash, None)
+            if entry is not None:
+                self.cached_bytes -= entry[1]
+                self._drop_owner(entry[0])
+            self._drop_aliases(content_hash)
+        self._notify([content_hash])
+    
+    def is_expired(self, document_id):
+        """Check whether a document existed but has passed its time-to-live"""
+        row = self.connection().execute('SELECT expires_at, expired FROM documents WHERE document_id = ?', (document_id,)).fetchone()
+        return row is not None and (bool(row[1]) or (row[0] is not None and row[0] <= time.time()))
+    
+    def expire_documents(self):
+        """Expire documents past their time-to-live, returning (content_hash, filepath) for content no longer referenced"""
+        conn = self.connection()
+        rows = conn.execute(
+            'SELECT document_id, content_hash FROM documents WHERE expires_at IS NOT NULL AND expired = 0 AND expires_at <= ?',
+            (time.time(),)
+        ).fetchall()
+        
+        released = []
+        expired = 0
+        for document_id, content_hash in rows:
+            # Keep a small tombstone so requests can report the document as expired
+            with conn:
+                # Another worker's sweeper may have expired it first
+                if conn.execute('UPDATE documents SET expired = 1, content_hash = NULL WHERE document_id = ? AND expired = 0', (document_id,)).rowcount == 0:
+                    continue
+                unreferenced = self._release(conn, content_hash)
+                self._record_event(conn, document_id, unreferenced)
+            expired += 1
+            self._forget(document_id)
+            for released_hash, _ in unreferenced:
+                self.uncache(released_hash)
+            released.extend(unreferenced)
+        
+        # Every process syncs on each request, so old events are no longer needed
+        with conn:
+            conn.execute('DELETE FROM document_events WHERE created < ?', (time.time() - self.EVENT_RETENTION,))
+        
+        with self.lock:
+            self.expirations += expired
+        return released
+    
+    def _record_event(self, conn, document_id, released):
+        """Log a removed or replaced document, and any content released with it, for other processes"""
+        created = time.time()
+        conn.executemany('INSERT INTO document_events (document_id, content_hash, created) VALUES (?, ?, ?)',
+                         [(document_id, content_hash, created) for content_hash, _ in released] or [(document_id, None, created)])
+    
+    def sync(self):
+        """Drop cached documents and content that another process removed, replaced or expired"""
+        rows = self.connection().execute(
+            'SELECT event_id, document_id, content_hash FROM document_events WHERE event_id > ? ORDER BY event_id', (self.last_event,)
+        ).fetchall()
+        if not rows:
+            return 0
+        
+        with self.lock:
+            self.last_event = max(self.last_event, rows[-1][0])
+        for _, document_id, content_hash in rows:
+            if document_id is not None:
+                self._forget(document_id)
+            if content_hash is not None:
+                self.uncache(content_hash)
+        return len(rows)
+    
+    def find_content(self, content_hashes, document_ids=None):
+        """Map content hashes to one live document each, preferring the given documents and then the newest upload"""
+        content_hashes = list(content_hashes)
+        found = {}
+        conn = self.connection()
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(content_hashes), 500):
+            batch = content_hashes[start:start + 500]
+            rows = conn.execute(
+                f"SELECT content_hash, document_id FROM documents WHERE expired = 0 AND content_hash IN ({','.join('?' * len(batch))}) ORDER BY upload_time DESC",
+                batch
+            )
+            for content_hash, document_id in rows:
+                if document_ids is None or document_id in document_ids:
+                    found.setdefault(content_hash, document_id)
+        return found
+    
+    def content_hashes(self, document_ids):
+        """Content hashes of the given live documents"""
+        document_ids = list(document_ids)
+        hashes = set()
+        conn = self.connection()
+        for start in range(0, len(document_ids), 500):
+            batch = document_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT content_hash FROM documents WHERE expired = 0 AND document_id IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            hashes.update(row[0] for row in rows)
+        return hashes
+    
+    def known_files(self):
+        """File paths of all stored content"""
+        return {row[0] for row in self.connection().execute('SELECT filepath FROM contents')}
+    
+    def cache_stats(self):
+        """Cache size and effectiveness counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'contents': len(self.cache),
+                'bytes': self.cached_bytes,
+                'budget_bytes': self.cache_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expired': self.expirations
+            }
+
+class CorpusIndex:
+    """Corpus-level inverted index for ranking paragraphs across documents"""
+    
+    INSERT_POSTINGS = 'INSERT OR REPLACE INTO corpus_postings (term, content_hash, paragraph_ids, frequencies) VALUES (?, ?, ?, ?)'
+    INSERT_DOCUMENT = 'INSERT OR REPLACE INTO corpus_documents (content_hash, paragraph_count, token_count, paragraph_lengths, token_lengths, pattern_bonuses) VALUES (?, ?, ?, ?, ?, ?)'
+    
+    def __init__(self, store):
+        self.store = store
+        self.index_missing()
+    
+    def index_missing(self):
+        """Add stored content that is not in the corpus yet, such as content migrated from an older database"""
+        conn = self.store.connection()
+        rows = conn.execute('SELECT content_hash, text, index_data FROM contents WHERE index_data IS NOT NULL AND content_hash NOT IN (SELECT content_hash FROM corpus_documents)')
+        for content_hash, text, index_data in rows.fetchall():
+            self.add_document(content_hash, self.store.load_index(content_hash, text, index_data))
+    
+    def add_document(self, content_hash, index):
+        """Merge a content record's paragraph index into the corpus"""
+        with self.store.connection() as conn:
+            conn.execute('DELETE FROM corpus_postings WHERE content_hash = ?', (content_hash,))
+            self._write_postings(conn, content_hash, index, index['postings'])
+    
+    def add_documents(self, rows):
+        """Merge the document_rows of several content records into the corpus in one transaction"""
+        # Inserting in key order touches each B-tree page once instead of once per document
+        postings = sorted(row for document_postings, _ in rows for row in document_postings)
+        with self.store.connection() as conn:
+            conn.executemany('DELETE FROM corpus_postings WHERE content_hash = ?', ((stats[0],) for _, stats in rows))
+            conn.executemany(self.INSERT_POSTINGS, postings)
+            conn.executemany(self.INSERT_DOCUMENT, (stats for _, stats in rows))
+    
+    def extend_document(self, source_chain, source_index, content_hash, index, delta=False):
+        """Add content whose index extends an indexed content record; source_chain is as for DocumentStore.delta_chain.
+        A delta keeps only the postings its new paragraphs added, which search joins onto its base's, while content stored
+        in full copies the postings of terms neither the new text nor the chain's deltas changed"""
+        with self.store.connection() as conn:
+            conn.execute('DELETE FROM corpus_postings WHERE content_hash = ?', (content_hash,))
+            # Extended indexes share the arrays of terms the new text doesn't use
+            changed = {token_id for token_id, paragraph_ids in index['postings'].items() if source_index['postings'].get(token_id) is not paragraph_ids}
+            if delta:
+                self._write_postings(conn, content_hash, index, changed, source_index)
+                return
+            
+            copied = conn.execute(
+                'INSERT INTO corpus_postings (term, content_hash, paragraph_ids, frequencies) '
+                'SELECT term, ?, paragraph_ids, frequencies FROM corpus_postings WHERE content_hash = ?',
+                (content_hash, source_chain[-1])
+            ).rowcount
+            if not copied:
+                changed = set(index['postings'])
+            for delta_hash in source_chain[:-1]:
+                terms = [row[0] for row in conn.execute('SELECT term FROM corpus_postings WHERE content_hash = ?', (delta_hash,))]
+                changed.update(vocabulary.lookup(terms).values())
+            self._write_postings(conn, content_hash, index, changed)
+    
+    def _write_postings(self, conn, content_hash, index, token_ids, source_index=None):
+        """Write the postings of the given terms and the paragraph statistics of a content record"""
+        postings, stats = self.document_rows(content_hash, index, token_ids, source_index)
+        conn.executemany(self.INSERT_POSTINGS, postings)
+        conn.execute(self.INSERT_DOCUMENT, stats)
+    
+    @staticmethod
+    def document_rows(content_hash, index, token_ids=None, source_index=None):
+        """Return (corpus_postings rows, corpus_documents row) for the given terms of a content record, or all of them;
+        with a source_index the postings rows hold only what was added since it"""
+        source_postings = source_index['postings'] if source_index is not None else {}
+        postings = []
+        for token_id in (index['postings'] if token_ids is None else token_ids):
+            skip = len(source_postings.get(token_id, ()))
+            postings.append((vocabulary.term(token_id), content_hash, index['postings'][token_id][skip:].tobytes(), index['term_frequencies'][token_id][skip:].tobytes()))
+        collapsed = NearDuplicates.collapsed(index)
+        stats = (content_hash, len(index['paragraphs']) - len(collapsed), sum(index['token_lengths']) - sum(index['token_lengths'][i] for i in collapsed),
+                 index['paragraph_lengths'].tobytes(), index['token_lengths'].tobytes(), index['pattern_bonuses'].tobytes())
+        return postings, stats
+    
+    def remove_document(self, content_hash):
+        """Drop a content record from the corpus"""
+        with self.store.connection() as conn:
+            conn.execute('DELETE FROM corpus_postings WHERE content_hash = ?', (content_hash,))
+            conn.execute('DELETE FROM corpus_documents WHERE content_hash = ?', (content_hash,))
+    
+    def document_stats(self, content_hashes):
+        """Load per-paragraph statistics for the given content records"""
+        content_hashes = list(content_hashes)
+        stats = {}
+        conn = self.store.connection()
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(content_hashes), 500):
+            batch = content_hashes[start:start + 500]
+            rows = conn.execute(
+                f"SELECT content_hash, paragraph_lengths, token_lengths, pattern_bonuses FROM corpus_documents WHERE content_hash IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            for content_hash, paragraph_lengths, token_lengths, pattern_bonuses in rows:
+                stats[content_hash] = {
+                    'paragraph_lengths': array('I', paragraph_lengths),
+                    'token_lengths': array('I', token_lengths),
+                    'pattern_bonuses': array('d', pattern_bonuses)
+                }
+        return stats
+    
+    def chain_targets(self, conn, content_hashes):
+        """Map those of the content records that are in delta chains to the live records whose postings include their own,
+        themselves if live and the live deltas built on them"""
+        content_hashes = list(content_hashes)
+        targets = {}
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(content_hashes), 500):
+            batch = content_hashes[start:start + 500]
+            rows = conn.execute(f"SELECT content_hash, target_hash FROM chain_targets WHERE content_hash IN ({','.join('?' * len(batch))})", batch)
+            for content_hash, target_hash in rows:
+                targets.setdefault(content_hash, []).append(target_hash)
+        return targets
+    
+    def search(self, question_words, max_results=10, content_hashes=None, scorer='legacy'):
+        """Rank paragraphs across documents, returning (score, content_hash, paragraph index) tuples"""
+        if scorer not in RankingEngine.SCORERS:
+            raise ValueError(f"Unknown scorer '{scorer}'. Available scorers: {', '.join(RankingEngine.SCORERS)}")
+        if not question_words:
+            return []
+        
+        question_words = list(question_words)
+        conn = self.store.connection()
+        rows = conn.execute(
+            f"SELECT term, content_hash, paragraph_ids, frequencies FROM corpus_postings WHERE term IN ({','.join('?' * len(question_words))})",
+            question_words
+        ).fetchall()
+        
+        # Group postings by term and live content, decoding only documents in scope; a delta's postings continue
+        # those of the records it extends, which aren't searched themselves once no document uses them
+        scope = set(content_hashes) if content_hashes is not None else None
+        targets = self.chain_targets(conn, {row[1] for row in rows})
+        pieces = {}
+        document_frequencies = Counter()
+        for term, content_hash, paragraph_ids, frequencies in rows:
+            paragraph_ids = array('I', paragraph_ids)
+            for target in targets.get(content_hash, (content_hash,)):
+                document_frequencies[term] += len(paragraph_ids)
+                if scope is None or target in scope:
+                    pieces.setdefault((term, target), []).append((paragraph_ids, frequencies))
+        
+        term_postings = {}
+        for (term, content_hash), parts in pieces.items():
+            parts.sort(key=lambda part: part[0][0])
+            paragraph_ids, frequencies = array('I'), array('I')
+            for part_ids, part_frequencies in parts:
+                paragraph_ids += part_ids
+                frequencies.frombytes(part_frequencies)
+            term_postings.setdefault(term, []).append((content_hash, paragraph_ids, frequencies))
+        
+        if not term_postings:
+            return []
+        
+        stats = self.document_stats({content_hash for postings in term_postings.values() for content_hash, _, _ in postings})
+        scores = {}
+        
+        if scorer == 'bm25':
+            # Corpus-wide statistics so scores are comparable across documents
+            paragraph_count, token_count = conn.execute(
+                'SELECT COALESCE(SUM(paragraph_count), 0), COALESCE(SUM(token_count), 0) FROM corpus_documents WHERE content_hash NOT IN '
+                '(SELECT content_hash FROM contents WHERE (base_hash IS NOT NULL OR extensions > 0) AND refcount <= 0)'
+            ).fetchone()
+            average_length = token_count / paragraph_count if paragraph_count else 1.0
+            k1, b = RankingEngine.BM25_K1, RankingEngine.BM25_B
+            for term, postings in term_postings.items():
+                document_frequency = document_frequencies[term]
+                idf = math.log(1 + (paragraph_count - document_frequency + 0.5) / (document_frequency + 0.5))
+                for content_hash, paragraph_ids, frequencies in postings:
+                    token_lengths = stats[content_hash]['token_lengths']
+                    for i, tf in zip(paragraph_ids, frequencies):
+                        norm = k1 * (1 - b + b * token_lengths[i] / average_length)
+                        key = (content_hash, i)
+                        scores[key] = scores.get(key, 0) + idf * tf * (k1 + 1) / (tf + norm)
+        else:
+            for postings in term_postings.values():
+                for content_hash, paragraph_ids, _ in postings:
+                    for i in paragraph_ids:
+                        key = (content_hash, i)
+                        scores[key] = scores.get(key, 0) + 1
+            
+            # Same overlap + density + length + pattern score as a single document
+            for (content_hash, i), word_overlap in scores.items():
+                document_stats = stats[content_hash]
+                density_score = word_overlap / len(question_words)
+                length_bonus = min(document_stats['paragraph_lengths'][i] / 100, 1.0)
+                scores[(content_hash, i)] = word_overlap + (density_score * 2) + length_bonus + document_stats['pattern_bonuses'][i]
+        
+        top = heapq.nlargest(max_results, scores.items(), key=lambda item: item[1])
+        return [(score, content_hash, i) for (content_hash, i), score in top]
+
+class Vocabulary:
+    """Shared mapping of terms to integer token IDs, persisted so every process and restart agrees on them"""
+    
+    def __init__(self, store):
+        self.store = store
+        self.ids = {}
+        self.terms = {}
+        self.lock = threading.Lock()
+        
+        with store.connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS vocabulary (token_id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE)')
+            self._remember(conn.execute('SELECT token_id, term FROM vocabulary'))
+    
+    def intern(self, terms):
+        """Return {term: token_id}, assigning IDs to new terms"""
+        missing = [term for term in terms if term not in self.ids]
+        if missing:
+            with self.lock:
+                with self.store.connection() as conn:
+                    conn.executemany('INSERT OR IGNORE INTO vocabulary (term) VALUES (?)', ((term,) for term in missing))
+                self._fetch(missing)
+        return {term: self.ids[term] for term in terms}
+    
+    def lookup(self, terms):
+        """Return {term: token_id} for the terms that have an ID"""
+        missing = [term for term in terms if term not in self.ids]
+        if missing:
+            # Another process may have added them since this one loaded the vocabulary
+            self._fetch(missing)
+        return {term: self.ids[term] for term in terms if term in self.ids}
+    
+    def term(self, token_id):
+        """Return the term for a token ID"""
+        term = self.terms.get(token_id)
+        if term is None:
+            row = self.store.connection().execute('SELECT token_id, term FROM vocabulary WHERE token_id = ?', (token_id,)).fetchone()
+            if row is None:
+                raise KeyError(token_id)
+            self._remember([row])
+            term = row[1]
+        return term
+    
+    def _fetch(self, terms):
+        conn = self.store.connection()
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(terms), 500):
+            batch = terms[start:start + 500]
+            self._remember(conn.execute(f"SELECT token_id, term FROM vocabulary WHERE term IN ({','.join('?' * len(batch))})", batch))
+    
+    def _remember(self, rows):
+        for token_id, term in rows:
+            self.ids[term] = token_id
+            self.terms[token_id] = term
+    
+    def __len__(self):
+        return len(self.ids)
+
+class AnswerCache:
+    """LRU cache of answers keyed by document content, normalized question, quoted phrases and scorer version"""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.keys_by_content = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def key(content_hash, question, scorer):
+        # Answers depend on the question's lowercase words and on which of them are quoted as phrases
+        normalized_question = ' '.join(re.findall(r'\b\w+\b', question.lower()))
+        phrases = TextAnalyzer.question_phrases(question)
+        return (content_hash, normalized_question, phrases, f"{scorer}:{RankingEngine.SCORER_VERSIONS[scorer]}")
+    
+    def get(self, content_hash, question, scorer):
+        """Return a memoized answer, or None"""
+        key = self.key(content_hash, question, scorer)
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+    
+    def put(self, content_hash, question, scorer, result):
+        """Memoize an answer, evicting the least recently used answers over the size limit"""
+        if self.max_entries <= 0:
+            return
+        key = self.key(content_hash, question, scorer)
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            self.keys_by_content.setdefault(content_hash, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                evicted_key, _ = self.entries.popitem(last=False)
+                self._forget(evicted_key)
+                self.evictions += 1
+    
+    def invalidate_content(self, content_hash):
+        """Drop every answer memoized for a content record"""
+        with self.lock:
+            keys = self.keys_by_content.pop(content_hash, ())
+            for key in keys:
+                del self.entries[key]
+            self.invalidations += len(keys)
+    
+    def _forget(self, key):
+        keys = self.keys_by_content.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_content[key[0]]
+    
+    def stats(self):
+        """Cache size and effectiveness counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+class StageTimer:
+    """Context manager recording how long a pipeline stage took"""
+    
+    __slots__ = ('metrics', 'name', 'started')
+    
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.metrics.observe_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+class Metrics:
+    """Request and pipeline stage counters and latency histograms, rendered in Prometheus text format"""
+    
+    # Histogram bucket upper bounds in seconds
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self, prefix='research_assistant'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.requests = {}
+        # key -> [count per bucket..., count above the last bucket, sum of observations]
+        self.request_latency = {}
+        self.stage_latency = {}
+    
+    def stage(self, name):
+        """Time a block of work as the named pipeline stage"""
+        return StageTimer(self, name)
+    
+    def observe_request(self, route, method, status, seconds):
+        with self.lock:
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._observe(self.request_latency, (route, method), seconds)
+    
+    def observe_stage(self, name, seconds):
+        with self.lock:
+            self._observe(self.stage_latency, (name,), seconds)
+    
+    def _observe(self, histograms, key, seconds):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+    
+    @staticmethod
+    def _labels(names, values):
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+        return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+    
+    def _histogram(self, lines, name, label_names, histograms):
+        for key, histogram in sorted(histograms.items()):
+            labels = self._labels(label_names, key)
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram[-1]}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+    
+    def render(self, gauges=(), counters=()):
+        """Prometheus text exposition of all metrics plus the given (name, help, value) gauges and counters"""
+        with self.lock:
+            requests = dict(self.requests)
+            request_latency = {key: list(histogram) for key, histogram in self.request_latency.items()}
+            stage_latency = {key: list(histogram) for key, histogram in self.stage_latency.items()}
+        
+        lines = []
+        name = f'{self.prefix}_http_requests_total'
+        lines += [f'# HELP {name} HTTP requests by route, method and status', f'# TYPE {name} counter']
+        for key, count in sorted(requests.items()):
+            lines.append(f"{name}{{{self._labels(('route', 'method', 'status'), key)}}} {count}")
+        
+        name = f'{self.prefix}_http_request_duration_seconds'
+        lines += [f'# HELP {name} HTTP request latency by route and method', f'# TYPE {name} histogram']
+        self._histogram(lines, name, ('route', 'method'), request_latency)
+        
+        name = f'{self.prefix}_stage_duration_seconds'
+        lines += [f'# HELP {name} Latency of pipeline stages', f'# TYPE {name} histogram']
+        self._histogram(lines, name, ('stage',), stage_latency)
+        
+        for kind, values in (('gauge', gauges), ('counter', counters)):
+            for metric, description, value in values:
+                name = f'{self.prefix}_{metric}'
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name} {value}']
+        
+        return '\n'.join(lines) + '\n'
+
+# Request and stage metrics exposed at /metrics
+metrics = Metrics()
+
+# Persistent document storage, loaded lazily by document_id
+documents = DocumentStore(app.config['DATABASE_PATH'], app.config['DOCUMENT_CACHE_BYTES'])
+
+# Token IDs shared by every document index
+vocabulary = Vocabulary(documents)
+
+# Shared corpus index, updated incrementally on each upload
+corpus_index = CorpusIndex(documents)
+
+# Memoized answers, shared by duplicate uploads and dropped whenever their content changes or leaves memory
+answer_cache = AnswerCache(app.config['ANSWER_CACHE_SIZE'])
+documents.listeners.append(answer_cache.invalidate_content)
+
+# Uploaded files are named "<document_id>_<original filename>"
+UPLOAD_FILENAME_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_')
+
+def remove_file(path):
+    """Delete a file unless another worker already did, returning whether it was removed here"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def sweep_documents():
+    """Expire documents past their TTL and delete upload files no document refers to"""
+    for content_hash, filepath in documents.expire_documents():
+        corpus_index.remove_document(content_hash)
+        remove_file(filepath)
+        logger.info(f"Content released: {content_hash}")
+    
+    for filepath in chunked_uploads.expire():
+        remove_file(filepath)
+        logger.info(f"Discarded idle chunked upload: {filepath}")
+    
+    # Leave recent files alone, they may belong to an upload still in progress
+    known_files = {os.path.abspath(path) for path in documents.known_files() | chunked_uploads.known_files() | ingest_queue.known_files()}
+    cutoff = time.time() - app.config['SWEEP_INTERVAL']
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            if not entry.is_file() or not UPLOAD_FILENAME_PATTERN.match(entry.name):
+                continue
+            if os.path.abspath(entry.path) in known_files or entry.stat().st_mtime > cutoff:
+                continue
+            if remove_file(entry.path):
+                logger.info(f"Removed orphaned upload: {entry.name}")
+
+def start_sweeper():
+    """Run sweep_documents periodically in a daemon thread"""
+    def run():
+        while True:
+            time.sleep(app.config['SWEEP_INTERVAL'])
+            try:
+                sweep_documents()
+            except Exception as e:
+                logger.error(f"Sweep error: {e}")
+    
+    thread = threading.Thread(target=run, name='document-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+if app.config['SWEEP_INTERVAL'] > 0:
+    start_sweeper()
+
+def summary_time_budget():
+    """Configured summary budget in seconds, or None when unlimited"""
+    return app.config['SUMMARY_TIME_BUDGET_MS'] / 1000 if app.config['SUMMARY_TIME_BUDGET_MS'] > 0 else None
+
+def process_document(document_id, filename, filepath, ttl, progress=None, content_hash=None, extracted=None):
+    """Extract, summarize, index and store an uploaded file, returning the stored document;
+    extracted is (text, index) when a chunked upload already did the first steps while it arrived"""
+    document = prepare_document(filename, filepath, ttl, progress, content_hash, extracted)
+    with metrics.stage('store'):
+        created = documents.add(document_id, document)
+        if created:
+            corpus_index.add_document(document['content_hash'], document['index'])
+    if not created and os.path.exists(filepath):
+        # An identical upload finished first, keep its file and drop ours
+        os.remove(filepath)
+    
+    logger.info(f"Document uploaded successfully: {document_id}")
+    return document
+
+def prepare_document(filename, filepath, ttl, progress=None, content_hash=None, extracted=None):
+    """Extract, index and summarize a saved file into a document ready to store"""
+    def report(stage, **details):
+        if progress:
+            progress(stage, **details)
+    
+    # Extract text based on file type
+    page_offsets = None
+    if extracted is not None:
+        text, index = extracted
+    else:
+        report('extracting')
+        if filename.lower().endswith('.pdf'):
+            with metrics.stage('extract_pdf'):
+                text, page_offsets = DocumentProcessor.extract_pdf_pages(filepath, progress=lambda pages_done: report('extracting', pages_done=pages_done))
+        else:
+            with metrics.stage('extract_txt'):
+                text = DocumentProcessor.extract_text_from_txt(filepath)
+    
+    if not text.strip():
+        raise ValueError('No text could be extracted from the document')
+    
+    # Index paragraphs once so questions don't re-tokenize the document
+    if extracted is None:
+        report('indexing')
+        with metrics.stage('index'):
+            index = DocumentProcessor.build_index(text, page_offsets)
+    
+    # Generate summary
+    report('summarizing')
+    with metrics.stage('summarize'):
+        summary = TextAnalyzer.generate_summary(text, app.config['SUMMARY_MAX_WORDS'], index=index, time_budget=summary_time_budget())
+    
+    # Document data
+    return {
+        'filename': filename,
+        'filepath': filepath,
+        'text': text,
+        'summary': summary,
+        'index': index,
+        'content_hash': content_hash or DocumentProcessor.hash_file(filepath),
+        'upload_time': datetime.now().isoformat(),
+        'expires_at': time.time() + ttl if ttl > 0 else None
+    }
+
+def append_document(document_id, document, text, page_offsets=None):
+    """Append text to a stored document, indexing only the new paragraphs, and return the updated document"""
+    source_index = document['index']
+    with metrics.stage('index'):
+        full_text, index = DocumentProcessor.append_text(document['text'], source_index, [(text, page_offsets)])
+    with metrics.stage('summarize'):
+        time_budget = summary_time_budget()
+        if NUMPY_SUPPORT:
+            # Ranked on from the sentence ranking of the text before, rather than over the whole document
+            Summarizer.extend_ranking(source_index, index, time_budget)
+        summary = TextAnalyzer.generate_summary(full_text, app.config['SUMMARY_MAX_WORDS'], index=index, time_budget=time_budget)
+    
+    # Content other documents share stays as it is; the extended text becomes new content whose hash
+    # depends on what it extends, so identical appends to shared content are shared again
+    updated = {
+        'filename': document['filename'],
+        'filepath': '',
+        'text': full_text,
+        'summary': summary,
+        'index': index,
+        'content_hash': hashlib.sha256(f"{document['content_hash']}\0{text}".encode('utf-8')).hexdigest(),
+        'upload_time': document['upload_time'],
+        'expires_at': document['expires_at']
+    }
+    
+    # Appends are stored as deltas of their own text on top of the content they extend, up to APPEND_CHAIN_LIMIT
+    # in a row; the next one stores the whole document again so loading it doesn't replay a long chain
+    chain = documents.delta_chain(document['content_hash'])
+    delta = len(chain) <= app.config['APPEND_CHAIN_LIMIT']
+    if delta:
+        updated.update(base_hash=document['content_hash'], appended=text, appended_pages=page_offsets)
+    
+    with metrics.stage('store'):
+        created, released = documents.update(document_id, updated, document['content_hash'])
+        if created:
+            corpus_index.extend_document(chain, source_index, updated['content_hash'], index, delta)
+        for content_hash, filepath in released:
+            corpus_index.remove_document(content_hash)
+            if filepath:
+                remove_file(filepath)
+    
+    logger.info(f"Document appended: {document_id}")
+    return updated
+
+INGEST_EXTENSIONS = ('.pdf', '.txt')
+
+def find_ingest_files(paths, manifest=None):
+    """List the files to ingest: PDF and TXT files under directories, plus named files and manifest entries"""
+    paths = list(paths)
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as file:
+            paths.extend(line.strip() for line in file if line.strip() and not line.lstrip().startswith('#'))
+    
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                found.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(INGEST_EXTENSIONS))
+        else:
+            found.append(path)
+    # A file named twice, say in a directory and a manifest, is ingested once
+    return list(dict.fromkeys(found))
+
+def init_ingest_worker():
+    """Extract PDFs in-process inside ingest workers, the pool already keeps every core busy"""
+    app.config['WORKER_PROCESSES'] = 1
+
+def hash_ingest_file(path):
+    """Return (content_hash, size, error) for a file to ingest, run inside a worker process"""
+    if not path.lower().endswith(INGEST_EXTENSIONS):
+        return None, 0, 'Only PDF and TXT files are supported'
+    try:
+        return DocumentProcessor.hash_file(path), os.path.getsize(path), None
+    except OSError as e:
+        return None, 0, str(e)
+
+def ingest_file(path, filepath, content_hash, ttl):
+    """Copy a file to its place in the upload folder and prepare its document, returning (document, index_data, corpus rows);
+    run inside a worker process, which also serializes the index so the process writing to the database only runs SQL"""
+    filename = os.path.basename(path)
+    shutil.copyfile(path, filepath)
+    try:
+        document = prepare_document(filename, filepath, ttl, content_hash=content_hash)
+    except Exception:
+        remove_file(filepath)
+        raise
+    index = document.pop('index')
+    return document, DocumentStore.serialize_index(index), CorpusIndex.document_rows(document['content_hash'], index)
+
+def store_ingested(batch):
+    """Write (document_id, document, index_data, corpus rows) tuples from ingest_file to the store and corpus in bulk"""
+    created = documents.add_many([(document_id, document, index_data) for document_id, document, index_data, _ in batch])
+    corpus_index.add_documents([rows for (_, _, _, rows), new in zip(batch, created) if new])
+    for (_, document, _, _), new in zip(batch, created):
+        if not new:
+            # A server stored the same content meanwhile, the document shares its file
+            remove_file(document['filepath'])
+
+def ingest_files(paths, workers, ttl, batch_size=64, on_result=None, on_progress=None):
+    """Ingest files with a process pool, skipping content already stored and writing documents in batches;
+    on_result receives a record per file and on_progress the running totals, which are returned"""
+    totals = {'files': len(paths), 'done': 0, 'bytes': 0, 'ingested': 0, 'skipped': 0, 'duplicate': 0, 'failed': 0}
+    outcomes = {}
+    
+    def finish(path, status, document_id=None, error=None, size=0):
+        totals['done'] += 1
+        totals['bytes'] += size
+        totals[status] += 1
+        if on_result:
+            on_result({'path': path, 'status': status, 'document_id': document_id, 'error': error})
+        if on_progress:
+            on_progress(totals)
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_ingest_worker) as pool:
+        # Hash everything first so content already in the store is never extracted again
+        hashed = list(pool.map(hash_ingest_file, paths, chunksize=max(1, min(64, len(paths) // (workers * 4)))))
+        stored = documents.find_content({content_hash for content_hash, _, _ in hashed if content_hash})
+        
+        pending = deque()
+        duplicates = []
+        for path, (content_hash, size, error) in zip(paths, hashed):
+            if content_hash is None:
+                finish(path, 'failed', error=error)
+            elif content_hash in stored:
+                finish(path, 'skipped', stored[content_hash], size=size)
+            elif content_hash in outcomes:
+                duplicates.append((path, content_hash, size))
+            else:
+                outcomes[content_hash] = None
+                pending.append((path, str(uuid.uuid4()), content_hash, size))
+        
+        in_flight = {}
+        batch = []
+        sizes = {}
+        while pending or in_flight:
+            # A few files per worker keeps every core busy without holding many documents in memory
+            submitted = [pending.popleft() for _ in range(min(len(pending), workers * 4 - len(in_flight)))]
+            files = [(document_id, os.path.basename(path), os.path.join(app.config['UPLOAD_FOLDER'], f"{document_id}_{os.path.basename(path)}"))
+                     for path, document_id, _, _ in submitted]
+            # The copies are tracked as jobs, so a server's sweeper leaves them alone until they are stored
+            job_ids = ingest_queue.track(files) if files else []
+            for (path, document_id, content_hash, size), (_, _, filepath), job_id in zip(submitted, files, job_ids):
+                in_flight[pool.submit(ingest_file, path, filepath, content_hash, ttl)] = (path, document_id, content_hash, size, job_id)
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, document_id, content_hash, size, job_id = in_flight.pop(future)
+                try:
+                    batch.append((document_id, *future.result()))
+                    sizes[document_id] = path, size, job_id
+                except Exception as e:
+                    ingest_queue.finish([job_id], error=str(e))
+                    outcomes[content_hash] = ('failed', None, str(e))
+                    finish(path, 'failed', error=str(e), size=size)
+            
+            if batch and (len(batch) >= batch_size or not (pending or in_flight)):
+                store_ingested(batch)
+                ingest_queue.finish([sizes[document_id][2] for document_id, _, _, _ in batch])
+                for document_id, document, _, _ in batch:
+                    path, size, _ = sizes.pop(document_id)
+                    outcomes[document['content_hash']] = ('ingested', document_id, None)
+                    finish(path, 'ingested', document_id, size=size)
+                batch = []
+    
+    # Repeated content is stored once, later copies point at the first one's document
+    for path, content_hash, size in duplicates:
+        status, document_id, error = outcomes[content_hash]
+        finish(path, 'duplicate' if status == 'ingested' else status, document_id, error, size)
+    return totals
+
+class IngestQueue:
+    """Bounded queue of asynchronous uploads processed by background worker threads, with job status shared through the store"""
+    
+    # A finished job no longer holds its file, which is stored content or an orphan by then
+    UPDATE_JOB = ('UPDATE jobs SET stage = ?, pages_done = COALESCE(?, pages_done), error = COALESCE(?, error), updated = ?, '
+                  "filepath = CASE WHEN ? IN ('done', 'failed') THEN NULL ELSE filepath END WHERE job_id = ?")
+    
+    def __init__(self, store, workers, max_size, retention):
+        self.store = store
+        self.workers = workers
+        self.retention = retention
+        self.pending = queue.Queue(maxsize=max_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        
+        with store.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    document_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created TEXT NOT NULL,
+                    updated TEXT NOT NULL,
+                    filepath TEXT
+                )
+            """)
+            # Databases created before unfinished jobs kept their upload files from the sweeper lack the column
+            if 'filepath' not in {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}:
+                conn.execute('ALTER TABLE jobs ADD COLUMN filepath TEXT')
+    
+    def submit(self, document_id, filename, filepath, ttl, content_hash=None):
+        """Queue an upload for processing, raising queue.Full when the queue is at capacity"""
+        with self.lock:
+            self._prune()
+            # Record the job before a worker can pick it up and report progress
+            job_id, = self.track([(document_id, filename, filepath)])
+            try:
+                self.pending.put_nowait((job_id, filepath, ttl, content_hash))
+            except queue.Full:
+                with self.store.connection() as conn:
+                    conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+                raise
+            self._start_workers()
+        return job_id
+    
+    def track(self, files):
+        """Record (document_id, filename, filepath) files as queued jobs, returning their job IDs;
+        the files are kept from the sweeper until their jobs finish"""
+        now = datetime.now().isoformat()
+        job_ids = [str(uuid.uuid4()) for _ in files]
+        with self.store.connection() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (job_id, document_id, filename, stage, pages_done, created, updated, filepath) VALUES (?, ?, ?, 'queued', 0, ?, ?, ?)",
+                ((job_id, document_id, filename, now, now, filepath) for job_id, (document_id, filename, filepath) in zip(job_ids, files))
+            )
+        return job_ids
+    
+    def finish(self, job_ids, error=None):
+        """Mark jobs done, or failed with an error, releasing their files"""
+        stage = 'failed' if error is not None else 'done'
+        now = datetime.now().isoformat()
+        with self.store.connection() as conn:
+            conn.executemany(self.UPDATE_JOB, ((stage, None, error, now, stage, job_id) for job_id in job_ids))
+    
+    def known_files(self):
+        """Files of jobs still queued or running"""
+        return {row[0] for row in self.store.connection().execute('SELECT filepath FROM jobs WHERE filepath IS NOT NULL')}
+    
+    def status(self, job_id):
+        """Snapshot of a job's progress, or None if unknown"""
+        row = self.store.connection().execute(
+            'SELECT job_id, document_id, filename, stage, pages_done, error, created, updated FROM jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('job_id', 'document_id', 'filename', 'stage', 'pages_done', 'error', 'created', 'updated'), row))
+    
+    def depth(self):
+        return self.pending.qsize()
+    
+    def _update(self, job_id, stage, pages_done=None, error=None):
+        with self.store.connection() as conn:
+            conn.execute(self.UPDATE_JOB, (stage, pages_done, error, datetime.now().isoformat(), stage, job_id))
+    
+    def _prune(self):
+        """Forget finished jobs older than the retention period"""
+        cutoff = datetime.fromtimestamp(time.time() - self.retention).isoformat()
+        with self.store.connection() as conn:
+            conn.execute("DELETE FROM jobs WHERE stage IN ('done', 'failed') AND updated < ?", (cutoff,))
+    
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'ingest-worker-{len(self.threads)}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def _work(self):
+        while True:
+            job_id, filepath, ttl, content_hash = self.pending.get()
+            job = self.status(job_id)
+            try:
+                process_document(
+                    job['document_id'], job['filename'], filepath, ttl,
+                    progress=lambda stage, **details: self._update(job_id, stage=stage, **details),
+                    content_hash=content_hash
+                )
+                self.finish([job_id])
+            except Exception as e:
+                logger.error(f"Error processing document {job['document_id']}: {e}")
+                self.finish([job_id], error=str(e))
+            finally:
+                self.pending.task_done()
+
+# Background processing for asynchronous uploads
+ingest_queue = IngestQueue(documents, app.config['INGEST_WORKERS'], app.config['INGEST_QUEUE_SIZE'], app.config['JOB_RETENTION'])
+
+class UploadOffsetMismatch(Exception):
+    """Raised when a chunk does not start where the upload left off"""
+    
+    def __init__(self, offset):
+        super().__init__(f'Upload continues at offset {offset}')
+        self.offset = offset
+
+class ChunkedUploads:
+    """Resumable uploads sent in chunks at explicit offsets and written straight to disk, with text files
+    hashed, decoded and indexed while later chunks are still arriving"""
+    
+    # Characters of new text gathered before they are indexed
+    INDEX_STEP = 1024 * 1024
+    
+    # A blank line, after which earlier paragraphs can no longer change
+    PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n')
+    
+    def __init__(self, store, max_bytes, session_ttl):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
         
-        # Generate analytical questions based on content
-        questions.extend([
-            "What is the author's main argument or thesis?",
-            "What evidence does the author provide to support their claims?",
-            "What are the key takeaways from this document?",
-            "How does the author structure their argument?",
-            "What examples or case studies are mentioned?",
-            "What are the implications of the information presented?",
-            "What questions does this document raise?",
-            "How does this document relate to broader themes or issues?"
-        ])
+        # upload_id -> hashing and extraction state, kept while this process sees every chunk in order
+        self.streams = {}
+        self.lock = threading.Lock()
         
-        # Remove duplicates and shuffle
-        questions = list(set(questions))
-        random.shuffle(questions)
+        with store.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    upload_id TEXT PRIMARY KEY,
+                    document_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    filepath TEXT NOT NULL,
+                    size INTEGER,
+                    received INTEGER NOT NULL DEFAULT 0,
+                    ttl INTEGER NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+    
+    def create(self, filename, size, ttl):
+        """Start an upload of an optionally known size, returning its session"""
+        upload_id = str(uuid.uuid4())
+        document_id = str(uuid.uuid4())
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{document_id}_{filename}")
+        open(filepath, 'wb').close()
         
-        # Return a reasonable number of questions (5-8)
-        return questions[:min(8, len(questions))] if questions else [
-            "What is the main topic discussed in this document?",
-            "What are the key points mentioned in the text?",
-            "What conclusions can be drawn from this document?"
-        ]
+        with self.store.connection() as conn:
+            conn.execute(
+                'INSERT INTO upload_sessions (upload_id, document_id, filename, filepath, size, received, ttl, updated) VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+                (upload_id, document_id, filename, filepath, size, ttl, time.time())
+            )
+        with self.lock:
+            self.streams[upload_id] = self._new_stream(filename, filepath)
+        return self.get(upload_id)
     
-    @staticmethod
-    def evaluate_answer(document_text, question, user_answer):
-        """Evaluate user's answer against the document"""
-        # Get the "correct" answer from the document
-        correct_response = TextAnalyzer.answer_question(document_text, question)
+    def get(self, upload_id):
+        """Snapshot of an upload session, or None if unknown"""
+        row = self.store.connection().execute(
+            'SELECT upload_id, document_id, filename, filepath, size, received, ttl FROM upload_sessions WHERE upload_id = ?', (upload_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('upload_id', 'document_id', 'filename', 'filepath', 'size', 'received', 'ttl'), row))
+    
+    def write(self, upload_id, offset, stream, chunk_size=65536):
+        """Write a chunk read from stream at offset, returning the offset the next chunk starts at"""
+        session = self.get(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        if offset != session['received']:
+            raise UploadOffsetMismatch(session['received'])
+        limit = min(self.max_bytes, session['size'] or self.max_bytes)
         
-        # Simple evaluation based on keyword matching
-        user_words = set(re.findall(r'\b\w+\b', user_answer.lower()))
-        correct_words = set(re.findall(r'\b\w+\b', correct_response['answer'].lower()))
+        # Extraction state only carries on from chunks this process saw
+        with self.lock:
+            extraction = self.streams.pop(upload_id, None)
+        if extraction is not None and extraction['offset'] != offset:
+            extraction = None
         
-        # Also check against the broader document context
-        document_words = set(re.findall(r'\b\w+\b', document_text.lower()))
+        end = offset
+        with open(session['filepath'], 'r+b') as file:
+            file.seek(offset)
+            while True:
+                data = stream.read(chunk_size)
+                if not data:
+                    break
+                end += len(data)
+                if end > limit:
+                    file.truncate(offset)
+                    raise ValueError(f'Upload exceeds the limit of {limit} bytes')
+                file.write(data)
+                if extraction is not None:
+                    self._feed(extraction, data)
+            # Drop anything left over from an earlier attempt at this chunk
+            file.truncate(end)
         
-        # Calculate overlap with correct answer and document
-        correct_overlap = len(user_words.intersection(correct_words))
-        document_overlap = len(user_words.intersection(document_words))
+        with self.store.connection() as conn:
+            advanced = conn.execute(
+                'UPDATE upload_sessions SET received = ?, updated = ? WHERE upload_id = ? AND received = ?',
+                (end, time.time(), upload_id, offset)
+            ).rowcount
+        if not advanced:
+            session = self.get(upload_id)
+            if session is None:
+                raise KeyError(upload_id)
+            raise UploadOffsetMismatch(session['received'])
         
-        # Weight both overlaps
-        total_correct_words = len(correct_words) if correct_words else 1
-        total_document_words = len(document_words) if document_words else 1
+        if extraction is not None:
+            if extraction['pending'] >= self.INDEX_STEP:
+                with metrics.stage('index'):
+                    self._index(extraction)
+            with self.lock:
+                self.streams[upload_id] = extraction
+        return end
+    
+    def finish(self, upload_id):
+        """Close an upload, returning its session, content hash and (text, index) if they were extracted on the way"""
+        session = self.get(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        if session['size'] is not None and session['received'] != session['size']:
+            raise ValueError(f"Upload incomplete: {session['received']} of {session['size']} bytes received")
         
-        correct_score = correct_overlap / total_correct_words
-        document_score = document_overlap / min(total_document_words, 100)  # Cap to avoid very low scores
+        with self.store.connection() as conn:
+            if conn.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,)).rowcount == 0:
+                raise KeyError(upload_id)
+        with self.lock:
+            extraction = self.streams.pop(upload_id, None)
+        if extraction is None or extraction['offset'] != session['received']:
+            return session, DocumentProcessor.hash_file(session['filepath']), None
         
-        # Combined score
-        score = (correct_score * 0.7) + (document_score * 0.3)
+        extracted = None
+        if extraction['decoder'] is not None:
+            try:
+                extraction['pieces'].append(extraction['decoder'].decode(b'', final=True))
+            except UnicodeDecodeError:
+                extraction['decoder'] = None
+            else:
+                with metrics.stage('index'):
+                    extracted = self._index(extraction, final=True)
+        return session, extraction['hasher'].hexdigest(), extracted
+    
+    def discard(self, upload_id):
+        """Abandon an upload and delete its file, returning False if it was unknown"""
+        session = self.get(upload_id)
+        if session is None:
+            return False
+        with self.store.connection() as conn:
+            conn.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,))
+        with self.lock:
+            self.streams.pop(upload_id, None)
+        remove_file(session['filepath'])
+        return True
+    
+    def expire(self):
+        """Discard uploads idle for longer than the session TTL, returning their files"""
+        cutoff = time.time() - self.session_ttl
+        with self.store.connection() as conn:
+            rows = conn.execute('SELECT upload_id, filepath FROM upload_sessions WHERE updated < ?', (cutoff,)).fetchall()
+            conn.executemany('DELETE FROM upload_sessions WHERE upload_id = ?', ((upload_id,) for upload_id, _ in rows))
+        with self.lock:
+            for upload_id, _ in rows:
+                self.streams.pop(upload_id, None)
+        return [filepath for _, filepath in rows]
+    
+    def known_files(self):
+        """Files of uploads still in progress"""
+        return {row[0] for row in self.store.connection().execute('SELECT filepath FROM upload_sessions')}
+    
+    @staticmethod
+    def _new_stream(filename, filepath):
+        # Text files are decoded as they arrive, the way extract_text_from_txt reads them;
+        # PDFs can only be parsed once complete, so they are just hashed
+        decoder = None
+        if not filename.lower().endswith('.pdf'):
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+        return {
+            'offset': 0,
+            'hasher': DocumentProcessor.content_hasher(filepath),
+            'decoder': decoder,
+            'pieces': [],
+            'pending': 0,
+            'text': '',
+            'indexed': 0,
+            'index': None
+        }
+    
+    @staticmethod
+    def _feed(extraction, data):
+        extraction['offset'] += len(data)
+        extraction['hasher'].update(data)
+        if extraction['decoder'] is None:
+            return
+        try:
+            piece = extraction['decoder'].decode(data)
+        except UnicodeDecodeError:
+            # Not UTF-8: the file is read again with the fallback encoding once complete
+            extraction.update(decoder=None, pieces=[], text='', index=None)
+            return
+        if not extraction['text'] and not extraction['pieces']:
+            piece = piece.lstrip()
+        if piece:
+            extraction['pieces'].append(piece)
+            extraction['pending'] += len(piece)
+    
+    def _index(self, extraction, final=False):
+        """Index the received text up to its last paragraph break, or all of it once final, returning (text, index)"""
+        text = extraction['text'] + ''.join(extraction['pieces'])
+        extraction['pieces'] = []
+        extraction['pending'] = 0
         
-        # Generate feedback based on score
-        if score > 0.7:
-            feedback = "Excellent! Your answer aligns well with the document content and demonstrates good understanding."
-        elif score > 0.5:
-            feedback = "Good answer! You captured important points from the document. Consider including more specific details."
-        elif score > 0.3:
-            feedback = "Your answer shows some understanding but could be more comprehensive. Review the document for additional details."
+        if final:
+            text = text.rstrip()
+            boundary = len(text)
         else:
-            feedback = "Your answer needs improvement. Please refer to the document more closely and include relevant information."
+            # Paragraphs before the last blank line followed by more text are final
+            boundary = extraction['indexed']
+            for match in self.PARAGRAPH_BREAK.finditer(text, extraction['indexed'], len(text.rstrip())):
+                boundary = match.end()
         
-        return {
-            'feedback': feedback,
-            'justification': correct_response['justification'],
-            'score': score
-        }
+        extraction['text'] = text
+        if final or boundary > extraction['indexed']:
+            # The ranking matrix covers every paragraph, so it is only built once the text is complete
+            extraction['index'] = DocumentProcessor.extend_index(
+                extraction['index'], text[:boundary] if boundary < len(text) else text, extraction['indexed'], with_matrix=final
+            )
+            extraction['indexed'] = boundary
+        return text, extraction['index']
+
+# Resumable chunked uploads for files beyond the request size limit
+chunked_uploads = ChunkedUploads(documents, app.config['MAX_UPLOAD_BYTES'], app.config['UPLOAD_SESSION_TTL'])
+
+def answer_document_question(document_id, document, question, scorer, deadline=None):
+    """Answer a question about a stored document, memoized per content and normalized question"""
+    result = answer_cache.get(document['content_hash'], question, scorer)
+    if result is None:
+        result = TextAnalyzer.answer_question(document['text'], question, index=document.get('index'), scorer=scorer,
+                                              deadline=deadline)
+        # Answers cut short by a deadline are not cached, so a later request can rank fully
+        if deadline is None or not deadline.reached:
+            answer_cache.put(document['content_hash'], question, scorer, result)
+    return result
+
+def answer_document_questions(document_id, document, questions, scorer):
+    """Answer many questions about a stored document, ranking uncached ones together"""
+    results = [None] * len(questions)
+    timings = [0.0] * len(questions)
+    
+    unresolved = []
+    for i, question in enumerate(questions):
+        started = time.perf_counter()
+        results[i] = answer_cache.get(document['content_hash'], question, scorer)
+        timings[i] = time.perf_counter() - started
+        if results[i] is None:
+            unresolved.append(i)
+    
+    if unresolved:
+        index = document.get('index')
+        started = time.perf_counter()
+        relevant_contexts = TextAnalyzer.find_relevant_contexts(document['text'], [questions[i] for i in unresolved],
+                                                                TextAnalyzer.ANSWER_CONTEXTS + TextAnalyzer.DUPLICATE_MARGIN, index=index, scorer=scorer)
+        # Each question carries an equal share of the joint ranking time
+        retrieval_share = (time.perf_counter() - started) / len(unresolved)
+        
+        for i, contexts in zip(unresolved, relevant_contexts):
+            started = time.perf_counter()
+            with metrics.stage('answer'):
+                results[i] = TextAnalyzer.answer_from_contexts(contexts, questions[i], pages=index.get('paragraph_pages'),
+                                                               pattern_flags=index.get('pattern_flags'))
+            answer_cache.put(document['content_hash'], questions[i], scorer, results[i])
+            timings[i] += retrieval_share + time.perf_counter() - started
+    
+    return results, timings
+
+def evaluate_document_answers(document, questions, answers, scorer, pool=None):
+    """Evaluate answers about a stored document, sharing reference answers with /ask through the answer cache"""
+    references = [answer_cache.get(document['content_hash'], question, scorer) for question in questions]
+    evaluations = TextAnalyzer.evaluate_answers(document['text'], questions, answers, index=document.get('index'),
+                                                scorer=scorer, pool=pool, reference_answers=references)
+    for question, reference, evaluation in zip(questions, references, evaluations):
+        if reference is None:
+            answer_cache.put(document['content_hash'], question, scorer, evaluation['reference'])
+    return evaluations
+
+# Streamed response formats and their content types
+STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
+def requested_stream_format(data):
+    """'ndjson' or 'sse' when the client asked for a streamed response through the stream field or its Accept header, otherwise None"""
+    stream = data.get('stream')
+    if stream is True:
+        return 'ndjson'
+    if stream in STREAM_FORMATS:
+        return stream
+    if stream not in (None, False):
+        raise ValueError(f"stream must be true or one of: {', '.join(STREAM_FORMATS)}")
+    best = request.accept_mimetypes.best_match(['application/json', *STREAM_FORMATS.values()])
+    return next((name for name, mimetype in STREAM_FORMATS.items() if mimetype == best), None)
+
+def progressive_chunks(count, largest=32):
+    """Yield (start, stop) ranges of 1, 2, 4... items up to largest, so a streamed batch's first result
+    costs one item's work while later items are still processed together"""
+    start, size = 0, 1
+    while start < count:
+        yield start, min(start + size, count)
+        start += size
+        size = min(size * 2, largest)
+
+def stream_events(events, stream_format, description):
+    """Stream (event, payload) pairs as NDJSON lines or Server-Sent Events, flushing each as soon as it is produced;
+    the server closes the stream when a write to a disconnected client fails, which stops the remaining work"""
+    def generate():
+        sent = 0
+        try:
+            for event, payload in events:
+                if stream_format == 'sse':
+                    yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+                else:
+                    yield app.json.dumps({'event': event, **payload}) + '\n'
+                sent += 1
+        except GeneratorExit:
+            logger.info(f"Client disconnected, {description} cancelled after {sent} events")
+            raise
+        except Exception as e:
+            logger.error(f"Streaming error in {description}: {e}")
+            error = {'success': False, 'error': f'Failed after {sent} results'}
+            yield f"event: error\ndata: {app.json.dumps(error)}\n\n" if stream_format == 'sse' else app.json.dumps({'event': 'error', **error}) + '\n'
+        finally:
+            # Stop the event generator so items not yet computed never are
+            events.close()
+    
+    # Proxies must pass each event on instead of buffering the response
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format],
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def document_not_found(document_id):
+    """Error response for a document that is missing or has expired"""
+    if documents.is_expired(document_id):
+        return jsonify({'success': False, 'error': 'Document expired'})
+    return jsonify({'success': False, 'error': 'Document not found'})
+
+def search_corpus(question, document_ids=None, max_results=10, scorer=None):
+    """Rank paragraphs across stored documents for a question"""
+    question_words = TextAnalyzer.question_terms(question)
+    content_hashes = documents.content_hashes(document_ids) if document_ids is not None else None
+    with metrics.stage('corpus_search'):
+        ranked = corpus_index.search(question_words, max_results, content_hashes, scorer or app.config['RANKING_SCORER'])
+    
+    # Duplicate uploads share content, so report each paragraph under one of its documents
+    owners = documents.find_content({content_hash for _, content_hash, _ in ranked}, set(document_ids) if document_ids is not None else None)
+    
+    results = []
+    for score, content_hash, i in ranked:
+        document_id = owners.get(content_hash)
+        document = documents.get(document_id) if document_id is not None else None
+        if document is None:
+            continue
+        pages = document['index'].get('paragraph_pages')
+        results.append({
+            'document_id': document_id,
+            'filename': document['filename'],
+            'paragraph_index': i,
+            'page': pages[i] if pages else None,
+            'score': score,
+            'content': document['index']['paragraphs'][i],
+            'copies': list(document['index']['copies'].get(i, ()))
+        })
+    return results
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Other worker processes may have removed or expired cached documents
+    documents.sync()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        # Label by route pattern, not by path, so document ids don't explode the label set
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+def profile_summary(profiler, limit=20):
+    """Hottest functions of a finished profile, by time spent in the function itself"""
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return {
+        'total_time': stats.total_tt,
+        'functions': [{
+            'function': f"{os.path.basename(filename)}:{line}({name})",
+            'calls': calls,
+            'own_time': own_time,
+            'cumulative_time': cumulative_time
+        } for (filename, line, name), (_, calls, own_time, cumulative_time, _) in rows]
+    }
+
+def write_profile(profiler):
+    """Save a profile for later analysis with pstats or snakeviz, returning its path"""
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    route = (request.url_rule.rule if request.url_rule is not None else 'unmatched').strip('/').replace('/', '_') or 'index'
+    route = re.sub(r'[^\w.-]', '', route)
+    path = os.path.join(app.config['PROFILE_DIR'], f"{datetime.now().strftime('%Y%m%dT%H%M%S')}_{route}_{uuid.uuid4().hex[:8]}.prof")
+    profiler.dump_stats(path)
+    prune_profiles()
+    return path
+
+def prune_profiles():
+    """Delete the oldest .prof files beyond PROFILE_MAX_FILES"""
+    limit = app.config['PROFILE_MAX_FILES']
+    if limit <= 0:
+        return
+    profile_dir = app.config['PROFILE_DIR']
+    profiles = []
+    with os.scandir(profile_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.prof') and entry.is_file():
+                try:
+                    profiles.append((entry.stat().st_mtime, entry.name))
+                except OSError:
+                    continue
+    if len(profiles) <= limit:
+        return
+    profiles.sort()
+    for _, name in profiles[:len(profiles) - limit]:
+        try:
+            os.remove(os.path.join(profile_dir, name))
+        except OSError:
+            # Another worker pruned it first
+            pass
+
+@app.before_request
+def start_profiler():
+    """Profile this request when asked to with X-Profile or ?profile=, or when it is sampled"""
+    if not app.config['PROFILING_ENABLED']:
+        return
+    
+    mode = (request.headers.get('X-Profile') or request.args.get('profile') or '').lower()
+    if mode not in ('summary', 'file'):
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        if not (rate > 0 and random.random() < rate):
+            return
+        mode = 'sampled'
+    
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this interpreter
+        return
+    g.profile = (profiler, mode)
+
+@app.after_request
+def finish_profiler(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    
+    profiler, mode = profile
+    profiler.disable()
+    if mode == 'summary' and response.is_json:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['profile'] = profile_summary(profiler)
+            response.set_data(app.json.dumps(data))
+            return response
+    
+    path = write_profile(profiler)
+    if mode != 'sampled':
+        response.headers['X-Profile-File'] = path
+    return response
 
 # Flask routes
 @app.route('/')
@@ -490,104 +3938,489 @@ def upload_document():
         if not file.filename.lower().endswith(('.pdf', '.txt')):
             return jsonify({'success': False, 'error': 'Only PDF and TXT files are supported'})
         
+        # Optional per-document time-to-live in seconds
+        try:
+            ttl = int(request.form.get('ttl', app.config['DOCUMENT_TTL']))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'ttl must be an integer number of seconds'})
+        
         # Generate unique document ID
         document_id = str(uuid.uuid4())
         
-        # Save file
+        # Save file, hashing it on the way to disk
         filename = f"{document_id}_{file.filename}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        with metrics.stage('save'):
+            content_hash = DocumentProcessor.save_upload(file, filepath)
         
-        # Extract text based on file type
-        try:
-            if file.filename.lower().endswith('.pdf'):
-                text = DocumentProcessor.extract_text_from_pdf(filepath)
-            else:
-                text = DocumentProcessor.extract_text_from_txt(filepath)
-            
-            if not text.strip():
-                return jsonify({'success': False, 'error': 'No text could be extracted from the document'})
-            
-            # Generate summary
-            summary = TextAnalyzer.generate_summary(text)
-            
-            # Store document data
-            documents[document_id] = {
-                'filename': file.filename,
-                'filepath': filepath,
-                'text': text,
-                'summary': summary,
-                'upload_time': datetime.now().isoformat()
-            }
-            
-            logger.info(f"Document uploaded successfully: {document_id}")
-            
-            return jsonify({
-                'success': True,
-                'document_id': document_id,
-                'summary': summary,
-                'filename': file.filename
-            })
-            
-        except Exception as e:
-            logger.error(f"Error processing document: {e}")
-            return jsonify({'success': False, 'error': f'Error processing document: {str(e)}'})
+        return finish_upload(document_id, file.filename, filepath, content_hash, ttl, run_async=request.values.get('async', '').lower() in ('1', 'true', 'yes'))
     
     except Exception as e:
         logger.error(f"Upload error: {e}")
         return jsonify({'success': False, 'error': 'Upload failed'})
 
+def finish_upload(document_id, filename, filepath, content_hash, ttl, run_async=False, extracted=None):
+    """Store a saved upload, or share content already stored under its hash, and build the upload response"""
+    # Identical bytes were uploaded before: share the stored text, summary and index
+    expires_at = time.time() + ttl if ttl > 0 else None
+    if documents.link(document_id, filename, content_hash, expires_at):
+        os.remove(filepath)
+        document = documents[document_id]
+        logger.info(f"Document deduplicated: {document_id}")
+        
+        return jsonify({
+            'success': True,
+            'document_id': document_id,
+            'summary': document['summary'],
+            'filename': filename,
+            'deduplicated': True
+        })
+    
+    # Asynchronous mode: queue the heavy work and report progress through /status,
+    # unless a chunked upload already extracted and indexed the text
+    if run_async and extracted is None:
+        try:
+            job_id = ingest_queue.submit(document_id, filename, filepath, ttl, content_hash)
+        except queue.Full:
+            os.remove(filepath)
+            response = jsonify({'success': False, 'error': 'Too many uploads in progress, please retry later'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'document_id': document_id,
+            'filename': filename,
+            'status_url': f'/status/{job_id}'
+        }), 202
+    
+    try:
+        document = process_document(document_id, filename, filepath, ttl, content_hash=content_hash, extracted=extracted)
+        
+        return jsonify({
+            'success': True,
+            'document_id': document_id,
+            'summary': document['summary'],
+            'filename': filename
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    except Exception as e:
+        logger.error(f"Error processing document: {e}")
+        return jsonify({'success': False, 'error': f'Error processing document: {str(e)}'})
+
+@app.route('/upload/chunked', methods=['POST'])
+def start_chunked_upload():
+    """Start a resumable upload whose chunks are sent to the returned upload_url"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = os.path.basename(data.get('filename') or '')
+        size = data.get('size')
+        ttl = data.get('ttl', app.config['DOCUMENT_TTL'])
+        
+        if not filename:
+            return jsonify({'success': False, 'error': 'filename is required'})
+        
+        if not filename.lower().endswith(('.pdf', '.txt')):
+            return jsonify({'success': False, 'error': 'Only PDF and TXT files are supported'})
+        
+        if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 1):
+            return jsonify({'success': False, 'error': 'size must be a positive number of bytes'})
+        
+        if size is not None and size > app.config['MAX_UPLOAD_BYTES']:
+            return jsonify({'success': False, 'error': f"Files are limited to {app.config['MAX_UPLOAD_BYTES']} bytes"}), 413
+        
+        if not isinstance(ttl, int) or isinstance(ttl, bool):
+            return jsonify({'success': False, 'error': 'ttl must be an integer number of seconds'})
+        
+        session = chunked_uploads.create(filename, size, ttl)
+        
+        return jsonify({
+            'success': True,
+            'upload_id': session['upload_id'],
+            'document_id': session['document_id'],
+            'filename': filename,
+            'offset': 0,
+            'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+            'upload_url': f"/upload/chunked/{session['upload_id']}"
+        }), 201
+    
+    except Exception as e:
+        logger.error(f"Chunked upload error: {e}")
+        return jsonify({'success': False, 'error': 'Upload failed'})
+
+@app.route('/upload/chunked/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Write the request body at the offset given by the Upload-Offset header or offset parameter"""
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Upload-Offset must be an integer number of bytes'})
+    
+    try:
+        with metrics.stage('save'):
+            offset = chunked_uploads.write(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    except UploadOffsetMismatch as e:
+        # The client resumes from the offset the server has
+        return jsonify({'success': False, 'error': str(e), 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    except Exception as e:
+        logger.error(f"Chunk upload error: {e}")
+        return jsonify({'success': False, 'error': 'Chunk upload failed'})
+    
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': offset})
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Report how much of a chunked upload has been received, so an interrupted client can resume"""
+    session = chunked_uploads.get(upload_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'upload_id': upload_id,
+        'document_id': session['document_id'],
+        'filename': session['filename'],
+        'offset': session['received'],
+        'size': session['size']
+    })
+
+@app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+def cancel_chunked_upload(upload_id):
+    """Abandon a chunked upload and delete what was received"""
+    if not chunked_uploads.discard(upload_id):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    return jsonify({'success': True, 'upload_id': upload_id})
+
+@app.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Process a fully received chunked upload like a regular upload"""
+    try:
+        try:
+            session, content_hash, extracted = chunked_uploads.finish(upload_id)
+        except KeyError:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        
+        data = request.get_json(silent=True) or {}
+        run_async = str(data.get('async', request.values.get('async', ''))).lower() in ('1', 'true', 'yes')
+        return finish_upload(session['document_id'], session['filename'], session['filepath'], content_hash, session['ttl'], run_async, extracted)
+    
+    except Exception as e:
+        logger.error(f"Chunked upload error: {e}")
+        return jsonify({'success': False, 'error': 'Upload failed'})
+
+@app.route('/status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Report progress of an asynchronous upload"""
+    job = ingest_queue.status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, **job})
+
+@app.route('/append', methods=['POST', 'PATCH'])
+def append_to_document():
+    """Append text or an uploaded file's pages to an existing document"""
+    try:
+        page_offsets = None
+        if 'file' in request.files:
+            document_id = request.form.get('document_id')
+            file = request.files['file']
+            if not document_id or file.filename == '':
+                return jsonify({'success': False, 'error': 'Document ID and file are required'})
+            if not file.filename.lower().endswith(('.pdf', '.txt')):
+                return jsonify({'success': False, 'error': 'Only PDF and TXT files are supported'})
+        else:
+            data = request.get_json(silent=True) or {}
+            document_id = data.get('document_id')
+            text = data.get('text')
+            if not document_id or not isinstance(text, str):
+                return jsonify({'success': False, 'error': 'Document ID and text are required'})
+        
+        document = documents.get(document_id)
+        if document is None:
+            return document_not_found(document_id)
+        
+        if 'file' in request.files:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{file.filename}")
+            try:
+                with metrics.stage('save'):
+                    DocumentProcessor.save_upload(file, filepath)
+                if file.filename.lower().endswith('.pdf'):
+                    with metrics.stage('extract_pdf'):
+                        text, page_offsets = DocumentProcessor.extract_pdf_pages(filepath)
+                else:
+                    with metrics.stage('extract_txt'):
+                        text = DocumentProcessor.extract_text_from_txt(filepath)
+            finally:
+                remove_file(filepath)
+        else:
+            text = text.strip()
+        
+        if not text:
+            return jsonify({'success': False, 'error': 'No text to append'})
+        
+        try:
+            updated = append_document(document_id, document, text, page_offsets)
+        except DocumentConflict:
+            return jsonify({'success': False, 'error': 'Document was changed by another request, please retry'}), 409
+        
+        return jsonify({
+            'success': True,
+            'document_id': document_id,
+            'summary': updated['summary'],
+            'filename': updated['filename'],
+            'paragraph_count': len(updated['index']['paragraphs'])
+        })
+    
+    except Exception as e:
+        logger.error(f"Append error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to append to document'})
+
 @app.route('/ask', methods=['POST'])
 def ask_question():
     """Handle question answering"""
     try:
         data = request.get_json()
         document_id = data.get('document_id')
+        document_ids = data.get('document_ids')
         question = data.get('question')
+        scorer = data.get('scorer', app.config['RANKING_SCORER'])
+        deadline_ms = data.get('deadline_ms')
         
-        if not document_id or not question:
+        if not (document_id or document_ids) or not question:
             return jsonify({'success': False, 'error': 'Document ID and question are required'})
         
-        if document_id not in documents:
-            return jsonify({'success': False, 'error': 'Document not found'})
+        if scorer not in RankingEngine.SCORERS:
+            return jsonify({'success': False, 'error': f"Unknown scorer. Available scorers: {', '.join(RankingEngine.SCORERS)}"})
         
-        document = documents[document_id]
-        result = TextAnalyzer.answer_question(document['text'], question)
+        if deadline_ms is not None and (not isinstance(deadline_ms, (int, float)) or isinstance(deadline_ms, bool) or deadline_ms <= 0):
+            return jsonify({'success': False, 'error': 'deadline_ms must be a positive number of milliseconds'})
+        
+        if document_ids:
+            return ask_across_documents(document_ids, question, scorer)
+        
+        document = documents.get(document_id)
+        if document is None:
+            return document_not_found(document_id)
+        # The deadline counts from when the request arrived, so loading the document uses part of it
+        deadline = Deadline(deadline_ms / 1000, started=g.get('request_started')) if deadline_ms is not None else None
+        result = answer_document_question(document_id, document, question, scorer, deadline)
         
         logger.info(f"Question answered for document {document_id}")
         
-        return jsonify({
+        response = {
             'success': True,
             'answer': result['answer'],
             'justification': result['justification']
-        })
+        }
+        if deadline is not None:
+            response['partial'] = deadline.reached
+        return jsonify(response)
     
     except Exception as e:
         logger.error(f"Question answering error: {e}")
         return jsonify({'success': False, 'error': 'Failed to answer question'})
 
+def ask_across_documents(document_ids, question, scorer):
+    """Answer a question from the best paragraphs of several documents"""
+    if not isinstance(document_ids, list):
+        return jsonify({'success': False, 'error': 'document_ids must be a list'})
+    
+    missing = [document_id for document_id in document_ids if document_id not in documents]
+    if missing:
+        expired = [document_id for document_id in missing if documents.is_expired(document_id)]
+        if expired:
+            return jsonify({'success': False, 'error': f"Document expired: {', '.join(expired)}"})
+        return jsonify({'success': False, 'error': f"Document not found: {', '.join(missing)}"})
+    
+    # The same boilerplate can top several documents, so a few extra results stand in for repeats
+    results = search_corpus(question, document_ids, max_results=TextAnalyzer.ANSWER_CONTEXTS + TextAnalyzer.DUPLICATE_MARGIN, scorer=scorer)
+    results = [results[n] for n in NearDuplicates.distinct([result['content'] for result in results])][:TextAnalyzer.ANSWER_CONTEXTS]
+    contexts = [(result['score'], result['paragraph_index'], result['content']) for result in results]
+    source = None
+    if results:
+        source = f"document {results[0]['document_id']} ({results[0]['filename']})"
+    with metrics.stage('answer'):
+        answer = TextAnalyzer.answer_from_contexts(contexts, question, source=source)
+    
+    logger.info(f"Question answered across {len(document_ids)} documents")
+    
+    return jsonify({
+        'success': True,
+        'answer': answer['answer'],
+        'justification': answer['justification'],
+        'sources': [{'document_id': result['document_id'], 'paragraph_index': result['paragraph_index']} for result in results]
+    })
+
+@app.route('/search', methods=['POST'])
+def search_documents():
+    """Rank paragraphs across all documents or a chosen subset"""
+    try:
+        data = request.get_json()
+        query = data.get('query')
+        document_ids = data.get('document_ids')
+        max_results = data.get('max_results', 10)
+        scorer = data.get('scorer', app.config['RANKING_SCORER'])
+        
+        if not query:
+            return jsonify({'success': False, 'error': 'Query is required'})
+        
+        if document_ids is not None and not isinstance(document_ids, list):
+            return jsonify({'success': False, 'error': 'document_ids must be a list'})
+        
+        if not isinstance(max_results, int) or max_results < 1:
+            return jsonify({'success': False, 'error': 'max_results must be a positive integer'})
+        
+        if scorer not in RankingEngine.SCORERS:
+            return jsonify({'success': False, 'error': f"Unknown scorer. Available scorers: {', '.join(RankingEngine.SCORERS)}"})
+        
+        results = search_corpus(query, document_ids, max_results, scorer)
+        
+        logger.info(f"Search returned {len(results)} results")
+        
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+    
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({'success': False, 'error': 'Search failed'})
+
+@app.route('/ask/batch', methods=['POST'])
+def ask_questions_batch():
+    """Answer a list of questions about one document in a single request"""
+    try:
+        started = time.perf_counter()
+        data = request.get_json()
+        document_id = data.get('document_id')
+        questions = data.get('questions')
+        scorer = data.get('scorer', app.config['RANKING_SCORER'])
+        
+        if not document_id or not questions:
+            return jsonify({'success': False, 'error': 'Document ID and questions are required'})
+        
+        if not isinstance(questions, list) or not all(isinstance(question, str) and question.strip() for question in questions):
+            return jsonify({'success': False, 'error': 'questions must be a list of non-empty strings'})
+        
+        if scorer not in RankingEngine.SCORERS:
+            return jsonify({'success': False, 'error': f"Unknown scorer. Available scorers: {', '.join(RankingEngine.SCORERS)}"})
+        
+        try:
+            stream_format = requested_stream_format(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        
+        document = documents.get(document_id)
+        if document is None:
+            return document_not_found(document_id)
+        
+        if stream_format:
+            def answer_events():
+                for start, stop in progressive_chunks(len(questions)):
+                    results, timings = answer_document_questions(document_id, document, questions[start:stop], scorer)
+                    for i, result, timing in zip(range(start, stop), results, timings):
+                        yield 'answer', {
+                            'question_index': i,
+                            'question': questions[i],
+                            'answer': result['answer'],
+                            'justification': result['justification'],
+                            'time_ms': round(timing * 1000, 3)
+                        }
+                logger.info(f"{len(questions)} questions answered for document {document_id}")
+                yield 'done', {'success': True, 'count': len(questions), 'total_time_ms': round((time.perf_counter() - started) * 1000, 3)}
+            
+            return stream_events(answer_events(), stream_format, f"batch of {len(questions)} questions")
+        
+        results, timings = answer_document_questions(document_id, document, questions, scorer)
+        
+        logger.info(f"{len(questions)} questions answered for document {document_id}")
+        
+        return jsonify({
+            'success': True,
+            'answers': [{
+                'question': question,
+                'answer': result['answer'],
+                'justification': result['justification'],
+                'time_ms': round(timing * 1000, 3)
+            } for question, result, timing in zip(questions, results, timings)],
+            'total_time_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+    
+    except Exception as e:
+        logger.error(f"Batch question answering error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to answer questions'})
+
+@app.route('/summary', methods=['POST'])
+def summarize_document():
+    """Summarize a document in up to max_words words"""
+    try:
+        data = request.get_json()
+        document_id = data.get('document_id')
+        max_words = data.get('max_words', app.config['SUMMARY_MAX_WORDS'])
+        
+        if not document_id:
+            return jsonify({'success': False, 'error': 'Document ID is required'})
+        
+        if not isinstance(max_words, int) or isinstance(max_words, bool) or max_words < 1:
+            return jsonify({'success': False, 'error': 'max_words must be a positive integer'})
+        
+        document = documents.get(document_id)
+        if document is None:
+            return document_not_found(document_id)
+        
+        # Sentence rankings are kept with the document, so other lengths only redo the selection
+        with metrics.stage('summarize'):
+            summary = TextAnalyzer.generate_summary(document['text'], max_words, index=document.get('index'), time_budget=summary_time_budget())
+        
+        return jsonify({
+            'success': True,
+            'summary': summary,
+            'max_words': max_words
+        })
+    
+    except Exception as e:
+        logger.error(f"Summary error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to summarize document'})
+
 @app.route('/challenge', methods=['POST'])
 def generate_challenge():
     """Generate challenge questions"""
     try:
         data = request.get_json()
         document_id = data.get('document_id')
+        seed = data.get('seed')
         
         if not document_id:
             return jsonify({'success': False, 'error': 'Document ID is required'})
         
-        if document_id not in documents:
-            return jsonify({'success': False, 'error': 'Document not found'})
+        if seed is not None and (not isinstance(seed, (int, str)) or isinstance(seed, bool)):
+            return jsonify({'success': False, 'error': 'seed must be an integer or a string'})
         
-        document = documents[document_id]
-        questions = TextAnalyzer.generate_challenge_questions(document['text'])
+        document = documents.get(document_id)
+        if document is None:
+            return document_not_found(document_id)
+        with metrics.stage('challenge'):
+            questions = TextAnalyzer.generate_challenge_questions(document['text'], index=document.get('index'), seed=seed)
         
         logger.info(f"Challenge questions generated for document {document_id}")
         
-        return jsonify({
+        response = {
             'success': True,
             'questions': questions
-        })
+        }
+        if seed is not None:
+            response['seed'] = seed
+        return jsonify(response)
     
     except Exception as e:
         logger.error(f"Challenge generation error: {e}")
@@ -597,32 +4430,58 @@ def generate_challenge():
 def evaluate_answers():
     """Evaluate user answers"""
     try:
+        started = time.perf_counter()
         data = request.get_json()
         document_id = data.get('document_id')
         questions = data.get('questions')
         answers = data.get('answers')
+        scorer = data.get('scorer', app.config['RANKING_SCORER'])
         
         if not document_id or not questions or not answers:
             return jsonify({'success': False, 'error': 'Document ID, questions, and answers are required'})
         
-        if document_id not in documents:
-            return jsonify({'success': False, 'error': 'Document not found'})
+        if scorer not in RankingEngine.SCORERS:
+            return jsonify({'success': False, 'error': f"Unknown scorer. Available scorers: {', '.join(RankingEngine.SCORERS)}"})
+        
+        document = documents.get(document_id)
+        if document is None:
+            return document_not_found(document_id)
         
         if len(questions) != len(answers):
             return jsonify({'success': False, 'error': 'Number of questions and answers must match'})
         
-        document = documents[document_id]
-        feedback = []
+        try:
+            stream_format = requested_stream_format(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        
+        # Spread large batches over worker processes when asked to
+        pool = None
+        if data.get('parallel') and app.config['WORKER_PROCESSES'] > 1:
+            pool = get_process_pool()
         
-        for i, (question, answer) in enumerate(zip(questions, answers)):
-            evaluation = TextAnalyzer.evaluate_answer(document['text'], question, answer)
-            feedback.append({
+        def feedback_item(i, evaluation):
+            return {
                 'question_index': i,
-                'user_answer': answer,
+                'user_answer': answers[i],
                 'feedback': evaluation['feedback'],
                 'justification': evaluation['justification'],
                 'score': evaluation['score']
-            })
+            }
+        
+        if stream_format:
+            def feedback_events():
+                for start, stop in progressive_chunks(len(questions)):
+                    evaluations = evaluate_document_answers(document, questions[start:stop], answers[start:stop], scorer, pool)
+                    for i, evaluation in enumerate(evaluations, start):
+                        yield 'feedback', feedback_item(i, evaluation)
+                logger.info(f"Answers evaluated for document {document_id}")
+                yield 'done', {'success': True, 'count': len(questions), 'total_time_ms': round((time.perf_counter() - started) * 1000, 3)}
+            
+            return stream_events(feedback_events(), stream_format, f"evaluation of {len(questions)} answers")
+        
+        evaluations = evaluate_document_answers(document, questions, answers, scorer, pool)
+        feedback = [feedback_item(i, evaluation) for i, evaluation in enumerate(evaluations)]
         
         logger.info(f"Answers evaluated for document {document_id}")
         
@@ -641,9 +4500,37 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'documents_count': len(documents)
+        'documents_count': len(documents),
+        'document_cache': documents.cache_stats(),
+        'answer_cache': answer_cache.stats(),
+        'ingest_queue_depth': ingest_queue.depth()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for requests, pipeline stages, caches and the ingest queue"""
+    document_cache = documents.cache_stats()
+    answers = answer_cache.stats()
+    gauges = [
+        ('documents', 'Live documents in the store', len(documents)),
+        ('document_cache_bytes', 'Approximate bytes of document content held in memory', document_cache['bytes']),
+        ('document_cache_budget_bytes', 'Memory budget for document content', document_cache['budget_bytes']),
+        ('document_cache_contents', 'Document contents held in memory', document_cache['contents']),
+        ('answer_cache_entries', 'Memoized answers held in memory', answers['entries']),
+        ('ingest_queue_depth', 'Asynchronous uploads waiting for a worker', ingest_queue.depth()),
+        ('vocabulary_terms', 'Distinct terms in the shared token vocabulary', len(vocabulary))
+    ]
+    counters = [
+        ('document_cache_hits_total', 'Document content served from memory', document_cache['hits']),
+        ('document_cache_misses_total', 'Document content loaded from the store', document_cache['misses']),
+        ('document_cache_evictions_total', 'Document content dropped from memory to stay under budget', document_cache['evictions']),
+        ('documents_expired_total', 'Documents expired by their time-to-live', document_cache['expired']),
+        ('answer_cache_hits_total', 'Answers served from the answer cache', answers['hits']),
+        ('answer_cache_misses_total', 'Answers computed on a cache miss', answers['misses']),
+        ('answer_cache_evictions_total', 'Answers dropped from the answer cache', answers['evictions'])
+    ]
+    return metrics.render(gauges, counters), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 if __name__ == '__main__':
     print("Starting Smart Research Assistant...")
     print("PDF Support:", "Enabled" if PDF_SUPPORT else "Disabled (install PyPDF2 for PDF support)")
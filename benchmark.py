@@ -0,0 +1,313 @@
+"""Benchmarks for the Smart Research Assistant on synthetic documents
+
+Usage: python benchmark.py [--paragraphs N] [--repeat N] [--only NAME ...] [--output results.json]
+
+Results are printed as JSON with p50/p95/p99 latencies, throughput and peak memory
+for each benchmark, so runs from two commits can be compared directly.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime
+from itertools import count, cycle
+
+PATTERN_SENTENCES = [
+    "This happens because the {0} depends on the {1}.",
+    "The result shows that {0} improves {1}.",
+    "We define {0} as the measure of {1}.",
+    "The conclusion indicates that {0} refers to {1}."
+]
+
+def make_vocabulary(size, rng):
+    """Random lowercase words of varied length"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 12))))
+    return sorted(words)
+
+def make_document(paragraphs=200, words_per_paragraph=80, vocabulary_size=2000, seed=0):
+    """Synthetic document text and its vocabulary, with names, numbers, quotes and answer patterns mixed in"""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    names = [word.capitalize() for word in rng.sample(vocabulary, min(20, len(vocabulary)))]
+
+    blocks = []
+    for _ in range(paragraphs):
+        sentences = []
+        words_left = words_per_paragraph
+        while words_left > 0:
+            length = min(words_left, rng.randint(8, 20))
+            words = [rng.choice(vocabulary) for _ in range(length)]
+            if rng.random() < 0.3:
+                words[0] = rng.choice(names)
+            if rng.random() < 0.1:
+                words[-1] = str(rng.randint(1900, 2030))
+            sentences.append(' '.join(words).capitalize() + '.')
+            words_left -= length
+        if rng.random() < 0.3:
+            sentences.append(rng.choice(PATTERN_SENTENCES).format(rng.choice(vocabulary), rng.choice(vocabulary)))
+        if rng.random() < 0.05:
+            sentences.append(f'"{" ".join(rng.choice(vocabulary) for _ in range(6))}" said {rng.choice(names)}.')
+
+        # Wrap lines like extracted text so paragraphs span several lines
+        line, lines = [], []
+        for word in ' '.join(sentences).split():
+            line.append(word)
+            if len(line) >= 12:
+                lines.append(' '.join(line))
+                line = []
+        if line:
+            lines.append(' '.join(line))
+        blocks.append('\n'.join(lines))
+
+    return '\n\n'.join(blocks), vocabulary
+
+def make_questions(vocabulary, count, seed=0):
+    """Questions built from document words"""
+    rng = random.Random(seed)
+    templates = ['What is {0}?', 'Why does {0} affect {1}?', 'How is {0} related to {1} and {2}?', 'Define {0}.']
+    return [rng.choice(templates).format(*rng.sample(vocabulary, 3)) for _ in range(count)]
+
+def make_pdf(text, lines_per_page=50):
+    """Minimal multi-page PDF with one line of Helvetica text per text line"""
+    lines = text.split('\n')
+    pages = [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = []
+    page_ids = []
+    font_id = 3
+    for page_lines in pages:
+        stream = ['BT', '/F1 10 Tf', '12 TL', '50 780 Td']
+        for line in page_lines:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            stream.append(f'({escaped}) Tj T*')
+        stream.append('ET')
+        content = zlib.compress('\n'.join(stream).encode('latin-1', 'replace'))
+        content_id = 4 + len(objects)
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream')
+        page_ids.append(4 + len(objects))
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>'.encode())
+
+    header = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {len(page_ids)} >>".encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+    ]
+
+    output = io.BytesIO()
+    output.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(header + objects, start=1):
+        offsets.append(output.tell())
+        output.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+    xref = output.tell()
+    output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(offsets) + 1))
+    for offset in offsets:
+        output.write(b'%010d 00000 n \n' % offset)
+    output.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(offsets) + 1, xref))
+    return output.getvalue()
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of pre-sorted values"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def run_benchmark(name, function, repeat, warmup, items=1):
+    """Time repeated calls of function, then measure its peak allocation in one traced call"""
+    for _ in range(warmup):
+        function()
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    # Tracing slows calls down, so memory is measured separately from latency
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    result = {
+        'repeat': repeat,
+        'items_per_call': items,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'throughput_per_s': repeat * items / elapsed if elapsed else None,
+        'peak_memory_bytes': peak
+    }
+    print(f"{name}: p50 {result['p50_ms']:.2f}ms p95 {result['p95_ms']:.2f}ms peak {peak / 1024 / 1024:.1f}MB", file=sys.stderr)
+    return result
+
+def checked(response):
+    """Fail loudly when an end-to-end request did not succeed"""
+    data = response.get_json()
+    if response.status_code >= 400 or not data.get('success', True):
+        raise RuntimeError(f'Request failed ({response.status_code}): {data}')
+    return data
+
+def first_streamed_event(response):
+    """Read only the first line of a streamed response, then drop the connection as a client giving up would"""
+    if response.status_code >= 400:
+        raise RuntimeError(f'Request failed ({response.status_code})')
+    try:
+        return json.loads(next(iter(response.response)))
+    finally:
+        response.close()
+
+def micro_benchmarks(app_module, text, pdf_path, questions, args):
+    """Benchmarks of the document processing and analysis functions"""
+    DocumentProcessor = app_module.DocumentProcessor
+    TextAnalyzer = app_module.TextAnalyzer
+    index = DocumentProcessor.build_index(text)
+    question_cycle = cycle(questions)
+    answers = cycle(['The answer mentions ' + question for question in questions])
+
+    benchmarks = {
+        'extract_text_from_pdf': lambda: DocumentProcessor.extract_text_from_pdf(pdf_path),
+        'split_into_paragraphs': lambda: DocumentProcessor.split_into_paragraphs(text),
+        'build_index': lambda: DocumentProcessor.build_index(text),
+        'generate_summary': lambda: TextAnalyzer.generate_summary(text),
+        'find_relevant_context': lambda: TextAnalyzer.find_relevant_context(text, next(question_cycle), index=index),
+        'find_relevant_context_unindexed': lambda: TextAnalyzer.find_relevant_context(text, next(question_cycle)),
+        'extract_key_concepts': lambda: TextAnalyzer.extract_key_concepts(text),
+        'evaluate_answer': lambda: TextAnalyzer.evaluate_answer(text, next(question_cycle), next(answers), index=index)
+    }
+    if app_module.NUMPY_SUPPORT:
+        benchmarks['rank_summary_sentences'] = lambda: app_module.Summarizer.rank_sentences(index)
+    return benchmarks
+
+def end_to_end_benchmarks(app_module, text, pdf_bytes, questions, args):
+    """Benchmarks of each route through the Flask test client"""
+    client = app_module.app.test_client()
+    uploads = count()
+
+    def upload(data, filename):
+        return checked(client.post('/upload', data={'file': (io.BytesIO(data), filename)}, content_type='multipart/form-data'))
+
+    # Unique bytes per call so content deduplication does not short-circuit the work
+    text_bytes = text.encode('utf-8')
+    document_id = upload(text_bytes, 'benchmark.txt')['document_id']
+    batch = questions[:args.batch_size]
+    question_cycle = cycle(questions)
+    evaluation = {
+        'document_id': document_id,
+        'questions': batch,
+        'answers': ['The answer mentions ' + question for question in batch]
+    }
+
+    return {
+        'POST /upload txt': lambda: upload(text_bytes + f'\n\nRun {next(uploads)}'.encode(), 'benchmark.txt'),
+        'POST /upload pdf': lambda: upload(pdf_bytes + f'\n% run {next(uploads)}\n'.encode(), 'benchmark.pdf'),
+        'POST /upload duplicate': lambda: upload(text_bytes, 'benchmark.txt'),
+        'POST /ask': lambda: checked(client.post('/ask', json={'document_id': document_id, 'question': next(question_cycle)})),
+        'POST /ask/batch': (lambda: checked(client.post('/ask/batch', json={'document_id': document_id, 'questions': batch})), len(batch)),
+        'POST /search': lambda: checked(client.post('/search', json={'query': next(question_cycle), 'max_results': 10})),
+        'POST /summary': lambda: checked(client.post('/summary', json={'document_id': document_id, 'max_words': 80})),
+        'POST /challenge': lambda: checked(client.post('/challenge', json={'document_id': document_id})),
+        'POST /evaluate': (lambda: checked(client.post('/evaluate', json=evaluation)), len(batch)),
+        'POST /evaluate stream first result': lambda: first_streamed_event(client.post('/evaluate', json=dict(evaluation, stream='ndjson'), buffered=False)),
+        'GET /health': lambda: checked(client.get('/health'))
+    }
+
+def git_commit():
+    """Current commit of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Smart Research Assistant on synthetic documents')
+    parser.add_argument('--paragraphs', type=int, default=500, help='paragraphs in the synthetic document')
+    parser.add_argument('--words-per-paragraph', type=int, default=80, help='words per paragraph')
+    parser.add_argument('--vocabulary', type=int, default=5000, help='distinct words in the synthetic vocabulary')
+    parser.add_argument('--questions', type=int, default=50, help='distinct questions to cycle through')
+    parser.add_argument('--batch-size', type=int, default=10, help='questions per /ask/batch and /evaluate call')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per benchmark')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed calls before timing')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the generator')
+    parser.add_argument('--only', nargs='*', help='run only benchmarks whose name contains one of these strings')
+    parser.add_argument('--answer-cache', action='store_true', help='keep the answer cache on, so repeated questions are served from memory')
+    parser.add_argument('--skip-e2e', action='store_true', help='skip the Flask end-to-end benchmarks')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    # Keep uploads and the document store out of the working tree
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'documents.db')
+    os.environ['SWEEP_INTERVAL'] = '0'
+    if not args.answer_cache:
+        os.environ['ANSWER_CACHE_SIZE'] = '0'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import app as app_module
+    app_module.logger.setLevel('WARNING')
+
+    text, vocabulary = make_document(args.paragraphs, args.words_per_paragraph, args.vocabulary, args.seed)
+    questions = make_questions(vocabulary, args.questions, args.seed)
+    pdf_bytes = make_pdf(text)
+    pdf_path = os.path.join(workdir, 'benchmark.pdf')
+    with open(pdf_path, 'wb') as file:
+        file.write(pdf_bytes)
+
+    suites = {'micro': micro_benchmarks(app_module, text, pdf_path, questions, args)}
+    if not args.skip_e2e:
+        suites['end_to_end'] = end_to_end_benchmarks(app_module, text, pdf_bytes, questions, args)
+
+    results = {}
+    for suite, benchmarks in suites.items():
+        results[suite] = {}
+        for name, benchmark in benchmarks.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            function, items = benchmark if isinstance(benchmark, tuple) else (benchmark, 1)
+            results[suite][name] = run_benchmark(name, function, args.repeat, args.warmup, items)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pdf_support': app_module.PDF_SUPPORT,
+            'numpy_support': app_module.NUMPY_SUPPORT,
+            'document_chars': len(text),
+            'pdf_bytes': len(pdf_bytes),
+            'parameters': vars(args)
+        },
+        'results': results
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""Gunicorn settings for serving the Smart Research Assistant with several worker processes
+
+Usage: gunicorn app:app
+
+All workers share documents.db (documents, indexes, corpus, vocabulary and upload
+jobs), so any worker can answer for a document uploaded through another one.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# One process per core for CPU-bound ranking, with a few threads each for I/O
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Every worker starts its own pool of WORKER_PROCESSES processes for PDF
+# extraction and parallel evaluation; left at one per core in each worker they
+# would add up to cores x cores processes, so the cores are split between the
+# workers' pools instead. The workers import app after the fork and inherit this.
+os.environ.setdefault('WORKER_PROCESSES', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Large PDF uploads can take a while to extract and index synchronously
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+
+# Each worker opens its own SQLite connections and starts its own background
+# threads, which must not be created before the fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
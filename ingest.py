@@ -0,0 +1,66 @@
+"""Bulk ingestion of PDF and TXT archives into the Smart Research Assistant's document store
+
+Usage: python ingest.py DIR [DIR ...] [--manifest paths.txt] [--workers N] [--output results.jsonl]
+
+Run it from the server's working directory, with the same DATABASE_PATH, so the
+documents land in the store the server reads. Files are extracted, indexed and
+summarized in a process pool and written in batches; content already stored is
+skipped, so an interrupted run can simply be started again.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+def main():
+    # The running server sweeps the store; a sweeper thread here would only race it
+    os.environ['SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+
+    parser = argparse.ArgumentParser(description='Extract, summarize and index PDF and TXT files into the document store in parallel')
+    parser.add_argument('paths', nargs='*', help='files or directories to ingest, directories are searched recursively')
+    parser.add_argument('--manifest', help='file listing paths to ingest, one per line')
+    parser.add_argument('--workers', type=int, default=app_module.app.config['WORKER_PROCESSES'], help='worker processes (default: WORKER_PROCESSES)')
+    parser.add_argument('--batch-size', type=int, default=64, help='documents written per database transaction')
+    parser.add_argument('--ttl', type=int, default=app_module.app.config['DOCUMENT_TTL'], help='seconds until the documents expire, 0 keeps them (default: DOCUMENT_TTL)')
+    parser.add_argument('--output', help='write a JSON line per file with its status and document ID')
+    args = parser.parse_args()
+    if not args.paths and not args.manifest:
+        parser.error('give at least one path or --manifest')
+
+    paths = app_module.find_ingest_files(args.paths, args.manifest)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    interactive = sys.stderr.isatty()
+    started = time.perf_counter()
+    shown = [0.0]
+
+    def on_result(record):
+        if output:
+            output.write(json.dumps(record) + '\n')
+        if record['status'] == 'failed':
+            print(('\n' if interactive else '') + f"{record['path']}: {record['error']}", file=sys.stderr)
+
+    def on_progress(totals, final=False):
+        # Redraw a terminal line often, but only log a line every few seconds otherwise
+        now = time.perf_counter()
+        if not final and now - shown[0] < (0.5 if interactive else 5):
+            return
+        shown[0] = now
+        elapsed = max(now - started, 1e-9)
+        line = (f"{totals['done']}/{totals['files']} files: {totals['ingested']} ingested, {totals['skipped']} already stored, "
+                f"{totals['duplicate']} duplicates, {totals['failed']} failed | "
+                f"{totals['done'] / elapsed:.1f} files/s, {totals['bytes'] / elapsed / 1e6:.1f} MB/s, {elapsed:.0f}s")
+        print('\r' + line if interactive else line, end='\n' if final or not interactive else '', file=sys.stderr, flush=True)
+
+    try:
+        totals = app_module.ingest_files(paths, max(1, args.workers), args.ttl, max(1, args.batch_size), on_result, on_progress)
+    finally:
+        if output:
+            output.close()
+    on_progress(totals, final=True)
+    return 1 if totals['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""Test setup: app is imported once, inside a scratch directory with its own document store"""
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app creates its upload folder and opens its database on import, relative to the working directory
+WORKDIR = tempfile.mkdtemp(prefix='research-assistant-tests-')
+os.chdir(WORKDIR)
+os.environ.update({
+    'DATABASE_PATH': os.path.join(WORKDIR, 'documents.db'),
+    # Sweeps run when a test asks for them, not from a background thread
+    'SWEEP_INTERVAL': '0',
+    # An unlimited summary budget keeps summaries independent of machine speed
+    'SUMMARY_TIME_BUDGET_MS': '0',
+    'DOCUMENT_TTL': '0'
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+
+app_module.logger.setLevel('WARNING')
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+@pytest.fixture
+def upload(client):
+    """Upload text or bytes as a file, returning the response JSON"""
+    def upload(content, filename='document.txt', **form):
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        response = client.post('/upload', data={'file': (io.BytesIO(data), filename), **form}, content_type='multipart/form-data')
+        return response.get_json()
+    return upload
@@ -0,0 +1,44 @@
+"""Shared helpers for the test modules"""
+import numpy as np
+
+import app
+import benchmark
+
+def make_text(seed, paragraphs=30):
+    """Synthetic document text, different for every seed"""
+    return benchmark.make_document(paragraphs, 40, 300, seed)[0]
+
+def make_questions(seed, number=6):
+    """Questions built from the words of make_text(seed)"""
+    return benchmark.make_questions(benchmark.make_document(1, 1, 300, seed)[1], number, seed)
+
+def assert_same_index(index, expected):
+    """Assert an index equals a freshly built one, leaving out entries cached on it lazily"""
+    for key, value in expected.items():
+        actual = index.get(key)
+        if key == 'matrix':
+            # The ranking matrix may still be built on first use
+            if actual is None or value is None:
+                continue
+            for part, expected_part in value.items():
+                if isinstance(expected_part, np.ndarray):
+                    assert np.array_equal(actual[part], expected_part), part
+                else:
+                    assert actual[part] == expected_part, part
+        elif key in ('term_totals', 'concepts'):
+            # Counts are added in layers as text is appended, to the same totals in the same order
+            merged = [counts(actual), counts(value)]
+            assert merged[0] == merged[1], key
+        elif isinstance(value, app.TextSpans):
+            assert (actual.starts, actual.ends, list(actual)) == (value.starts, value.ends, list(value)), key
+        else:
+            assert actual == value, key
+
+def counts(layered):
+    """Layered counts, or the layered counts of concept statistics, merged into lists of nonzero counts"""
+    if isinstance(layered, dict):
+        return {key: counts(value) if isinstance(value, tuple) else value for key, value in layered.items()}
+    return [(key, count) for key, count in app.LayeredCounts.merged(layered).items() if count]
+
+def ask(client, document_id, question, **fields):
+    return client.post('/ask', json={'document_id': document_id, 'question': question, **fields}).get_json()
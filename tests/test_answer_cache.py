@@ -0,0 +1,16 @@
+"""Checks of memoized answers"""
+
+import app
+from helpers import make_text, ask
+
+def test_memoized_answers_serve_rephrased_questions_until_the_document_changes(client, upload):
+    document_id = upload(make_text(13))['document_id']
+    first = ask(client, document_id, 'What is the heliograph signal?')
+    hits = app.answer_cache.stats()['hits']
+    assert ask(client, document_id, 'WHAT is the heliograph   signal??') == first
+    assert app.answer_cache.stats()['hits'] == hits + 1
+
+    appended = 'The heliograph signal is defined as a coded flash of reflected sunlight between hill stations.'
+    assert client.post('/append', json={'document_id': document_id, 'text': appended}).get_json()['success']
+    answer = ask(client, document_id, 'What is the heliograph signal?')
+    assert answer != first and 'heliograph' in answer['answer'].lower()
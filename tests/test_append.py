@@ -0,0 +1,124 @@
+"""Checks of appends, delta rows and compaction"""
+import pytest
+
+import app
+from helpers import make_text, make_questions, assert_same_index
+
+DocumentProcessor = app.DocumentProcessor
+RankingEngine = app.RankingEngine
+TextAnalyzer = app.TextAnalyzer
+
+def test_appends_match_a_full_rebuild_through_deltas_replays_and_compaction(client, upload, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'APPEND_CHAIN_LIMIT', 2)
+    text = make_text(21)
+    document_id = upload(text)['document_id']
+    # A second document keeps sharing the content the appends start from
+    shared_id = upload(text)['document_id']
+
+    chain_lengths = []
+    for n in range(5):
+        piece = make_text(210 + n, paragraphs=3)
+        before = app.documents[document_id]
+        response = client.post('/append', json={'document_id': document_id, 'text': piece}).get_json()
+        text += '\n\n' + piece
+        fresh = DocumentProcessor.build_index(text)
+        assert response['paragraph_count'] == len(fresh['paragraphs'])
+
+        document = app.documents[document_id]
+        assert document['text'] == text
+        assert_same_index(document['index'], fresh)
+        # The summary is ranked on from the one before and the matrix waits for a search
+        assert response['summary'] == document['summary'] == TextAnalyzer.generate_summary(text, app.app.config['SUMMARY_MAX_WORDS'],
+                                                                                           index=document['index'])
+        assert len(document['summary'].split()) <= app.app.config['SUMMARY_MAX_WORDS']
+        assert document['index']['matrix'] is None
+
+        # Deltas are replayed from their stored pieces once their content leaves memory
+        app.documents.uncache(document['content_hash'])
+        assert_same_index(app.documents[document_id]['index'], fresh)
+        chain_lengths.append(len(app.documents.delta_chain(document['content_hash'])))
+    assert chain_lengths == [2, 3, 1, 2, 3]
+    assert app.documents[shared_id]['text'] == make_text(21)
+
+    # A request that read the document before the last append must not overwrite it
+    with pytest.raises(app.DocumentConflict):
+        app.append_document(document_id, before, 'A late paragraph that lost the race against the previous append.')
+
+    # Corpus rows match those of the same text uploaded in one go
+    rebuilt_id = upload(text, 'rebuilt.txt')['document_id']
+    for scorer in RankingEngine.SCORERS:
+        for question in make_questions(21, 3) + make_questions(214, 3):
+            found = [client.post('/search', json={'query': question, 'document_ids': [target], 'scorer': scorer}).get_json()['results']
+                     for target in (document_id, rebuilt_id)]
+            assert [(result['paragraph_index'], result['content']) for result in found[0]] == [(result['paragraph_index'], result['content']) for result in found[1]]
+            assert [result['score'] for result in found[0]] == pytest.approx([result['score'] for result in found[1]])
+
+def test_appended_summaries_rank_like_a_full_ranking_when_the_state_holds_every_term_and_paragraph(client, upload, monkeypatch):
+    monkeypatch.setattr(app.Summarizer, 'CENTROID_TERMS', 10 ** 6)
+    monkeypatch.setattr(app.Summarizer, 'CANDIDATE_PARAGRAPHS', 10 ** 6)
+    text = make_text(37, paragraphs=8)
+    document_id = upload(text)['document_id']
+    for n in range(3):
+        piece = make_text(370 + n, paragraphs=2)
+        summary = client.post('/append', json={'document_id': document_id, 'text': piece}).get_json()['summary']
+        text += '\n\n' + piece
+        index = app.documents[document_id]['index']
+        fresh = DocumentProcessor.build_index(text)
+        assert list(index['summary_ranking']) == list(app.Summarizer.rank_sentences(fresh)[0])
+        assert summary == TextAnalyzer.generate_summary(text, app.app.config['SUMMARY_MAX_WORDS'], index=fresh)
+
+def scanned_chain_targets(conn):
+    """Live records including each chain member's postings, found by walking every chain"""
+    rows = conn.execute('SELECT content_hash, base_hash, refcount FROM contents WHERE base_hash IS NOT NULL OR extensions > 0').fetchall()
+    deltas = {}
+    for content_hash, base_hash, _ in rows:
+        deltas.setdefault(base_hash, []).append(content_hash)
+    live = {content_hash for content_hash, _, refcount in rows if refcount > 0}
+    targets = {}
+    for content_hash, _, _ in rows:
+        pending = [content_hash]
+        while pending:
+            member = pending.pop()
+            if member in live:
+                targets.setdefault(content_hash, set()).add(member)
+            pending.extend(deltas.get(member, ()))
+    return targets
+
+def stored_chain_targets(conn):
+    targets = {}
+    for content_hash, target_hash in conn.execute('SELECT content_hash, target_hash FROM chain_targets'):
+        targets.setdefault(content_hash, set()).add(target_hash)
+    return targets
+
+def test_chain_targets_follow_appends_shared_content_and_deletions(client, upload):
+    conn = app.documents.connection()
+    text = make_text(35)
+    first = upload(text)['document_id']
+    second = upload(text)['document_id']
+    def append(document_id, seed):
+        assert client.post('/append', json={'document_id': document_id, 'text': make_text(seed, paragraphs=2)}).get_json()['success']
+
+    append(first, 350)
+    # A second branch from the same content, then a delta on the first branch
+    append(second, 351)
+    assert len(stored_chain_targets(conn)[app.documents[first]['content_hash']]) == 1
+    base_targets = stored_chain_targets(conn)[app.documents.delta_chain(app.documents[first]['content_hash'])[-1]]
+    assert base_targets == {app.documents[first]['content_hash'], app.documents[second]['content_hash']}
+    steps = [
+        lambda: append(first, 352),
+        # The content the branches start from stays, for them, after its last document moves on
+        lambda: app.documents.__delitem__(second),
+        lambda: upload(text),
+        lambda: app.documents.__delitem__(first)
+    ]
+    for step in steps:
+        step()
+        assert stored_chain_targets(conn) == scanned_chain_targets(conn)
+
+    # Databases created before the table build it from their chains
+    client.post('/append', json={'document_id': upload(make_text(36))['document_id'], 'text': make_text(360, paragraphs=2)})
+    expected = stored_chain_targets(conn)
+    with conn:
+        conn.execute('DROP TABLE chain_targets')
+    app.DocumentStore(app.app.config['DATABASE_PATH'], 1)
+    assert stored_chain_targets(conn) == expected == scanned_chain_targets(conn)
@@ -0,0 +1,27 @@
+"""Checks of batched questions"""
+
+import app
+from helpers import make_text, make_questions
+
+DocumentProcessor = app.DocumentProcessor
+RankingEngine = app.RankingEngine
+TextAnalyzer = app.TextAnalyzer
+
+def test_ask_batch_answers_like_single_questions_and_scores_like_one_query_at_a_time(client, upload):
+    text = make_text(14, paragraphs=50)
+    document_id = upload(text)['document_id']
+    questions = make_questions(14, 5)
+    questions.append(questions[0])
+
+    answers = client.post('/ask/batch', json={'document_id': document_id, 'questions': questions}).get_json()['answers']
+    assert [answer['question'] for answer in answers] == questions
+    for answer, question in zip(answers, questions):
+        expected = TextAnalyzer.answer_question(text, question)
+        assert (answer['answer'], answer['justification']) == (expected['answer'], expected['justification'])
+
+    index = DocumentProcessor.build_index(text)
+    word_sets = [TextAnalyzer.question_terms(question) for question in questions]
+    for scorer in RankingEngine.SCORERS:
+        together = RankingEngine.score_many(index, word_sets, scorer=scorer)
+        one_by_one = [RankingEngine.score(index, words, scorer=scorer) for words in word_sets]
+        assert [[i for _, i, _ in ranked] for ranked in together] == [[i for _, i, _ in ranked] for ranked in one_by_one]
@@ -0,0 +1,21 @@
+"""Checks of the benchmark script"""
+import argparse
+
+import app
+import benchmark
+
+def test_benchmark_suites_run_on_a_small_synthetic_corpus(tmp_path):
+    text, vocabulary = benchmark.make_document(20, 30, 200, seed=17)
+    questions = benchmark.make_questions(vocabulary, 4, seed=17)
+    pdf_bytes = benchmark.make_pdf(text)
+    pdf_path = tmp_path / 'benchmark.pdf'
+    pdf_path.write_bytes(pdf_bytes)
+    args = argparse.Namespace(batch_size=2)
+
+    suites = [benchmark.micro_benchmarks(app, text, str(pdf_path), questions, args),
+              benchmark.end_to_end_benchmarks(app, text, pdf_bytes, questions, args)]
+    for benchmarks in suites:
+        for name, entry in benchmarks.items():
+            function, items = entry if isinstance(entry, tuple) else (entry, 1)
+            result = benchmark.run_benchmark(name, function, repeat=2, warmup=0, items=items)
+            assert result['p50_ms'] <= result['p99_ms'] and result['items_per_call'] == items
@@ -0,0 +1,43 @@
+"""Checks of the vectorized BM25 scorer"""
+import re
+
+import numpy as np
+import pytest
+
+import app
+from helpers import make_text, make_questions, ask
+
+DocumentProcessor = app.DocumentProcessor
+RankingEngine = app.RankingEngine
+TextAnalyzer = app.TextAnalyzer
+
+def test_bm25_matches_a_paragraph_by_paragraph_computation(client, upload):
+    text = make_text(2, paragraphs=60)
+    index = DocumentProcessor.build_index(text)
+    paragraph_tokens = [re.findall(r'\b\w+\b', paragraph.lower()) for paragraph in index['paragraphs']]
+    paragraph_sets = [set(tokens) for tokens in paragraph_tokens]
+    average_length = sum(map(len, paragraph_tokens)) / len(paragraph_tokens)
+    k1, b = RankingEngine.BM25_K1, RankingEngine.BM25_B
+
+    for question in make_questions(2):
+        words = TextAnalyzer.question_terms(question)
+        scores = []
+        for i, tokens in enumerate(paragraph_tokens):
+            score = 0.0
+            for word in words:
+                frequency = tokens.count(word)
+                if not frequency:
+                    continue
+                document_frequency = sum(word in other for other in paragraph_sets)
+                idf = np.log(1 + (len(paragraph_tokens) - document_frequency + 0.5) / (document_frequency + 0.5))
+                score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(tokens) / average_length))
+            if score > 0:
+                scores.append((score, i))
+        expected = sorted(scores, reverse=True)[:3]
+        ranked = RankingEngine.score(index, words, scorer='bm25')
+        assert [i for _, i, _ in ranked] == [i for _, i in expected]
+        assert [score for score, _, _ in ranked] == pytest.approx([score for score, _ in expected])
+
+    document_id = upload(text)['document_id']
+    rejected = ask(client, document_id, 'What is this?', scorer='tfidf')
+    assert not rejected['success'] and 'bm25' in rejected['error']
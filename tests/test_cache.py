@@ -0,0 +1,52 @@
+"""Checks of the document cache budget and expiry"""
+import os
+import time
+
+import app
+from helpers import make_text, ask
+
+def test_cache_evicts_least_recently_used_content_and_expired_documents_are_released(client, upload):
+    first = upload(make_text(6))['document_id']
+    second = upload(make_text(7))['document_id']
+    store = app.DocumentStore(app.app.config['DATABASE_PATH'], 1)
+    store[first]
+    store[second]
+    assert store.cache_stats()['evictions'] == 1 and store.cache_stats()['contents'] == 1
+    assert store[first]['text'] == app.documents[first]['text']
+    assert store.cache_stats()['misses'] == 3
+
+    expiring = upload(make_text(8), ttl='1')['document_id']
+    filepath = app.documents[expiring]['filepath']
+    time.sleep(1.1)
+    assert ask(client, expiring, 'What is it?') == {'success': False, 'error': 'Document expired'}
+    app.sweep_documents()
+    assert not os.path.exists(filepath)
+    assert expiring not in app.documents
+
+def test_data_cached_on_an_index_after_loading_is_charged_to_the_budget(client, upload):
+    document_id = upload(make_text(32))['document_id']
+    content_hash = app.documents[document_id]['content_hash']
+    size = app.documents.cache[content_hash][1]
+    cached_bytes = app.documents.cached_bytes
+
+    document = app.documents[document_id]
+    index = document['index']
+    app.RankingEngine.static_scores(index)
+    for token_id in list(index['postings'])[:50]:
+        app.RankingEngine.position_offsets(index, token_id)
+    app.TextAnalyzer.generate_challenge_questions(document['text'], index, seed=3)
+    app.TextAnalyzer.document_vocabulary(document['text'], index)
+    assert {'static_scores', 'position_offsets', 'key_concepts', 'challenge_sets', 'vocabulary'} <= index.keys()
+    grown = app.documents.cache[content_hash][1] - size
+    assert grown > 0 and app.documents.cached_bytes - cached_bytes == grown
+    assert app.documents.cached_bytes == sum(entry[1] for entry in app.documents.cache.values())
+
+    # Filling a cache past the budget evicts the least recently used content
+    first = upload(make_text(33))['document_id']
+    second = upload(make_text(34))['document_id']
+    store = app.DocumentStore(app.app.config['DATABASE_PATH'], 1 << 30)
+    store[first]
+    index = store[second]['index']
+    store.cache_bytes = store.cached_bytes + 10
+    store.keep_on_index(index, 'vocabulary', frozenset(store[second]['text'].lower().split()))
+    assert store.cache_stats()['evictions'] == 1 and list(store.cache) == [app.documents[second]['content_hash']]
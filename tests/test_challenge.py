@@ -0,0 +1,17 @@
+"""Checks of seeded challenge questions"""
+
+import app
+from helpers import make_text
+
+DocumentProcessor = app.DocumentProcessor
+TextAnalyzer = app.TextAnalyzer
+
+def test_seeded_challenges_are_reproducible_from_cached_concepts(client, upload):
+    text = make_text(23)
+    document_id = upload(text)['document_id']
+    assert TextAnalyzer.get_key_concepts(app.documents[document_id]['index']) == TextAnalyzer.extract_key_concepts(text)
+
+    challenge = client.post('/challenge', json={'document_id': document_id, 'seed': 7}).get_json()
+    assert challenge['seed'] == 7 and challenge['questions']
+    assert client.post('/challenge', json={'document_id': document_id, 'seed': 7}).get_json()['questions'] == challenge['questions']
+    assert challenge['questions'] == TextAnalyzer.generate_challenge_questions(text, DocumentProcessor.build_index(text), seed=7)
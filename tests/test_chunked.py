@@ -0,0 +1,33 @@
+"""Checks of chunked uploads"""
+
+import app
+from helpers import make_text, assert_same_index
+
+DocumentProcessor = app.DocumentProcessor
+TextAnalyzer = app.TextAnalyzer
+
+def test_chunked_upload_builds_the_same_document_as_a_direct_upload(client, upload, monkeypatch):
+    # Index while chunks arrive, with chunk boundaries inside characters, line endings and paragraphs
+    monkeypatch.setattr(app.ChunkedUploads, 'INDEX_STEP', 200)
+    text = make_text(24).replace('\n\n', '\n\nThe naïve café résumé — ünïcödé text.\n\n', 3)
+    data = text.encode('utf-8').replace(b'\n', b'\r\n')
+
+    started = client.post('/upload/chunked', json={'filename': 'chunked.txt', 'size': len(data)})
+    assert started.status_code == 201
+    upload_url = started.get_json()['upload_url']
+    for offset in range(0, len(data), 97):
+        response = client.put(upload_url, data=data[offset:offset + 97], headers={'Upload-Offset': str(offset)}).get_json()
+        assert response['offset'] == min(offset + 97, len(data))
+        if offset == 97 * 3:
+            # A resent chunk is refused with the offset to resume from
+            resent = client.put(upload_url, data=data[:97], headers={'Upload-Offset': '0'})
+            assert resent.status_code == 409 and resent.get_json()['offset'] == offset + 97
+
+    completed = client.post(upload_url + '/complete').get_json()
+    document = app.documents[completed['document_id']]
+    assert document['text'] == text
+    assert_same_index(document['index'], DocumentProcessor.build_index(text))
+    assert completed['summary'] == TextAnalyzer.generate_summary(text, app.app.config['SUMMARY_MAX_WORDS'], index=DocumentProcessor.build_index(text))
+
+    # The content hash computed on the way matches a direct upload of the same bytes
+    assert upload(data, 'direct.txt')['deduplicated']
@@ -0,0 +1,21 @@
+"""Checks of content deduplication"""
+import os
+
+import app
+from helpers import make_text
+
+def test_identical_uploads_share_content_until_the_last_one_goes(upload):
+    text = make_text(15)
+    first = upload(text, 'first.txt')
+    second = upload(text, 'second.txt')
+    assert second['deduplicated'] and 'deduplicated' not in first
+    assert second['summary'] == first['summary']
+
+    content_hash = app.documents[first['document_id']]['content_hash']
+    assert app.documents[second['document_id']]['content_hash'] == content_hash
+    refcount, = app.documents.connection().execute('SELECT refcount FROM contents WHERE content_hash = ?', (content_hash,)).fetchone()
+    assert refcount == 2
+    assert not [name for name in os.listdir(app.app.config['UPLOAD_FOLDER']) if name.startswith(second['document_id'])]
+
+    del app.documents[first['document_id']]
+    assert app.documents[second['document_id']]['text'] == text
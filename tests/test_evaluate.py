@@ -0,0 +1,17 @@
+"""Checks of batch answer evaluation"""
+
+import app
+from helpers import make_text, make_questions
+
+TextAnalyzer = app.TextAnalyzer
+
+def test_evaluate_scores_each_answer_like_evaluate_answer(client, upload):
+    text = make_text(12)
+    document_id = upload(text)['document_id']
+    questions = make_questions(12, 4)
+    answers = ['The answer mentions ' + question for question in questions[:2]] + ['No idea', questions[3]]
+
+    feedback = client.post('/evaluate', json={'document_id': document_id, 'questions': questions, 'answers': answers}).get_json()['feedback']
+    for item, question, answer in zip(feedback, questions, answers):
+        expected = TextAnalyzer.evaluate_answer(text, question, answer)
+        assert (item['score'], item['feedback'], item['justification']) == (expected['score'], expected['feedback'], expected['justification'])
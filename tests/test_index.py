@@ -0,0 +1,26 @@
+"""Checks of the paragraph inverted index against a fresh build and the raw-text answers"""
+import re
+
+import app
+from helpers import make_text, make_questions, assert_same_index, ask
+
+DocumentProcessor = app.DocumentProcessor
+TextAnalyzer = app.TextAnalyzer
+
+def test_upload_index_matches_a_fresh_build_and_answers_like_the_raw_text(client, upload):
+    text = make_text(1)
+    uploaded = upload(text)
+    document = app.documents[uploaded['document_id']]
+    assert document['text'] == text
+    assert_same_index(document['index'], DocumentProcessor.build_index(text))
+
+    # Postings list exactly the paragraphs holding each term
+    paragraph_words = [set(re.findall(r'\b\w+\b', paragraph.lower())) for paragraph in document['index']['paragraphs']]
+    for term in sorted(paragraph_words[3])[:10]:
+        token_id = app.vocabulary.lookup([term])[term]
+        assert list(document['index']['postings'][token_id]) == [i for i, words in enumerate(paragraph_words) if term in words]
+
+    for question in make_questions(1):
+        answer = ask(client, uploaded['document_id'], question)
+        expected = TextAnalyzer.answer_question(text, question)
+        assert (answer['answer'], answer['justification']) == (expected['answer'], expected['justification'])
@@ -0,0 +1,32 @@
+"""Checks of the bulk ingestion command"""
+import os
+
+import app
+from helpers import make_text, assert_same_index
+
+DocumentProcessor = app.DocumentProcessor
+TextAnalyzer = app.TextAnalyzer
+
+def test_bulk_ingestion_stores_what_uploads_would_and_skips_stored_content(upload, tmp_path):
+    texts = [make_text(25), make_text(26)]
+    for name, content in (('a.txt', texts[0]), ('b.txt', texts[1]), ('copy.txt', texts[0]), ('notes.md', 'Not a document')):
+        (tmp_path / name).write_text(content, encoding='utf-8')
+    paths = app.find_ingest_files([str(tmp_path)])
+    assert [os.path.basename(path) for path in paths] == ['a.txt', 'b.txt', 'copy.txt']
+
+    records = []
+    totals = app.ingest_files(paths, 2, 0, batch_size=1, on_result=records.append)
+    assert (totals['ingested'], totals['duplicate'], totals['failed']) == (2, 1, 0)
+    # Workers finish in any order
+    document_ids = {os.path.basename(record['path']): record['document_id'] for record in records}
+    assert document_ids['copy.txt'] == document_ids['a.txt']
+    for name, text in zip(('a.txt', 'b.txt'), texts):
+        document = app.documents[document_ids[name]]
+        assert document['text'] == text
+        assert document['summary'] == TextAnalyzer.generate_summary(text, app.app.config['SUMMARY_MAX_WORDS'], index=DocumentProcessor.build_index(text))
+        assert_same_index(document['index'], DocumentProcessor.build_index(text))
+    # Jobs tracking the copies in the upload folder are finished once they are stored
+    assert not app.ingest_queue.known_files() & {app.documents[document_id]['filepath'] for document_id in document_ids.values()}
+
+    assert app.ingest_files(paths, 2, 0)['skipped'] == 3
+    assert upload(texts[1], 'b.txt')['deduplicated']
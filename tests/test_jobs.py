@@ -0,0 +1,38 @@
+"""Checks of asynchronous uploads and the sweeper"""
+import os
+import time
+import uuid
+
+import app
+from helpers import make_text, assert_same_index
+
+DocumentProcessor = app.DocumentProcessor
+
+def test_async_upload_reports_progress_until_the_document_is_stored(client, upload):
+    text = make_text(10)
+    accepted = upload(text, **{'async': 'true'})
+    assert accepted['status_url'] == f"/status/{accepted['job_id']}"
+
+    deadline = time.time() + 30
+    status = client.get(accepted['status_url']).get_json()
+    while status['stage'] not in ('done', 'failed') and time.time() < deadline:
+        time.sleep(0.05)
+        status = client.get(accepted['status_url']).get_json()
+    assert status['stage'] == 'done'
+    assert_same_index(app.documents[accepted['document_id']]['index'], DocumentProcessor.build_index(text))
+
+def test_sweeper_keeps_the_files_of_unfinished_jobs():
+    document_id = str(uuid.uuid4())
+    filepath = os.path.join(app.app.config['UPLOAD_FOLDER'], f'{document_id}_queued.txt')
+    with open(filepath, 'w', encoding='utf-8') as file:
+        file.write(make_text(11))
+    an_hour_ago = time.time() - 3600
+    os.utime(filepath, (an_hour_ago, an_hour_ago))
+
+    job_id, = app.ingest_queue.track([(document_id, 'queued.txt', filepath)])
+    app.sweep_documents()
+    assert os.path.exists(filepath)
+
+    app.ingest_queue.finish([job_id])
+    app.sweep_documents()
+    assert not os.path.exists(filepath)
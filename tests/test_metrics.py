@@ -0,0 +1,20 @@
+"""Checks of the metrics endpoint"""
+
+from helpers import make_text, ask
+
+def test_metrics_count_requests_by_route_and_time_pipeline_stages(client, upload):
+    document_id = upload(make_text(18))['document_id']
+    counter = 'research_assistant_http_requests_total{route="/ask",method="POST",status="200"}'
+
+    def requests_counted():
+        for line in client.get('/metrics').get_data(as_text=True).splitlines():
+            if line.startswith(counter + ' '):
+                return int(line.split()[-1])
+        return 0
+
+    before = requests_counted()
+    ask(client, document_id, 'What is the measure of the result?')
+    exposition = client.get('/metrics').get_data(as_text=True)
+    assert requests_counted() == before + 1
+    for stage in ('save', 'extract_txt', 'index', 'summarize', 'store', 'score', 'answer'):
+        assert f'research_assistant_stage_duration_seconds_count{{stage="{stage}"}}' in exposition
@@ -0,0 +1,53 @@
+"""Checks of near-duplicate paragraph collapsing"""
+from array import array
+
+import app
+from helpers import make_text
+
+DocumentProcessor = app.DocumentProcessor
+NearDuplicates = app.NearDuplicates
+TextAnalyzer = app.TextAnalyzer
+
+def test_near_duplicate_paragraphs_are_indexed_once_and_reported_as_copies(client, upload, monkeypatch):
+    footer = 'Confidential report of the northern survey team, page {} of 40, printed by the records office for internal review.'
+    body = make_text(30, paragraphs=6).split('\n\n')
+    text = '\n\n'.join(f'{paragraph}\n\n{footer.format(page)}' for page, paragraph in enumerate(body, start=1))
+    document_id = upload(text)['document_id']
+    index = app.documents[document_id]['index']
+
+    footers = [i for i, paragraph in enumerate(index['paragraphs']) if paragraph.startswith('Confidential')]
+    assert dict(index['copies']) == {footers[0]: array('I', footers[1:])}
+    token_id = app.vocabulary.lookup(['confidential'])['confidential']
+    assert list(index['postings'][token_id]) == footers[:1]
+
+    results = client.post('/search', json={'query': 'confidential survey records', 'document_ids': [document_id]}).get_json()['results']
+    assert results[0]['paragraph_index'] == footers[0] and results[0]['copies'] == footers[1:]
+
+    monkeypatch.setitem(app.app.config, 'NEAR_DUPLICATE_THRESHOLD', 0)
+    uncollapsed = DocumentProcessor.build_index(text)
+    assert not uncollapsed['copies'] and list(uncollapsed['postings'][token_id]) == footers
+
+def test_answers_replace_near_duplicate_contexts_with_the_next_best_paragraphs(monkeypatch):
+    footer = 'Confidential report of the northern survey team, page {} of 40, printed by the records office for internal review.'
+    body = make_text(31, paragraphs=8).split('\n\n')
+    text = '\n\n'.join(body[:2] + [footer.format(1), footer.format(2)] + body[2:])
+    # Both footers indexed, as near-duplicates the index-time hashing misses would be
+    monkeypatch.setitem(app.app.config, 'NEAR_DUPLICATE_THRESHOLD', 0)
+    index = DocumentProcessor.build_index(text)
+    monkeypatch.setitem(app.app.config, 'NEAR_DUPLICATE_THRESHOLD', 0.9)
+    question = 'What does the confidential survey report say?'
+
+    top = TextAnalyzer.find_relevant_context(text, question, 3, index=index)
+    assert len(NearDuplicates.distinct_contexts(top)) < 3
+    ranked = TextAnalyzer.find_relevant_context(text, question, TextAnalyzer.ANSWER_CONTEXTS + TextAnalyzer.DUPLICATE_MARGIN, index=index)
+    expected = NearDuplicates.distinct_contexts(ranked)[:3]
+    assert len(expected) == 3 and sum(context[2].startswith('Confidential') for context in expected) == 1
+
+    answered_from = []
+    generate_contextual_answer = TextAnalyzer.generate_contextual_answer
+    def spy(context_text, *args):
+        answered_from.append(context_text)
+        return generate_contextual_answer(context_text, *args)
+    monkeypatch.setattr(TextAnalyzer, 'generate_contextual_answer', spy)
+    TextAnalyzer.answer_question(text, question, index=index)
+    assert answered_from == [' '.join(context[2] for context in expected)]
@@ -0,0 +1,31 @@
+"""Checks of PDF text extraction"""
+
+import app
+import benchmark
+from helpers import make_text, make_questions, assert_same_index, ask
+
+DocumentProcessor = app.DocumentProcessor
+
+def test_pdf_pages_extract_the_same_in_parallel_and_keep_page_offsets(client, upload, monkeypatch, tmp_path):
+    text = make_text(9, paragraphs=12)
+    pdf_path = tmp_path / 'pages.pdf'
+    pdf_path.write_bytes(benchmark.make_pdf(text, lines_per_page=8))
+    lines = text.split('\n')
+    pages = [lines[start:start + 8] for start in range(0, len(lines), 8)]
+
+    monkeypatch.setitem(app.app.config, 'WORKER_PROCESSES', 1)
+    serial = DocumentProcessor.extract_pdf_pages(str(pdf_path))
+    monkeypatch.setitem(app.app.config, 'WORKER_PROCESSES', 2)
+    monkeypatch.setitem(app.app.config, 'PDF_PARALLEL_MIN_PAGES', 1)
+    assert DocumentProcessor.extract_pdf_pages(str(pdf_path)) == serial
+
+    extracted, page_offsets = serial
+    assert len(page_offsets) == len(pages)
+    for offset, lines in zip(page_offsets, pages):
+        first_line = next(line for line in lines if line)
+        assert extracted[offset:].lstrip().startswith(first_line)
+
+    uploaded = upload(pdf_path.read_bytes(), 'pages.pdf')
+    document = app.documents[uploaded['document_id']]
+    assert_same_index(document['index'], DocumentProcessor.build_index(extracted, page_offsets))
+    assert '(page ' in ask(client, uploaded['document_id'], make_questions(9)[0])['justification']
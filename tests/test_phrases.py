@@ -0,0 +1,26 @@
+"""Checks of quoted phrases and proximity scoring"""
+
+import app
+from helpers import make_text, ask
+
+DocumentProcessor = app.DocumentProcessor
+TextAnalyzer = app.TextAnalyzer
+
+NEAR_PARAGRAPH = 'Museum curators often describe the art state of ancient collections during long winter seasons near old harbours.'
+PHRASE_PARAGRAPH = 'Engineers in northern laboratories built machines that were truly state of the art for their quiet daily work today.'
+
+def test_quoted_phrases_rank_and_memoize_apart_from_the_same_words_unquoted(client, upload):
+    text = '\n\n'.join([NEAR_PARAGRAPH, PHRASE_PARAGRAPH, make_text(29, paragraphs=2)])
+    document_id = upload(text)['document_id']
+    unquoted, quoted = 'What is state of the art?', 'What is "state of the art"?'
+
+    index = DocumentProcessor.build_index(text)
+    assert TextAnalyzer.find_relevant_context(text, unquoted, index=index)[0][1] == 0
+    assert TextAnalyzer.find_relevant_context(text, quoted, index=index)[0][1] == 1
+
+    assert app.AnswerCache.key('hash', unquoted, 'legacy') != app.AnswerCache.key('hash', quoted, 'legacy')
+    # The unquoted answer is memoized first and must not be served for the quoted question
+    unquoted_answer = ask(client, document_id, unquoted)
+    quoted_answer = ask(client, document_id, quoted)
+    assert unquoted_answer['justification'] != quoted_answer['justification']
+    assert {key: quoted_answer[key] for key in ('answer', 'justification')} == TextAnalyzer.answer_question(text, quoted)
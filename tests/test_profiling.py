@@ -0,0 +1,34 @@
+"""Checks of per-request profiling"""
+import os
+
+import app
+from helpers import make_text
+
+def test_profiling_is_opt_in_and_reports_a_summary_or_a_file(client, upload, monkeypatch, tmp_path):
+    document_id = upload(make_text(19))['document_id']
+    request = {'document_id': document_id, 'max_words': 40}
+    assert 'profile' not in client.post('/summary', json=request, headers={'X-Profile': 'summary'}).get_json()
+
+    monkeypatch.setitem(app.app.config, 'PROFILING_ENABLED', True)
+    monkeypatch.setitem(app.app.config, 'PROFILE_DIR', str(tmp_path))
+    profile = client.post('/summary', json=request, headers={'X-Profile': 'summary'}).get_json()['profile']
+    assert profile['functions'] and profile['total_time'] >= 0
+
+    response = client.post('/summary?profile=file', json=request)
+    assert os.path.dirname(response.headers['X-Profile-File']) == str(tmp_path)
+    assert 'profile' not in response.get_json()
+
+def test_profile_files_beyond_the_limit_are_pruned_oldest_first(client, upload, monkeypatch, tmp_path):
+    document_id = upload(make_text(19))['document_id']
+    monkeypatch.setitem(app.app.config, 'PROFILING_ENABLED', True)
+    monkeypatch.setitem(app.app.config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setitem(app.app.config, 'PROFILE_MAX_FILES', 3)
+    # An older profile, and a file that is not a profile and stays
+    (tmp_path / '19990101T000000_old.prof').write_bytes(b'')
+    os.utime(tmp_path / '19990101T000000_old.prof', (0, 0))
+    (tmp_path / 'notes.txt').write_text('kept')
+
+    paths = [client.post('/summary?profile=file', json={'document_id': document_id}).headers['X-Profile-File'] for _ in range(4)]
+    remaining = sorted(os.listdir(tmp_path))
+    assert len(remaining) == 4 and 'notes.txt' in remaining and '19990101T000000_old.prof' not in remaining
+    assert os.path.basename(paths[-1]) in remaining
@@ -0,0 +1,51 @@
+"""Checks of max-score pruning and answer deadlines"""
+
+import app
+from helpers import make_text, make_questions, ask
+
+DocumentProcessor = app.DocumentProcessor
+RankingEngine = app.RankingEngine
+TextAnalyzer = app.TextAnalyzer
+
+def test_pruned_ranking_equals_scoring_every_matching_paragraph(client, upload):
+    text = make_text(28, paragraphs=300)
+    index = DocumentProcessor.build_index(text)
+    postings = index['postings']
+    for question in make_questions(28, 20):
+        words = TextAnalyzer.question_terms(question)
+        token_ids = app.vocabulary.lookup(words).values()
+        overlaps = {}
+        for token_id in token_ids:
+            for i in postings.get(token_id, ()):
+                overlaps[i] = overlaps.get(i, 0) + 1
+        proximity = RankingEngine.proximity_query(index, token_ids, ())
+        assert RankingEngine.score_legacy(index, words) == RankingEngine.rank_legacy(index, overlaps, len(words), 3, proximity)
+
+    document_id = upload(text)['document_id']
+    question = make_questions(28)[0]
+    content_hash = app.documents[document_id]['content_hash']
+    cut_short = ask(client, document_id, question, deadline_ms=0.001)
+    assert cut_short['partial'] is True
+    # Partial answers are not memoized
+    assert app.answer_cache.get(content_hash, question, 'legacy') is None
+    in_time = ask(client, document_id, question, deadline_ms=60000)
+    assert in_time['partial'] is False
+    assert {key: in_time[key] for key in ('answer', 'justification')} == TextAnalyzer.answer_question(text, question)
+
+def test_bm25_scored_in_blocks_under_a_deadline_equals_the_single_pass(client, upload, monkeypatch):
+    text = make_text(29, paragraphs=300)
+    index = DocumentProcessor.build_index(text)
+    # Blocks much shorter than the postings lists, so terms are split across deadline checks
+    monkeypatch.setattr(RankingEngine, 'BM25_DEADLINE_BLOCK', 7)
+    for question in make_questions(29, 20):
+        words = TextAnalyzer.question_terms(question)
+        deadline = app.Deadline(60)
+        assert RankingEngine.score_bm25(index, words, deadline=deadline) == RankingEngine.score_bm25(index, words)
+        assert not deadline.reached
+
+    document_id = upload(text)['document_id']
+    question = make_questions(29)[0]
+    cut_short = ask(client, document_id, question, scorer='bm25', deadline_ms=0.001)
+    assert cut_short['partial'] is True
+    assert app.answer_cache.get(app.documents[document_id]['content_hash'], question, 'bm25') is None
+    assert ask(client, document_id, question, scorer='bm25', deadline_ms=60000)['partial'] is False
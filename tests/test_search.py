@@ -0,0 +1,17 @@
+"""Checks of cross-document search"""
+
+import app
+from helpers import make_text
+
+def test_search_ranks_paragraphs_across_documents_and_honours_document_ids(client, upload):
+    first = upload(make_text(3) + '\n\nThe heliotrope lantern glowed over the harbour wall all night long.')['document_id']
+    second = upload(make_text(4) + '\n\nA heliotrope lantern and a brass compass were found in the heliotrope chest.')['document_id']
+
+    results = client.post('/search', json={'query': 'heliotrope lantern'}).get_json()['results']
+    assert [result['document_id'] for result in results[:2]] == [second, first]
+    for result in results[:2]:
+        assert result['content'] == app.documents[result['document_id']]['index']['paragraphs'][result['paragraph_index']]
+
+    scoped = client.post('/search', json={'query': 'heliotrope lantern', 'document_ids': [first]}).get_json()['results']
+    assert scoped and {result['document_id'] for result in scoped} == {first}
+    assert 'harbour wall' in scoped[0]['content']
@@ -0,0 +1,24 @@
+"""Checks of the offset-based document representation"""
+import pickle
+
+import app
+from helpers import make_text, assert_same_index
+
+DocumentProcessor = app.DocumentProcessor
+
+def test_indexes_are_offset_views_over_one_text_with_shared_token_ids(upload):
+    text = make_text(16)
+    document = app.documents[upload(text)['document_id']]
+    index = document['index']
+    assert index['paragraphs'].text is document['text'] and index['sentences'].text is document['text']
+    assert list(index['paragraphs']) == [' '.join(block.split('\n')) for block in text.split('\n\n')]
+
+    # Stored indexes hold offsets only, and are bound to the text again on load
+    data = app.DocumentStore.serialize_index(index)
+    assert index['paragraphs'][0].encode('utf-8') not in data
+    assert_same_index(DocumentProcessor.bind_text(pickle.loads(data), document['text']), index)
+
+    other_process = app.Vocabulary(app.documents)
+    for token_id in list(index['postings'])[:20]:
+        term = app.vocabulary.term(token_id)
+        assert other_process.lookup([term]) == {term: token_id}
@@ -0,0 +1,21 @@
+"""Checks of the SQLite document store"""
+import uuid
+
+import app
+from helpers import make_text, assert_same_index
+
+DocumentProcessor = app.DocumentProcessor
+
+def test_documents_survive_a_restart_and_existence_checks_load_no_content(upload):
+    text = make_text(5)
+    document_id = upload(text)['document_id']
+
+    restarted = app.DocumentStore(app.app.config['DATABASE_PATH'], app.app.config['DOCUMENT_CACHE_BYTES'])
+    assert document_id in restarted
+    assert str(uuid.uuid4()) not in restarted
+    assert restarted.cache_stats()['contents'] == 0 and restarted.cache_stats()['misses'] == 0
+
+    document = restarted[document_id]
+    assert document['text'] == text
+    assert document['summary'] == app.documents[document_id]['summary']
+    assert_same_index(document['index'], DocumentProcessor.build_index(text))
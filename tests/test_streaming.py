@@ -0,0 +1,30 @@
+"""Checks of streamed batch responses"""
+import json
+import re
+
+from helpers import make_text, make_questions
+
+def streamed(response):
+    """Events of an NDJSON response"""
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_streamed_batches_send_the_same_results_one_event_at_a_time(client, upload):
+    document_id = upload(make_text(27))['document_id']
+    questions = make_questions(27, 5)
+    request = {'document_id': document_id, 'questions': questions}
+
+    answers = client.post('/ask/batch', json=request).get_json()['answers']
+    events = streamed(client.post('/ask/batch', json={**request, 'stream': 'ndjson'}))
+    assert [event['event'] for event in events] == ['answer'] * len(questions) + ['done']
+    assert [event['question_index'] for event in events[:-1]] == list(range(len(questions)))
+    assert [(event['answer'], event['justification']) for event in events[:-1]] == [(answer['answer'], answer['justification']) for answer in answers]
+
+    sse = client.post('/ask/batch', json=request, headers={'Accept': 'text/event-stream'})
+    assert sse.mimetype == 'text/event-stream'
+    assert re.findall(r'^event: (\w+)$', sse.get_data(as_text=True), re.M) == ['answer'] * len(questions) + ['done']
+
+    evaluation = {**request, 'answers': ['The answer mentions ' + question for question in questions]}
+    feedback = client.post('/evaluate', json=evaluation).get_json()['feedback']
+    events = streamed(client.post('/evaluate', json={**evaluation, 'stream': True}))
+    assert [event.pop('event') for event in events] == ['feedback'] * len(questions) + ['done']
+    assert events[:-1] == feedback
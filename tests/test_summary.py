@@ -0,0 +1,18 @@
+"""Checks of centroid summaries"""
+
+import app
+from helpers import make_text
+
+DocumentProcessor = app.DocumentProcessor
+TextAnalyzer = app.TextAnalyzer
+
+def test_summary_respects_max_words_and_matches_a_fresh_summary(client, upload):
+    text = make_text(22, paragraphs=60)
+    uploaded = upload(text)
+    index = DocumentProcessor.build_index(text)
+    assert uploaded['summary'] == TextAnalyzer.generate_summary(text, app.app.config['SUMMARY_MAX_WORDS'], index=index)
+
+    for max_words in (25, 60):
+        summary = client.post('/summary', json={'document_id': uploaded['document_id'], 'max_words': max_words}).get_json()['summary']
+        assert len(summary.split()) <= max_words
+        assert summary == TextAnalyzer.generate_summary(text, max_words, index=DocumentProcessor.build_index(text))
@@ -0,0 +1,14 @@
+"""Checks of workers sharing one store"""
+
+import app
+from helpers import make_text, ask
+
+def test_documents_removed_by_another_worker_leave_this_ones_cache(client, upload):
+    document_id = upload(make_text(20))['document_id']
+    content_hash = app.documents[document_id]['content_hash']
+    assert content_hash in app.documents.cache
+
+    other_worker = app.DocumentStore(app.app.config['DATABASE_PATH'], app.app.config['DOCUMENT_CACHE_BYTES'])
+    del other_worker[document_id]
+    assert ask(client, document_id, 'What is it?') == {'success': False, 'error': 'Document not found'}
+    assert content_hash not in app.documents.cache